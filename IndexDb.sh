@@ -19,6 +19,38 @@ else
     MFEHOME=$(dirname $(which ${0}))
 fi 
 
+usage() {
+    echo Usage:  
+    echo
+    echo     $(basename $0) [-t Threads] [-m Max_memory_MB] [-a Database] Fasta_file [K_value]
+    echo
+    echo Example:  
+    echo
+    echo     $(basename $0) Human.fasta 9
+    echo     $(basename $0) -t 8 -m 4096 Human.fasta 9
+    echo
+    echo     Append the sequences in New.fasta to the indexed database Human.fasta,
+    echo     the K_value of its index is used if not given:
+    echo
+    echo     $(basename $0) -a Human.fasta New.fasta 9
+    echo
+    exit
+}
+
+threads=1
+max_memory=''
+append_db=''
+while getopts "t:m:a:" opt
+do
+    case $opt in
+        t) threads=$OPTARG ;;
+        m) max_memory="-m $OPTARG" ;;
+        a) append_db=$OPTARG ;;
+        *) usage ;;
+    esac
+done
+shift $((OPTIND - 1))
+
 if [ $# == 2 ]
 then
     fasta_file=$1
@@ -26,39 +58,84 @@ then
 elif [ $# == 1 ]
 then
     fasta_file=$1
-    k=9
+    # 9 for a new index, the k of the index for -a
+    k=''
 else
-    echo Usage:  
-    echo
-    echo     $(basename $0) Fasta_file K_value
-    echo
-    echo Example:  
-    echo
-    echo     $(basename $0) Human.fasta 9
-    echo
+    usage
+fi
+
+if [ `getconf LONG_BIT` == 64 ]
+then
+    faToTwoBit=$MFEHOME/bin/$platform/64/faToTwoBit
+else
+    faToTwoBit=$MFEHOME/bin/$platform/32/faToTwoBit
+fi
+
+if [ -n "$append_db" ]
+then
+    echo "Begin appending to $append_db ..."
+
+    if [ ! -f $append_db.idx ] || [ ! -f $append_db.2bit ] || [ ! -f $append_db.uni ]
+    then
+        echo "Error: $append_db is not indexed, only databases with the .idx index can be appended" >&2
+        exit 1
+    fi
+
+    # The new files are written next to the database and replace the old
+    # ones only when all the steps succeed, so a failed append leaves the
+    # database as it was.
+    new_files="$append_db.uni.append $append_db.2bit.append $append_db.idx.append"
+    fail() {
+        rm -f $new_files $fasta_file.unifasta $fasta_file.2bit
+        echo "Error: appending to $append_db failed, the database is not changed" >&2
+        exit 1
+    }
+
+    if [ -n "$k" ]
+    then
+        k_option="-k $k"
+    else
+        k_option=''
+    fi
+
+    $MFEHOME/chilli/UniFastaFormat.py -i $fasta_file -a $append_db -u $append_db.uni.append || fail
+
+    echo "Step 1/3: UniFasta done."
+
+    $faToTwoBit $fasta_file.unifasta $fasta_file.2bit || fail
+    $MFEHOME/chilli/twobit.py -a $append_db.2bit -o $append_db.2bit.append $fasta_file.2bit || fail
+    rm $fasta_file.2bit
+
+    echo "Step 2/3: faToTwoBit done."
+
+    echo "Step 3/3: Index begin ..."
+
+    $MFEHOME/chilli/mfe_index_db.py -f $fasta_file.unifasta $k_option -t $threads $max_memory -a $append_db -o $append_db.idx.append || fail
+
+    mv $append_db.uni.append $append_db.uni && mv $append_db.2bit.append $append_db.2bit && mv $append_db.idx.append $append_db.idx || exit 1
+
+    echo "Step 3/3: Index done"
+
+    rm $fasta_file.unifasta
     exit
 fi
 
+k=${k:-9}
+
 echo "Begin indexing ..."
 
 $MFEHOME/chilli/UniFastaFormat.py -i $fasta_file
 
 echo "Step 1/3: UniFasta done."
 
-if [ `getconf LONG_BIT` == 64 ]
-then
-    $MFEHOME/bin/$platform/64/faToTwoBit $fasta_file.unifasta $fasta_file.2bit
-else
-    $MFEHOME/bin/$platform/32/faToTwoBit $fasta_file.unifasta $fasta_file.2bit
-fi
-
+$faToTwoBit $fasta_file.unifasta $fasta_file.2bit
 
 echo "Step 2/3: faToTwoBit done."
 
 
 echo "Step 3/3: Index begin ..."
 
-$MFEHOME/chilli/mfe_index_db.py -f $fasta_file.unifasta -k $k
+$MFEHOME/chilli/mfe_index_db.py -f $fasta_file.unifasta -k $k -t $threads $max_memory
 
 echo "Step 3/3: Index done"
 
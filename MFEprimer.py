@@ -12,15 +12,25 @@ Version = 'V2.0'
 
 import sys, os
 import time
+import json
 import math
 import textwrap
-import subprocess
-import platform
 import argparse
 from operator import itemgetter
 import sqlite3
 from pprint import pprint
 import shutil
+import multiprocessing
+import heapq
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    # Optional, the sites are paired with bisect
+    numpy = None
 
 from chilli import Seq
 from chilli import SeqCheck
@@ -28,23 +38,18 @@ from chilli import TmDeltaG
 from chilli import chilli
 from chilli import FastaFormatParser
 from chilli import DegenerateSeqConvetor
-
-def get_os():
-    if platform.system() == 'Darwin':
-        return 'mac'
-    else:
-        return 'linux'
-
-def get_bit():
-    return platform.architecture()[0].replace('bit', '')
-
-src_path = os.path.split(os.path.realpath(sys.argv[0]))[0]
-
-bin_path = os.path.join(src_path, 'bin', get_os(), get_bit())
+from chilli import mer_index
+from chilli import twobit
+from chilli import contig_table
+from chilli import stage_stats
+from chilli import external_sort
 
 global degenerate
 degenerate = 'no'
 
+# Stage statistics of the current run, see stage_stats
+stats = stage_stats.StageStats()
+
 nn_mm_data = {
     'GA' : ['GC'],
     'GG' : ['GT', 'GC'],
@@ -56,8 +61,8 @@ nn_mm_data = {
     'AG' : ['AC'],
     }
 
-def get_opt():
-    '''Check and parsing the opts'''
+def get_parser():
+    '''The parser of the command line options'''
     parser = argparse.ArgumentParser(prog='MFEprimer', description='MFEprimer: A fast and thermodynamics-based PCR primer specificity checking program.', usage='%(prog)s.py [options] -i primers.fasta -d Human.genomic.fasta')
     parser.add_argument('-i', '--infile', nargs='?', type=argparse.FileType('r'),
 	    default=sys.stdin, help='[Required] Primer sequences for specificity checking. [File]', required=True)
@@ -69,12 +74,51 @@ def get_opt():
     parser.add_argument('-k', '--k_value', nargs='?', type=int,
 	    default=9, help='[Optional] K value, must be identical to the k value when indexing the database. [Integer]', required=False)
 
+    parser.add_argument('--pairs', nargs='?', type=argparse.FileType('r'),
+	    help='[Optional] Only check the primer pairs in this file, one pair of forward and reverse primer IDs separated by a tab in each line, the amplicons of each primer alone are also checked. [File]', required=False)
+
+    parser.add_argument('--cross_pairs', nargs='?', type=argparse.FileType('r'),
+	    help='[Optional] Also check the primers in this file against each other, for the cross-talk between the pairs, same format as --pairs. [File]', required=False)
+
+    parser.add_argument('--seed_mismatches', nargs='?', type=int,
+	    default=0, help='[Optional] Number of mismatches allowed in the 3\' k-mer for finding the binding sites, 0 or 1, default = 0. [Integer]', required=False)
+
+    parser.add_argument('--seed_protect', nargs='?', type=int,
+	    default=2, help='[Optional] Number of bases at the 3\' end which must match when seed_mismatches is 1, default = 2. [Integer]', required=False)
+
+    parser.add_argument('-j', '--jobs', nargs='?', type=int,
+	    default=1, help='[Optional] Number of databases searched in parallel, default = 1. Can not be used with -t for several databases. [Integer]', required=False)
+
+    parser.add_argument('-t', '--threads', nargs='?', type=int,
+	    default=1, help='[Optional] Number of processes for searching the hits of a database, default = 1. Can not be used with -j for several databases. [Integer]', required=False)
+
     parser.add_argument('--amplicon', action='store_true',
 	    help='[Optional] Produce the amplicons sequence in Fasta format, only works for normal output format (not tabular).')
 
     parser.add_argument('--tab', action='store_true',
 	    help='[Optional] Output in tabular format.')
 
+    parser.add_argument('--max_hits', nargs='?', type=int,
+	    help='[Optional] Only report the best N amplicons, sorted by PPC and size. [Integer]', required=False)
+
+    parser.add_argument('--max_hits_per_pair', nargs='?', type=int,
+	    help='[Optional] Only report the best N amplicons of each pair of primers, sorted by PPC and size. [Integer]', required=False)
+
+    parser.add_argument('--stream', nargs='?', choices=['tab', 'fasta', 'json'],
+	    help='[Optional] Write the amplicons as they are found, in tabular, FASTA or JSON lines format, instead of the whole report at the end.', required=False)
+
+    parser.add_argument('--no_sort', action='store_true',
+	    help='[Optional] Write the streamed amplicons in order of finding, not sorted by PPC and size.')
+
+    parser.add_argument('--sort_buffer', nargs='?', type=int,
+	    default=100000, help='[Optional] Number of streamed amplicons sorted in memory, more are sorted in temporary files, default = 100000. [Integer]', required=False)
+
+    parser.add_argument('--stats', action='store_true',
+	    help='[Optional] Report the time, memory and item counts of each stage at the end of the normal output, or to STDERR for the tabular output.')
+
+    parser.add_argument('--stats_json', nargs='?', type=argparse.FileType('w'),
+	    help='[Optional] Write the time, memory and item counts of each stage to this file in JSON format. [File]', required=False)
+
     parser.add_argument('-v', '--version', action='version', version='%(prog)s 2.0')
 
     filter_group = parser.add_argument_group('Results filter settings:' ,'set these arguments for filtering the results.')
@@ -100,22 +144,60 @@ def get_opt():
     thermo_group.add_argument('--dntp_conc', nargs='?', type=float,
 	    default=0.25, help='[Optional] Concentration of dNTPs [nM], default = 0.25 [Float]', required=False)
 
-    options = parser.parse_args()
+    return parser
+
+def check_options(options):
+    '''Return the error message of illegal option values, None for good ones'''
+    if options.seed_mismatches not in (0, 1):
+	return 'Error: Illegal value for seed_mismatches'
+
+    # seed_protect is only used for the mismatched seeds
+    if options.seed_mismatches > 0 and (options.seed_protect < 1 or options.seed_protect >= options.k_value):
+	return 'Error: Illegal value for seed_protect'
+
+    if options.jobs < 1:
+	return 'Error: Illegal value for jobs'
+
+    if options.threads < 1:
+	return 'Error: Illegal value for threads'
+
+    if options.jobs > 1 and options.threads > 1 and len(options.database) > 1:
+	# The worker processes of -j can not start processes of their own
+	return 'Error: -t can not be used with -j for several databases, use -j to search the databases in parallel or -t to search them one by one with several processes'
+
+    if options.max_hits is not None and options.max_hits < 1:
+	return 'Error: Illegal value for max_hits'
+
+    if options.max_hits_per_pair is not None and options.max_hits_per_pair < 1:
+	return 'Error: Illegal value for max_hits_per_pair'
+
+    if options.sort_buffer < 1:
+	return 'Error: Illegal value for sort_buffer'
+
+    if options.stream and (options.tab or options.amplicon):
+	return 'Error: --tab and --amplicon are not for the streamed output'
+
     if options.ppc < 0 or options.ppc > 100:
-	print 'Error: Illegal value for ppc'
-	exit()
+	return 'Error: Illegal value for ppc'
 
     if options.size_start > options.size_stop or options.size_start < 0:
-	print 'Illegal value for size_start or size_stop'
-	exit()
+	return 'Illegal value for size_start or size_stop'
 
     if options.tm_start > options.tm_stop or options.tm_start < 0:
-	print 'Illegal value for tm_start or tm_stop'
-	exit()
+	return 'Illegal value for tm_start or tm_stop'
 
     if options.dg_start > options.dg_stop or options.dg_start > 0:
-	print 'Illegal value for dg_start or DeltagG_stop'
-	exit()
+	return 'Illegal value for dg_start or DeltagG_stop'
+
+    return None
+
+def get_opt(argv=None):
+    '''Check and parsing the opts, from sys.argv if argv is None'''
+    options = get_parser().parse_args(argv)
+    error = check_options(options)
+    if error:
+	print error
+	sys.exit(1)
 
     return options
 
@@ -133,90 +215,180 @@ def print_head(out, options):
 
     return out
 
-def primer_analysis(product, options, oligos, session_dir, fcdict, db):
-    '''Analysis the candidate forward and reverse primer and check whether they can amplify an amplicon'''
-    mid_seq_id_list = []
+def primer_analysis(candidates, p_scores, m_scores, options, oligos, session_dir, fcdict, twobit_db, keys=None, emit=None):
+    '''Analysis the candidate forward and reverse primer and check whether they can amplify an amplicon.
+    If keys is a list, the (forward primer index, reverse primer index, hid)
+    of each amplicon is appended to it. If emit is given, each amplicon is
+    passed to it instead of the returned amp_list.'''
     tmp_list = []
     amp_list = []
-    filter_product = []
-
-    # Forward primer
-    for i in xrange(len(product)):
-        # Reverse primer
-        #print i
-        amp = product[i]
-        hid = amp['hid']
-        pid = amp['pid']
-        mid = amp['mid']
-        f_len = amp['plen']
-        r_len = amp['mlen']
-        pseq = amp['pseq']
-        mseq = amp['mseq']
-        size = amp['size']
-        f_3_pos = amp['f3_pos'] 
-        r_3_pos = amp['r3_pos']
-
-        p_qseq = amp['p_qseq']
-        p_aseq = amp['p_aseq']
-        p_sseq = amp['p_sseq']
-        p_tail = amp['p_tail']
-
-        m_qseq = amp['m_qseq']
-        m_aseq = amp['m_aseq']
-        m_sseq = amp['m_sseq']
-        m_tail = amp['m_tail']
-
-        p_Tm = amp['p_Tm']
-        p_DeltaG = amp['p_DeltaG']
-        m_Tm = amp['m_Tm']
-        m_DeltaG = amp['m_DeltaG']
-        #print 2*i, 2*i + 1
-        p_3_DeltaG = TmDeltaG.calDeltaG(p_qseq[-5:], Seq.complement(p_sseq[-5:]), mono_conc=options.mono_conc, diva_conc=options.diva_conc, dntp_conc=options.dntp_conc)
-        m_3_DeltaG = TmDeltaG.calDeltaG(m_qseq[:5], Seq.complement(m_sseq[:5]), mono_conc=options.mono_conc, diva_conc=options.diva_conc, dntp_conc=options.dntp_conc)
-
-        # Filter DeltaG
-        if p_3_DeltaG < float(options.dg_start) or p_3_DeltaG > float(options.dg_stop):
-            continue
-        if m_3_DeltaG < float(options.dg_start) or m_3_DeltaG > float(options.dg_stop):
-            continue
-
-        ppc = cal_PPC(len(p_qseq), f_len, len(m_qseq), r_len)
+    mid_spans = []
+
+    for i in xrange(len(candidates)):
+        hid = candidates.hid[i]
+        pi = candidates.pi[i]
+        mi = candidates.mi[i]
+        f_3_pos = candidates.f3_pos[i]
+        r_3_pos = candidates.r3_pos[i]
+        p_site = p_scores[(pi, hid)][1][f_3_pos - 1]
+        m_site = m_scores[(mi, hid)][1][r_3_pos]
+
+        ppc = cal_PPC(len(p_site[0]), oligos[pi]['size'], len(m_site[0]), oligos[mi]['size'])
         # Filter by PPC
         if ppc < options.ppc:
             continue
-        
-        mid_seq_id = '%s:%s-%s' % (hid, f_3_pos, r_3_pos)
-        mid_seq_id_list.append(mid_seq_id)
-
 
+        tmp_list.append((i, ppc, p_site, m_site))
+        mid_spans.append((str(hid), f_3_pos, r_3_pos))
+
+    selection = local_top_hits(options)
+    if selection is not None:
+        # Only the candidates which can be in the best ones are extracted
+        for n in xrange(len(tmp_list)):
+            (i, ppc, p_site, m_site) = tmp_list[n]
+            selection.add(ppc, candidates.size(i, oligos), pair_key(candidates.pi[i], candidates.mi[i]), n)
+        selected = selection.selected()
+        tmp_list = [tmp_list[n] for n in selected]
+        mid_spans = [mid_spans[n] for n in selected]
+
+    mid_seq_buffers = fetch_seq(mid_spans, twobit_db)
+
+    for n in xrange(len(tmp_list)):
+        (i, ppc, p_site, m_site) = tmp_list[n]
+        (p_qseq, p_aseq, p_sseq, p_tail, p_Tm, p_DeltaG, p_3_DeltaG) = p_site
+        (m_qseq, m_aseq, m_sseq, m_tail, m_Tm, m_DeltaG, m_3_DeltaG) = m_site
+        p_oligo = oligos[candidates.pi[i]]
+        m_oligo = oligos[candidates.mi[i]]
         ave_Tm = (p_Tm + m_Tm) / 2 # For sort
-        to_be_added = (ave_Tm, ppc, p_3_DeltaG, m_3_DeltaG)
-        tmp_list.append(to_be_added)
-        filter_product.append(amp)
-
-    mid_seq_list = get_mid_seq(mid_seq_id_list, options, session_dir, db)
-    for i in xrange(len(mid_seq_list)):
-        mid_seq = mid_seq_list[i]
-        (ave_Tm, ppc, p_3_DeltaG, m_3_DeltaG) = tmp_list[i]
-        amp = filter_product[i]
-        pid = amp['pid']
-        mid = amp['mid']
-
-        hid = int(amp['hid'])
-        real_hid = fcdict[str(hid)]['id']
-        hdesc = fcdict[str(hid)]['desc']
-        amp_graphic = draw_graphical_alignment_primer(amp, oligos, options, mid_seq)
-        size = amp['size']
+
+        # Only the amplicons passed all the filters become dicts
+        (hid, f_3_pos, r_3_pos) = mid_spans[n]
+        size = candidates.size(i, oligos)
+        amp = {
+            'hid' : hid,
+            'pid' : p_oligo['id'],
+            'mid' : m_oligo['id'],
+            'plen' : p_oligo['size'],
+            'mlen' : m_oligo['size'],
+            'pseq' : p_oligo['seq'],
+            'mseq' : m_oligo['rc_seq'],
+            'size' : size,
+            'f3_pos' : f_3_pos,
+            'r3_pos' : r_3_pos,
+            'p_qseq' : p_qseq,
+            'p_aseq' : p_aseq,
+            'p_sseq' : p_sseq,
+            'p_tail' : p_tail,
+            'm_qseq' : m_qseq,
+            'm_aseq' : m_aseq,
+            'm_sseq' : m_sseq,
+            'm_tail' : m_tail,
+            'p_Tm' : p_Tm,
+            'p_DeltaG' : p_DeltaG,
+            'm_Tm' : m_Tm,
+            'm_DeltaG' : m_DeltaG,
+        }
+
+        (seq, seq_start) = mid_seq_buffers[n]
+        mid_seq = seq[(f_3_pos - seq_start) : (r_3_pos - seq_start)]
+
+        real_hid = fcdict[hid]['id']
+        hdesc = fcdict[hid]['desc']
+        if options.tab or getattr(options, 'stream', None):
+            # Only the text report has the graphics
+            amp_graphic = None
+        else:
+            amp_graphic = draw_graphical_alignment_primer(amp, oligos, options, mid_seq)
         amp['p_3_DeltaG'] = p_3_DeltaG
         amp['m_3_DeltaG'] = m_3_DeltaG
         amp['real_hid'] = real_hid
         amp['hdesc'] = hdesc
         amp['mid_seq'] = mid_seq
         amp['amp_graphic'] = amp_graphic
-        amp_list.append([ave_Tm, ppc, size, amp])
+        if emit is None:
+            amp_list.append([ave_Tm, ppc, size, amp])
+        else:
+            emit([ave_Tm, ppc, size, amp])
+        if keys is not None:
+            keys.append((candidates.pi[i], candidates.mi[i], candidates.hid[i]))
 
     return amp_list
 
+class TopHits(object):
+    '''Bounded heap selection of the best items by (PPC, size): at most
+    max_per_pair items of each pair, then at most max_hits of them. The
+    items with the smallest order (a tuple of integers, the order of adding
+    by default) win the ties, same as the stable sorting of the outputs.'''
+    def __init__(self, max_hits=None, max_per_pair=None):
+        self.max_hits = max_hits
+        self.max_per_pair = max_per_pair
+        self.heaps = {}
+        self.count = 0
+
+    def add(self, ppc, size, pair, item, order=None):
+        if order is None:
+            order = (self.count,)
+        entry = (ppc, size, tuple([-n for n in order]), item)
+        self.count += 1
+        if self.max_per_pair is None:
+            (pair, limit) = (None, self.max_hits)
+        else:
+            limit = self.max_per_pair
+
+        heap = self.heaps.setdefault(pair, [])
+        if len(heap) < limit:
+            heapq.heappush(heap, entry)
+        elif entry[:3] > heap[0][:3]:
+            heapq.heapreplace(heap, entry)
+
+    def selected(self):
+        '''The selected items in order'''
+        entries = [entry for heap in self.heaps.itervalues() for entry in heap]
+        if self.max_hits is not None and self.max_per_pair is not None:
+            entries = heapq.nlargest(self.max_hits, entries)
+        entries.sort(key=itemgetter(2), reverse=True)
+
+        return [entry[3] for entry in entries]
+
+def pair_key(p_id, m_id):
+    '''The same pair for both primers as forward primer'''
+    return (min(p_id, m_id), max(p_id, m_id))
+
+def top_hits(options):
+    '''TopHits of the --max_hits options, None without limits'''
+    max_hits = getattr(options, 'max_hits', None)
+    max_per_pair = getattr(options, 'max_hits_per_pair', None)
+    if max_hits is None and max_per_pair is None:
+        return None
+
+    return TopHits(max_hits, max_per_pair)
+
+def local_top_hits(options):
+    '''TopHits for a part of the amplicons (a partition or a database).
+    The best amplicons of each pair are also the best ones in the part, but
+    with both limits the best ones after the pair limit may not be, so the
+    global limit is left to the final selection.'''
+    max_hits = getattr(options, 'max_hits', None)
+    max_per_pair = getattr(options, 'max_hits_per_pair', None)
+    if max_per_pair is not None:
+        return TopHits(max_per_pair=max_per_pair)
+    if max_hits is not None:
+        return TopHits(max_hits)
+
+    return None
+
+def select_amp_list(options, amp_list):
+    '''The best amplicons of the amp_list by the --max_hits options'''
+    selection = top_hits(options)
+    if selection is None:
+        return amp_list
+
+    for item in amp_list:
+        (ave_Tm, ppc, size, amp) = item
+        selection.add(ppc, size, pair_key(amp['pid'], amp['mid']), item)
+
+    return selection.selected()
+
 def cal_PPC(f_match, p_len, r_match, m_len):
     '''Cal PPC parameter'''
     ave = (f_match + r_match) / 2
@@ -357,9 +529,8 @@ def format_output_primer(amp_list, oligos, options, start_time, session_dir):
         try:
             out_file = options.outfile.name + '.fa'
             fh = open(out_file, 'w')
-        except:
-            msg = 'Error: can not open %s for write' % out_file
-            print2stderr(msg)
+        except IOError:
+            raise MFEprimerError('Error: can not open %s for write' % out_file)
 
         fh.write(os.linesep.join(fa_file))
         fh.close()
@@ -379,7 +550,15 @@ def print_foot(out, options, start_time):
 
     out.append('Database: '.rjust(42) + textwrap.fill(', '.join([os.path.basename(db) for db in options.database]), 80))
     out.append('Degenerate: '.rjust(42) + degenerate.capitalize())
-    out.append('k value: '.rjust(42) + str(options.k_value) + linesep)
+    if options.pairs is not None:
+        out.append('Primer pairs: '.rjust(42) + str(len(options.pairs)))
+    if options.cross_pairs is not None:
+        out.append('Cross pairs: '.rjust(42) + str(len(options.cross_pairs)))
+    if options.seed_mismatches:
+        out.append('k value: '.rjust(42) + str(options.k_value))
+        out.append('Seed mismatches: '.rjust(42) + '%s (3\' end %s bases protected)%s' % (options.seed_mismatches, options.seed_protect, linesep))
+    else:
+        out.append('k value: '.rjust(42) + str(options.k_value) + linesep)
 
     out.append('Concentration of monovalent cations [mM]: '.rjust(42) + str(options.mono_conc))
     out.append('Concentration of divalent cations [mM]: '.rjust(42) + str(options.diva_conc))
@@ -388,6 +567,10 @@ def print_foot(out, options, start_time):
     out.append('PPC cutoff [%]: '.rjust(42) + str(options.ppc))
     out.append('Size start [bp]: '.rjust(42) + str(options.size_start))
     out.append('Size stop [bp]: '.rjust(42) + str(options.size_stop))
+    if options.max_hits is not None:
+        out.append('Max hits: '.rjust(42) + str(options.max_hits))
+    if options.max_hits_per_pair is not None:
+        out.append('Max hits per pair: '.rjust(42) + str(options.max_hits_per_pair))
 
     out.append(('Tm start [%s]: ' % (u'\u2103')).rjust(41) + str(options.tm_start))
 
@@ -411,6 +594,11 @@ def print_foot(out, options, start_time):
     #full_cmd = ' '.join(sys.argv)
     #out.append('  ' + textwrap.fill(full_cmd, 80))
 
+    if options.stats:
+        out.append(linesep)
+        out.append('Stages:')
+        out.extend(['  ' + line for line in stats.format()])
+
     out.append(linesep)
     if elapsed_time < 1:
         out.append('Time used: ' + '%.2f s' % elapsed_time)
@@ -473,54 +661,15 @@ def draw_graphical_alignment_primer(amp, oligos, options, mid_seq):
 
     return os.linesep.join(lines)
 
-def get_mid_seq(mid_seq_id_list, options, session_dir, db):
-    '''Get the amp sequence using twoBitToFa from Blat suite'''
-    mid_seq_list = []
-    if len(mid_seq_id_list) == 0:
-        return mid_seq_list
-
-    tmp_name = '%s.mid_seq_id_list.txt.tmp' % (os.path.basename(db))
-    mid_seq_id_list_file = os.path.join(session_dir, tmp_name)
-    fh = open(mid_seq_id_list_file, 'w')
-    fh.write(os.linesep.join(mid_seq_id_list))
-    fh.close()
-
-    tmp_name = '%s.twoBitToFa_output.txt.tmp' % (os.path.basename(db))
-    outfile = os.path.join(session_dir, tmp_name)
-    twoBitDB = db + '.2bit'
-
-    cmd = '%s%stwoBitToFa -seqList=%s %s %s' % (bin_path, os.sep, mid_seq_id_list_file, twoBitDB, outfile)
-
-    try:
-        out, err = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-    except:
-        msg = 'Error: twoBitToFa running error.'
-	print msg
-        print2stderr(msg)
-    
-    if err:
-	print err
-        print2stderr(err)
-
-    try:
-        fh = open(outfile)
-    except:
-        msg = 'Error: twoBitToFa running error: no output file produced.'
-	print msg
-        print2stderr(msg)
-
-    records = FastaFormatParser.parse(fh)
-    mid_seq_list = []
-    for record in records:
-        mid_seq_list.append(record['seq'].lower())
-
-    fh.close()
-    return mid_seq_list
-
 def print2stderr(msg):
-    '''Print the error message to STDERR'''
+    '''Print the error message to STDERR and exit with status 1'''
     print >> sys.stderr, msg
-    exit()
+    sys.exit(1)
+
+class MFEprimerError(ValueError):
+    '''Error of the primers, the options or the databases, with the message
+    for the user. Only main() prints it and exits, so check_primers() and
+    the server can handle it.'''
 
 def get_pos_data(data):
     ''''''
@@ -531,201 +680,544 @@ def get_pos_data(data):
 
     return pos_dict
 
-def get_position(options, mer_id, db):
-    '''Get position of the mer from SQLite3 database'''
-    plus_pos = {}
-    minus_pos = {}
+def get_positions_sqlite(options, mer_ids, db, batch_size=500):
+    '''Get positions of the mers from SQLite3 database (old index format)
+    with one connection and a query for each batch of mers'''
+    positions = {}
     dbname = db + '.sqlite3.db'
     conn = sqlite3.connect(dbname)
     cur = conn.cursor()
-    query = "select plus, minus from pos where mer_id=%s" %  mer_id
-    cur.execute(query)
-    try:
-	(plus, minus) = cur.fetchone()
-    except:
-	print "Error found when retrieving position values from indexed database"
-	print "Is the k-value right?"
-	exit()
+    for i in xrange(0, len(mer_ids), batch_size):
+        batch = mer_ids[i : (i+batch_size)]
+        query = "select mer_id, plus, minus from pos where mer_id in (%s)" % ','.join(['?'] * len(batch))
+        cur.execute(query, batch)
+        for (mer_id, plus, minus) in cur:
+            plus_pos = {}
+            minus_pos = {}
+            if plus:
+                plus_pos = get_pos_data(plus)
 
-    if plus:
-	plus_pos = get_pos_data(plus)
+            if minus:
+                minus_pos = get_pos_data(minus)
 
-    if minus:
-	minus_pos = get_pos_data(minus)
+            positions[mer_id] = (plus_pos, minus_pos)
 
     cur.close()
     conn.close()
-    return plus_pos, minus_pos
+
+    if len(positions) != len(mer_ids):
+	raise MFEprimerError('Error found when retrieving position values from indexed database %s, is the k-value right?' % db)
+
+    return positions
+
+def open_index(db):
+    '''Open the binary k-mer index of the database, None for the old SQLite3 index'''
+    index_file = mer_index.index_name(db)
+    if not os.path.isfile(index_file):
+        return None
+
+    try:
+        index = mer_index.MerIndex(index_file)
+    except (IOError, ValueError), e:
+        raise MFEprimerError('Error: can not open the index file %s: %s' % (index_file, e))
+
+    return index
+
+def check_index(options, db, index):
+    '''The k-value must be the one of the index'''
+    if index is not None and index.k != options.k_value:
+        raise MFEprimerError('Error: the database %s was indexed with k = %s, is the k-value right?' % (db, index.k))
+
+class Database(object):
+    '''The contig table, the k-mer index and the .2bit file of a database'''
+    def __init__(self, db):
+        self.name = db
+        try:
+            self.fcdict = contig_table.load(db + '.uni')
+        except (IOError, ValueError), e:
+            raise MFEprimerError('Error: can not open the database %s: %s' % (db, e))
+        self.index = open_index(db)
+        self.twobit = open_twobit(db)
+        self.dg3_tables = OrderedDict()
+
+    def dg3_table(self, options):
+        '''3' DeltaG table of the concentrations, the tables of the last
+        MAX_DG3_TABLES concentrations are kept'''
+        key = dg3_key(options)
+        if key in self.dg3_tables:
+            table = self.dg3_tables.pop(key)
+        else:
+            table = open_dg3_table(options, self.name)
+            if len(self.dg3_tables) >= MAX_DG3_TABLES:
+                self.dg3_tables.popitem(last=False)
+        self.dg3_tables[key] = table
+
+        return table
+
+    def close(self):
+        if isinstance(self.fcdict, contig_table.ContigTable):
+            self.fcdict.close()
+        if self.index is not None:
+            self.index.close()
+        self.twobit.close()
+
+# Databases kept open between the searches, {name : Database}, see load_databases
+resident_databases = {}
+
+def load_databases(dbs):
+    '''Open the databases and keep them for the following searches'''
+    for db in dbs:
+        if db not in resident_databases:
+            resident_databases[db] = Database(db)
+
+def get_positions(options, mer_ids, db, index=None):
+    '''Get positions of the mers from the indexed database, return
+    {mer_id : (plus positions, minus positions)}'''
+    mer_ids = sorted(set(mer_ids))
+    if index is None:
+        return get_positions_sqlite(options, mer_ids, db)
+
+    positions = {}
+    for mer_id in mer_ids:
+        plus, minus = index.lookup(mer_id)
+        positions[mer_id] = (mer_index.decode(plus), mer_index.decode(minus))
+
+    return positions
+
+def get_site_arrays(options, mer_ids, db, index=None):
+    '''Same as get_positions, the positions of each hit are in the form
+    used by pair_sites'''
+    positions = get_positions(options, mer_ids, db, index)
+    for mer_id, pos_dicts in positions.items():
+        for pos_dict in pos_dicts:
+            for seq_id in pos_dict:
+                pos_dict[seq_id] = site_array(pos_dict[seq_id])
+
+    return positions
 
 def check_infile(options):
     '''Check and return Oligos'''
-    err_or_degenerate = SeqCheck.fasta_format_check(options.infile)
+    # The error is returned instead of printed with exit status 0
+    err_or_degenerate = SeqCheck.fasta_format_check(options.infile, err_path=None)
     if err_or_degenerate in ['yes', 'no']:
 	global degenerate
 	degenerate = err_or_degenerate
     else:
-	print2stderr(err_or_degenerate)
+	raise MFEprimerError(err_or_degenerate.replace('<br />', os.linesep))
 
     options.infile.seek(0)
+    oligos = parse_oligos(options.infile, degenerate)
+    options.infile.close()
 
-    if degenerate == 'no':
-        oligos = FastaFormatParser.parse(options.infile)
-    else:
-        oligos = DegenerateSeqConvetor.convert(FastaFormatParser.parse(options.infile))
+    return oligos
 
-    options.infile.close()
+def parse_oligos(fh, degenerate='no'):
+    '''Oligos of the primers in FASTA format (a file or a list of lines).
+    A degenerate primer is one oligo, only its 3' mer is expanded for the
+    index and each binding site is scored with its best matching variant.'''
+    oligos = FastaFormatParser.parse(fh)
+    for oligo in oligos:
+        if degenerate == 'no':
+            oligo['degenerate'] = False
+        else:
+            # Inosine pairs with any base, same as N
+            oligo['seq'] = oligo['seq'].replace('i', 'n')
+            oligo['degenerate'] = DegenerateSeqConvetor.is_degenerate(oligo['seq'])
 
     return oligos
 
-def primer_process(options, session_dir, fcdict, db, oligos):
-    '''Primer Process'''
-    #options.processor = int(options.processor)
-    oligo_pos = []
-    oligo_id_list = []
-    #t1 = time.time()
+def get_oligo_pos(options, database, oligos):
+    '''Positions of the 3' mer of each primer, [{'p_list' : {hid : plus
+    positions}, 'm_list' : {hid : minus positions}}, ...]'''
+    oligo_mer_ids = []
     for oligo in oligos:
         primer_seq = oligo['seq']
-        oligo_id_list.append(oligo['id'])
-
-        #mer = primer_seq[-options.k:]
         mer = primer_seq[-options.k_value:]
-        mer_id = chilli.DNA2int(mer)
+        if oligo['degenerate']:
+            mers = DegenerateSeqConvetor.iupac2normal(mer)
+        else:
+            mers = [mer]
+        mer_ids = [chilli.DNA2int(mer) for mer in mers]
+
+        if options.seed_mismatches:
+            # The neighbors of the variants may be variants or shared
+            seed_ids = set(mer_ids)
+            for mer_id in mer_ids:
+                seed_ids.update(mer_neighbors(mer_id, options.k_value, options.seed_protect))
+            mer_ids = sorted(seed_ids)
+        oligo_mer_ids.append(mer_ids)
+
+    # The primers with the same 3' mer share the positions, all the mers
+    # are read from the index in one pass
+    with stats.stage('index lookup') as counts:
+        check_index(options, database.name, database.index)
+        positions = get_site_arrays(options, [mer_id for mer_ids in oligo_mer_ids for mer_id in mer_ids], database.name, database.index)
+        counts['mers'] = len(positions)
 
+    oligo_pos = []
+    for mer_ids in oligo_mer_ids:
         # p for plus strand, m for minus strand
-        p_pos_list, m_pos_list = get_position(options, mer_id, db)
-
+        if len(mer_ids) == 1:
+            p_pos_list, m_pos_list = positions[mer_ids[0]]
+        else:
+            p_pos_list = merge_sites([positions[mer_id][0] for mer_id in mer_ids])
+            m_pos_list = merge_sites([positions[mer_id][1] for mer_id in mer_ids])
         oligo_pos.append({
             'p_list' : p_pos_list,
             'm_list' : m_pos_list,
         })
 
-    #t2 = time.time()
-    #cost = t2 - t1
-    #print cost
-
-    product = []
-    binding_range = []
-    binding_primer = []
+    return oligo_pos
+
+def mer_neighbors(mer_id, k, protect):
+    '''mer_ids of the 3 * (k - protect) mers with one mismatch to the mer,
+    the last protect bases (3' end) are not changed'''
+    neighbors = []
+    for n in xrange(protect, k):
+        # The n-th base from the 3' end
+        weight = 4**n
+        code = (mer_id // weight) % 4
+        base = mer_id - code * weight
+        for other in xrange(4):
+            if other != code:
+                neighbors.append(base + other * weight)
+
+    return neighbors
+
+def merge_sites(pos_dicts):
+    '''Merge the {hid : positions} of the 3' mers of a primer (variants of
+    a degenerate primer or seed neighbors), a position is found by one mer
+    only'''
+    merged = {}
+    for pos_dict in pos_dicts:
+        for hid, pos_list in pos_dict.iteritems():
+            merged.setdefault(hid, []).append(pos_list)
+
+    for hid, pos_lists in merged.iteritems():
+        if len(pos_lists) == 1:
+            merged[hid] = pos_lists[0]
+        elif numpy is None:
+            merged[hid] = sorted([pos for pos_list in pos_lists for pos in pos_list])
+        else:
+            merged[hid] = numpy.sort(numpy.concatenate(pos_lists))
+
+    return merged
+
+def primer_process(options, oligos, oligo_pos, twobit_db, dg3_table, hids=None):
+    '''Primer Process, return the candidate products and the scores of
+    their forward and reverse binding sites, only in the hits of hids if
+    given'''
+    # Each binding site is scored once, only the passed ones are paired
+    with stats.stage('pairable sites') as counts:
+        (p_sites, m_sites) = find_pairable_sites(options, oligos, oligo_pos, hids)
+        counts['forward'] = sum([len(pos_list) for pos_list in p_sites.itervalues()])
+        counts['reverse'] = sum([len(pos_list) for pos_list in m_sites.itervalues()])
+    p_scores = score_sites(options, oligos, p_sites, 'forward', twobit_db, dg3_table)
+    m_scores = score_sites(options, oligos, m_sites, 'reverse', twobit_db, dg3_table)
+
+    with stats.stage('pairing') as counts:
+        candidates = Candidates()
+        for i in xrange(len(oligos)):
+            p_list = oligo_pos[i]['p_list']
+            p_oligo_length = oligos[i]['size']
+            for k in partners(oligos, i):
+                m_oligo_length = oligos[k]['size']
+                (low, high) = pair_window(options, p_oligo_length, m_oligo_length)
+
+                for j in p_list.iterkeys():
+                    try:
+                        p_pos = p_scores[(i, j)][0]
+                        m_pos = m_scores[(k, j)][0]
+                    except KeyError:
+                        continue
+
+                    (p_pairs, r_pairs) = pair_sites(p_pos, m_pos, low, high)
+                    if r_pairs:
+                        candidates.extend(j, i, k, [p + 1 for p in p_pairs], r_pairs)
+        counts['candidates'] = len(candidates)
+
+    return candidates, p_scores, m_scores
+
+def pair_window(options, p_oligo_length, m_oligo_length):
+    '''The reverse site r of a forward site p is in [p + low, p + high]'''
+    # product size = p.len + m.len - 1 + r - p, and r > p + 1
+    low = max(2, options.size_start - p_oligo_length - m_oligo_length + 1)
+    high = options.size_stop - p_oligo_length - m_oligo_length + 1
+    return low, high
+
+def find_pairable_sites(options, oligos, oligo_pos, hids=None):
+    '''Find the binding sites with at least one partner in the size range,
+    return {(oligo index, hid) : positions} for the forward and the
+    reverse sites, only in the hits of hids if given'''
+    p_masks = {}
+    m_masks = {}
     for i in xrange(len(oligos)):
         p_list = oligo_pos[i]['p_list']
-        p_oligo_length = oligos[i]['size']
-        for k in xrange(len(oligos)):
+        for k in partners(oligos, i):
             m_list = oligo_pos[k]['m_list']
-            m_oligo_length = oligos[k]['size']
-
+            (low, high) = pair_window(options, oligos[i]['size'], oligos[k]['size'])
             for j in p_list.iterkeys():
-                hid = str(j) # Because the database has been re-formated
-                try:
-                    p_pos = p_list[j]
-                    m_pos = m_list[j]
-                except:
+                if j not in m_list or (hids is not None and j not in hids):
                     continue
 
-                for p in p_pos:
-                    left = get_pos_range(p, m_pos)
-                    for pos_index in xrange(left, len(m_pos)):
-			f3_pos = p+1
-			r3_pos = m_pos[pos_index]
-
-                        # The amplicon size <= p.len + m.len
-			if f3_pos >= r3_pos:
-			    continue
-
-                        product_size = p_oligo_length + m_pos[pos_index] - p + m_oligo_length - 1
-
-                        if product_size < options.size_start:
-                            continue
-                        if product_size > options.size_stop:
-                            break
-
-                        p_start = p - p_oligo_length + 1
-                        if p_start < 0:
-                            p_start = 0
-
-                        m_stop = r3_pos + m_oligo_length
-                        if m_stop > fcdict[hid]['size']:
-                            m_stop = fcdict[hid]['size'] 
-
-                        binding_range.append('%s:%s-%s' % (hid, p_start, p + 1))
-                        # Reverse: Correction for reverse
-                        binding_range.append('%s:%s-%s' % (hid, r3_pos, m_stop))
-
-                        amp = {
-                            'hid' : hid,
-                            'pid' : oligos[i]['id'],
-                            'mid' : oligos[k]['id'],
-                            'plen' : p_oligo_length,
-                            'mlen' : m_oligo_length,
-                            'pseq' : oligos[i]['seq'],
-                            'mseq' : Seq.rev_com(oligos[k]['seq']),
-                            'size' : product_size,
-                            'f3_pos' : f3_pos,
-                            'r3_pos' : r3_pos,
-                        }
-
-                        product.append(amp)
-
-    return product, binding_range
-
-def get_pos_range(value, list_com):
-    '''Based on Binary Search'''
-    left = 0
-    right = len(list_com) - 1
-    #print list_com
-    if right == 1:
-        return left
-    while (left < right):
-        mid = (left + right) // 2
-        #print mid, left, right
-        if value == list_com[mid]:
-            left = right = mid
-        elif value > list_com[mid]:
-            left = mid + 1
-        else: 
-            right = mid
-
-    return left
-
-def extract_by_twoBitToFa(id_pos_range_list, options, session_dir, db):
-    '''Get the amp sequence using twoBitToFa from Blat suite'''
-    seq_list = []
-    if len(id_pos_range_list) == 0:
-        return seq_list
-
-    tmp_name = '%s.id_pos_range_list.txt.tmp' % (os.path.basename(db))
-    id_pos_range_list_file = os.path.join(session_dir, tmp_name)
-    fh = open(id_pos_range_list_file, 'w')
-    fh.write(os.linesep.join(id_pos_range_list))
-    fh.close()
-
-    tmp_name = '%s.twoBitToFa_output.txt.tmp' % (os.path.basename(db))
-    outfile = os.path.join(session_dir, tmp_name)
-    twoBitDB = db + '.2bit'
-
-    cmd = '%s%stwoBitToFa -seqList=%s %s %s' % (bin_path, os.sep, id_pos_range_list_file, twoBitDB, outfile)
-
+                p_pos = p_list[j]
+                m_pos = m_list[j]
+                if (i, j) not in p_masks:
+                    p_masks[(i, j)] = new_mask(len(p_pos))
+                if (k, j) not in m_masks:
+                    m_masks[(k, j)] = new_mask(len(m_pos))
+
+                mark_pairable(p_pos, m_pos, low, high, p_masks[(i, j)], m_masks[(k, j)])
+
+    p_sites = {}
+    for (i, j), mask in p_masks.iteritems():
+        p_sites[(i, j)] = select_sites(oligo_pos[i]['p_list'][j], mask)
+
+    m_sites = {}
+    for (k, j), mask in m_masks.iteritems():
+        m_sites[(k, j)] = select_sites(oligo_pos[k]['m_list'][j], mask)
+
+    return p_sites, m_sites
+
+def score_sites(options, oligos, sites, primer_type, twobit_db, dg3_table):
+    '''Align and score each binding site once, return {(oligo index, hid) :
+    (positions passed the Tm and 3' DeltaG filters, {position : site})},
+    site is (qseq, aseq, sseq, tail, Tm, DeltaG, 3' DeltaG)'''
+    with stats.stage('site fetch') as counts:
+        keys = []
+        spans = []
+        for (i, j) in sorted(sites.iterkeys()):
+            hid = str(j)
+            oligo_length = oligos[i]['size']
+            for pos in sites[(i, j)]:
+                if primer_type == 'forward':
+                    # Plus strand position is the 3' end of the mer
+                    start = pos + 1 - oligo_length
+                    if start < 0:
+                        start = 0
+                    spans.append((hid, start, pos + 1))
+                else:
+                    stop = pos + oligo_length
+                    if stop > twobit_db.size(hid):
+                        stop = twobit_db.size(hid)
+                    spans.append((hid, pos, stop))
+                keys.append((i, j, pos))
+
+        seq_buffers = fetch_seq(spans, twobit_db)
+        counts['sites'] = len(keys)
+
+    with stats.stage('alignment') as counts:
+        alignments = []
+        for n in xrange(len(keys)):
+            (i, j, pos) = keys[n]
+            (hid, start, stop) = spans[n]
+            (seq, seq_start) = seq_buffers[n]
+            ts = seq[(start - seq_start) : (stop - seq_start)] # target sequence
+            if primer_type == 'forward':
+                oligo_seq = oligos[i]['seq']
+            else:
+                oligo_seq = oligos[i]['rc_seq']
+
+            if oligos[i]['degenerate']:
+                # The target sequence is shorter at the ends of the hit
+                padding = 'n' * (len(oligo_seq) - len(ts))
+                if primer_type == 'forward':
+                    oligo_seq = DegenerateSeqConvetor.best_variant(oligo_seq, padding + ts)
+                else:
+                    oligo_seq = DegenerateSeqConvetor.best_variant(oligo_seq, ts + padding)
+
+            alignments.append(align_site(oligo_seq, ts, primer_type))
+        counts['sites'] = len(alignments)
+
+    with stats.stage('thermodynamics') as counts:
+        # Tm and DeltaG of all the sites in one batch, 3' DeltaG from the table
+        thermo = TmDeltaG.BatchCal(mono_conc=options.mono_conc, diva_conc=options.diva_conc, oligo_conc=options.oligo_conc, dntp_conc=options.dntp_conc)
+        (Tm_list, DeltaG_list) = thermo.calTmDeltaG([qseq for (qseq, aseq, sseq, tail) in alignments], [Seq.complement(sseq) for (qseq, aseq, sseq, tail) in alignments])
+
+        scores = {}
+        for n in xrange(len(keys)):
+            if Tm_list[n] < float(options.tm_start) or Tm_list[n] > float(options.tm_stop):
+                continue
+
+            (qseq, aseq, sseq, tail) = alignments[n]
+            if primer_type == 'forward':
+                DeltaG_3 = dg3_table.get(qseq[-5:], sseq[-5:])
+            else:
+                DeltaG_3 = dg3_table.get(qseq[:5], sseq[:5])
+
+            # Filter DeltaG
+            if DeltaG_3 < float(options.dg_start) or DeltaG_3 > float(options.dg_stop):
+                continue
+
+            (i, j, pos) = keys[n]
+            site = (qseq, aseq, sseq, tail, Tm_list[n], DeltaG_list[n], DeltaG_3)
+            if (i, j) not in scores:
+                scores[(i, j)] = ([], {})
+            scores[(i, j)][0].append(pos)
+            scores[(i, j)][1][pos] = site
+        counts['sites'] = len(keys)
+        counts['passed'] = sum([len(positions) for (positions, site_dict) in scores.itervalues()])
+
+    for key, (positions, site_dict) in scores.items():
+        scores[key] = (site_array(positions), site_dict)
+
+    return scores
+
+class Candidates(object):
+    '''Candidate products in parallel arrays, the primers are referenced by
+    their index in oligos and the hits by the numeric id'''
+    __slots__ = ('hid', 'pi', 'mi', 'f3_pos', 'r3_pos')
+
+    def __init__(self):
+        self.hid = array('I')
+        self.pi = array('I') # Forward primer
+        self.mi = array('I') # Reverse primer
+        self.f3_pos = array('I')
+        self.r3_pos = array('I')
+
+    def __len__(self):
+        return len(self.hid)
+
+    def extend(self, hid, pi, mi, f3_pos_list, r3_pos_list):
+        '''Add the products of the primer pair on the hit'''
+        count = len(f3_pos_list)
+        self.hid.extend(array('I', [hid]) * count)
+        self.pi.extend(array('I', [pi]) * count)
+        self.mi.extend(array('I', [mi]) * count)
+        self.f3_pos.extend(f3_pos_list)
+        self.r3_pos.extend(r3_pos_list)
+
+    def size(self, i, oligos):
+        '''Amplicon size of the product'''
+        return oligos[self.pi[i]]['size'] + oligos[self.mi[i]]['size'] + self.r3_pos[i] - self.f3_pos[i]
+
+
+def site_array(pos_list):
+    '''Sorted positions in the form used by pair_sites'''
+    if numpy is None:
+        return pos_list
+
+    return numpy.array(pos_list, dtype=numpy.int64)
+
+def new_mask(size):
+    '''All False mask for the sites'''
+    if numpy is None:
+        return [False] * size
+
+    return numpy.zeros(size, dtype=bool)
+
+def select_sites(pos_list, mask):
+    '''The positions marked in the mask'''
+    if numpy is None:
+        return [pos for pos, keep in zip(pos_list, mask) if keep]
+
+    return pos_list[mask].tolist()
+
+def pair_bounds(p_pos, m_pos, low, high):
+    '''The reverse sites paired with p_pos[i] are m_pos[starts[i] : stops[i]],
+    for the sorted sites of a hit with p + low <= r <= p + high'''
+    if numpy is None:
+        starts = [bisect_left(m_pos, p + low) for p in p_pos]
+        stops = [bisect_right(m_pos, p + high) for p in p_pos]
+        return starts, stops
+
+    starts = m_pos.searchsorted(p_pos + low, 'left')
+    stops = m_pos.searchsorted(p_pos + high, 'right')
+    return starts, numpy.maximum(stops, starts)
+
+def mark_pairable(p_pos, m_pos, low, high, p_mask, m_mask):
+    '''Mark the forward and reverse sites which have a partner'''
+    (starts, stops) = pair_bounds(p_pos, m_pos, low, high)
+    if numpy is None:
+        # starts and stops are increasing, so sweep the covered reverse sites
+        covered = 0
+        for n in xrange(len(starts)):
+            if starts[n] < stops[n]:
+                p_mask[n] = True
+                for x in xrange(max(starts[n], covered), stops[n]):
+                    m_mask[x] = True
+                covered = max(covered, stops[n])
+        return
+
+    paired = stops > starts
+    p_mask |= paired
+    depth = numpy.zeros(len(m_pos) + 1, dtype=numpy.int64)
+    numpy.add.at(depth, starts[paired], 1)
+    numpy.add.at(depth, stops[paired], -1)
+    m_mask |= numpy.cumsum(depth)[:-1] > 0
+
+def pair_sites(p_pos, m_pos, low, high):
+    '''Pair the sorted forward sites p and reverse sites r of a hit with
+    p + low <= r <= p + high, return the lists of p and r of the pairs in
+    order of p, r'''
+    (starts, stops) = pair_bounds(p_pos, m_pos, low, high)
+    if numpy is None:
+        p_pairs = []
+        r_pairs = []
+        for n in xrange(len(starts)):
+            if starts[n] < stops[n]:
+                p_pairs.extend([p_pos[n]] * (stops[n] - starts[n]))
+                r_pairs.extend(m_pos[starts[n]:stops[n]])
+
+        return p_pairs, r_pairs
+
+    counts = stops - starts
+    total = counts.sum()
+    if not total:
+        return [], []
+
+    # The reverse sites of each p are m_pos[starts[i] : stops[i]]
+    first = numpy.cumsum(counts) - counts
+    r_index = numpy.arange(total) + numpy.repeat(starts - first, counts)
+    return numpy.repeat(p_pos, counts).tolist(), m_pos[r_index].tolist()
+
+def open_twobit(db):
+    '''Open the .2bit file of the database'''
+    twobit_file = db + '.2bit'
     try:
-        out, err = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-    except:
-        msg = 'Error: twoBitToFa running error.'
-        print2stderr(msg)
-    
-    if err:
-        print2stderr(err)
-
+        return twobit.TwoBit(twobit_file)
+    except (IOError, ValueError), e:
+        raise MFEprimerError('Error: can not open %s: %s' % (twobit_file, e))
+
+# 3' DeltaG tables (8 MB each) kept by a Database for different concentrations
+MAX_DG3_TABLES = 4
+
+def dg3_key(options):
+    '''(mono_conc, diva_conc, dntp_conc) of the 3' DeltaG table'''
+    return (float(options.mono_conc), float(options.diva_conc), float(options.dntp_conc))
+
+def default_dg3_key():
+    '''dg3_key of the default concentrations of the options'''
+    parser = get_parser()
+    return tuple([float(parser.get_default(name)) for name in ('mono_conc', 'diva_conc', 'dntp_conc')])
+
+# Only the table of the default concentrations is cached
+DEFAULT_DG3_KEY = default_dg3_key()
+
+def dg3_cache_name(options, db):
+    '''Cache file of the 3' DeltaG table next to the index, only for the
+    default concentrations, so other values do not fill the directory.
+    None for the other concentrations.'''
+    key = dg3_key(options)
+    if key != DEFAULT_DG3_KEY:
+        return None
+
+    return '%s.dg3_%s_%s_%s' % ((db,) + key)
+
+def open_dg3_table(options, db):
+    '''3' DeltaG table of the concentrations, cached next to the index for
+    the default ones'''
+    cache_file = dg3_cache_name(options, db)
+    return TmDeltaG.DeltaG3Table(mono_conc=options.mono_conc, diva_conc=options.diva_conc, dntp_conc=options.dntp_conc, cache_file=cache_file)
+
+def fetch_seq(spans, twobit_db):
+    '''Fetch the (hid, start, stop) spans in lower case, the overlapping
+    spans of a hit are read only once. Return a (seq, seq_start) buffer
+    for each span.'''
     try:
-        fh = open(outfile)
-    except:
-        msg = 'Error: twoBitToFa running error: no output file produced.'
-        print2stderr(msg)
-
-    records = FastaFormatParser.parse(fh)
-    seq_list = []
-    for record in records:
-        seq_list.append(record['seq'].lower())
-
-    fh.close()
-    return seq_list
+        return twobit_db.fetch_spans(spans, lower=True)
+    except (KeyError, ValueError), e:
+        raise MFEprimerError('Error: %s' % e)
 
 def Thermodynamics_alignment(fp, ts, primer_type):
     '''Alignment'''
@@ -766,151 +1258,565 @@ def Thermodynamics_alignment(fp, ts, primer_type):
     else:
         return aseq
 
-def get_align_seq(seq_list, options, product):
-    '''Alignment seq'''
-    filter_product = []
-    for i in xrange(len(product)):
-        amp = product[i]
-        pseq = amp['pseq']
-        mseq = amp['mseq']
-        pts = seq_list[2*i] # Forward primer target sequence
-        mts = seq_list[2*i+1] # Reverse primer target sequence
-        # ts for target sequence
-        #p_aseq = Watson_Click_alignment(pseq, pts, 'forward')
-        p_aseq = Thermodynamics_alignment(pseq, pts, 'forward')
-        p_aseq_len = len(p_aseq)
-        p_qseq = pseq[-p_aseq_len:].upper()
-        p_sseq = pts[-p_aseq_len:].upper()
-        p_tail = pseq[:-p_aseq_len]
-
-        p_thermo =  TmDeltaG.Cal(p_qseq, Seq.complement(p_sseq), mono_conc=options.mono_conc, diva_conc=options.diva_conc, dntp_conc=options.dntp_conc, oligo_conc=options.oligo_conc)
-        p_DeltaG = p_thermo.DeltaG
-        p_Tm = p_thermo.Tm
-        if p_Tm < float(options.tm_start) or p_Tm > float(options.tm_stop):
-            continue
-
-        #m_aseq = Watson_Click_alignment(mseq, mts, 'reverse')
-        m_aseq = Thermodynamics_alignment(mseq, mts, 'reverse')
-        m_aseq_len = len(m_aseq)
-
-        m_qseq = mseq[:m_aseq_len].upper()
-        m_sseq = mts[:m_aseq_len].upper()
-        r_len = amp['mlen']
-        if m_aseq_len == r_len:
-            m_tail = ''
+def align_site(oligo_seq, ts, primer_type):
+    '''Align the primer (reverse complement for the reverse primer) to the
+    target sequence ts of the binding site, return (qseq, aseq, sseq, tail)'''
+    aseq = Thermodynamics_alignment(oligo_seq, ts, primer_type)
+    aseq_len = len(aseq)
+    if primer_type == 'forward':
+        qseq = oligo_seq[-aseq_len:].upper()
+        sseq = ts[-aseq_len:].upper()
+        tail = oligo_seq[:-aseq_len]
+    else:
+        qseq = oligo_seq[:aseq_len].upper()
+        sseq = ts[:aseq_len].upper()
+        if aseq_len == len(oligo_seq):
+            tail = ''
         else:
-            m_tail = mseq[m_aseq_len:]
+            tail = oligo_seq[aseq_len:]
+
+    return qseq, aseq, sseq, tail
+
+class Amplicon(object):
+    '''An amplicon of the results, the attributes are the same as the
+    records of chilli.MFEprimerParser plus hit_desc, database, the 3' end
+    DeltaG of the primers and the binding start and stop on the hit'''
+    __slots__ = ('id', 'fp_id', 'rp_id', 'hit_id', 'hit_desc', 'database', 'ppc', 'size', 'gc', 'fp_tm', 'rp_tm', 'fp_dg', 'rp_dg', 'fp_3_dg', 'rp_3_dg', 'start', 'stop', 'seq')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields[name])
+
+    def __repr__(self):
+        return '<Amplicon %s: %s, %s on %s, %s bp>' % (self.id, self.fp_id, self.rp_id, self.hit_id, self.size)
+
+def new_amplicon(amp, ppc, amp_id=None):
+    '''Amplicon of an amp dict of the amp_list'''
+    # p for plus, m for minus primer # History reason
+    amp_len = amp['size']
+    amp_seq = amp['p_tail'] + amp['p_qseq'] + amp['mid_seq'] + amp['m_qseq'] + amp['m_tail']
+    return Amplicon(
+            id = amp_id,
+            fp_id = amp['pid'],
+            rp_id = amp['mid'],
+            hit_id = amp['real_hid'],
+            hit_desc = amp['hdesc'],
+            database = amp.get('db'),
+            ppc = ppc,
+            size = amp_len,
+            gc = chilli.cal_GC_content(amp_seq, + amp_len),
+            fp_tm = amp['p_Tm'],
+            rp_tm = amp['m_Tm'],
+            fp_dg = amp['p_DeltaG'],
+            rp_dg = amp['m_DeltaG'],
+            fp_3_dg = amp['p_3_DeltaG'],
+            rp_3_dg = amp['m_3_DeltaG'],
+            start = amp['f3_pos'] - len(amp['p_aseq']) + 1,
+            stop = amp['r3_pos'] + len(amp['m_aseq']),
+            seq = amp_seq,
+        )
+
+def get_amplicons(amp_list):
+    '''Sort the amp_list as the output and return the Amplicons'''
+    amp_list.sort(key=itemgetter(1, 2), reverse=True)
+    amplicons = []
+    for ave_Tm, ppc, amp_len, amp in amp_list:
+        amplicons.append(new_amplicon(amp, ppc, len(amplicons) + 1))
 
-        m_thermo =  TmDeltaG.Cal(m_qseq, Seq.complement(m_sseq), mono_conc=options.mono_conc, diva_conc=options.diva_conc, dntp_conc=options.dntp_conc, oligo_conc=options.oligo_conc)
-        m_DeltaG = m_thermo.DeltaG
-        m_Tm = m_thermo.Tm
-        if m_Tm < float(options.tm_start) or m_Tm > float(options.tm_stop):
-            continue
+    return amplicons
 
-        amp['p_qseq'] = p_qseq
-        amp['p_aseq'] = p_aseq
-        amp['p_sseq'] = p_sseq
-        amp['p_tail'] = p_tail
+def tab_out(amp_list, oligos, options, start_time, session_dir):
+    '''Format output in primer task'''
+    # amp_id, fp_id, rp_id, ppc, size, gc, fp_tm, fp_dg, rp_tm, rp_dg, seq, hit_id
+    options.outfile.write(TAB_HEADER)
+    for amp in get_amplicons(amp_list):
+	options.outfile.write(tab_line(amp))
 
-        amp['m_qseq'] = m_qseq
-        amp['m_aseq'] = m_aseq
-        amp['m_sseq'] = m_sseq
-        amp['m_tail'] = m_tail
+TAB_HEADER = "AmpID\tFpID\tRpID\tHitID\tPPC\tSize\tAmpGC\tFpTm\tRpTm\tFpDg\tRpDg\tBindingStart\tBindingStop\tAmpSeq\n"
 
-        amp['p_Tm'] = p_Tm
-        amp['p_DeltaG'] = p_DeltaG
-        amp['m_Tm'] = m_Tm
-        amp['m_DeltaG'] = m_DeltaG
-        filter_product.append(amp)
+def tab_line(amp):
+    '''Line of the Amplicon in the tabular output'''
+    if amp.fp_id == amp.rp_id:
+        ppc = '-%.1f' % amp.ppc
+    else:
+        ppc = '%.1f' % amp.ppc
 
-    return filter_product
+    return "%d\t%s\t%s\t%s\t%s\t%d\t%.2f\t%.2f\t%.2f\t%.2f\t%.2f\t%d\t%d\t%s\n" % (amp.id, amp.fp_id, amp.rp_id, amp.hit_id, ppc, amp.size, amp.gc, amp.fp_tm, amp.rp_tm, amp.fp_dg, amp.rp_dg, amp.start, amp.stop, amp.seq)
 
-def tab_out(amp_list, oligos, options, start_time, session_dir):
-    '''Format output in primer task'''
-    # amp_id, fp_id, rp_id, ppc, size, gc, fp_tm, fp_dg, rp_tm, rp_dg, seq, hit_id
-    options.outfile.write("AmpID\tFpID\tRpID\tHitID\tPPC\tSize\tAmpGC\tFpTm\tRpTm\tFpDg\tRpDg\tBindingStart\tBindingStop\tAmpSeq\n")
-    sn = 0
-    amp_list.sort(key=itemgetter(1, 2), reverse=True)
-    for ave_Tm, ppc, amp_len, amp in amp_list:
-        sn = sn + 1
+def fasta_record(amp):
+    '''Record of the Amplicon in FASTA format, same as the --amplicon file'''
+    if not amp.hit_desc:
+        fa_desc = '>%s %s + %s %s' % (amp.id, amp.fp_id, amp.rp_id, amp.hit_id)
+    else:
+        fa_desc = '>%s %s %s %s %s' % (amp.id, amp.fp_id, amp.rp_id, amp.hit_id, amp.hit_desc)
+
+    return fa_desc + os.linesep + chilli.print_seq(amp.seq, 80) + os.linesep
+
+def json_line(amp):
+    '''Line of the Amplicon in JSON lines format'''
+    return json.dumps(dict([(name, getattr(amp, name)) for name in Amplicon.__slots__]), sort_keys=True) + '\n'
+
+class StreamWriter(object):
+    '''Write the amplicons in the --stream format as they are found. They
+    are sorted as the other outputs with at most --sort_buffer amplicons in
+    memory, or written at once with --no_sort.'''
+    def __init__(self, options, session_dir):
+        self.outfile = options.outfile
+        self.format = {'tab' : tab_line, 'fasta' : fasta_record, 'json' : json_line}[options.stream]
+        self.count = 0
+        self.added = 0
+        # Index of each database in order of the first amplicon
+        self.databases = {}
+        # With the --max_hits options, the amplicons are written at the end
+        self.top_hits = top_hits(options)
+        if options.no_sort:
+            self.sorter = None
+        else:
+            self.sorter = external_sort.ExternalSort(options.sort_buffer, session_dir)
+
+        if options.stream == 'tab':
+            self.outfile.write(TAB_HEADER)
+
+    def add(self, item, order=None):
+        '''Add an item [ave_Tm, ppc, size, amp] of the amp_list. order is
+        the position of the amplicon in a serial search of its database, a
+        tuple of integers, the order of adding by default.'''
+        (ave_Tm, ppc, size, amp) = item
+        if order is None:
+            order = (self.added,)
+        self.added += 1
+        # The databases are searched in order
+        order = (self.databases.setdefault(amp['db'], len(self.databases)),) + order
+        if self.top_hits is not None:
+            self.top_hits.add(ppc, size, pair_key(amp['pid'], amp['mid']), (order, new_amplicon(amp, ppc)), order)
+        else:
+            self.put(ppc, size, order, new_amplicon(amp, ppc))
 
-        amp_len = amp['size']
+    def put(self, ppc, size, order, amplicon):
+        '''Write or sort the Amplicon'''
+        if self.sorter is None:
+            self.write(amplicon)
+        else:
+            # The fields are smaller than the Amplicon, the serial order
+            # breaks the ties as the stable sort of get_amplicons
+            fields = tuple([getattr(amplicon, name) for name in Amplicon.__slots__])
+            self.sorter.add((-ppc, -size, order, fields))
+
+    def write(self, amplicon):
+        self.count += 1
+        amplicon.id = self.count
+        self.outfile.write(self.format(amplicon))
+
+    def close(self):
+        '''Write the sorted amplicons'''
+        if self.top_hits is not None:
+            for (order, amplicon) in self.top_hits.selected():
+                self.put(amplicon.ppc, amplicon.size, order, amplicon)
+        if self.sorter is not None:
+            for (ppc, size, n, fields) in self.sorter:
+                self.write(Amplicon(**dict(zip(Amplicon.__slots__, fields))))
+            self.sorter.close()
+        self.outfile.flush()
+
+def search_database(options, session_dir, db, oligos, threads=1, emit=None):
+    '''Search the primers in one database (a name or a Database), return the
+    amp_list, or pass each amplicon to emit if given'''
+    stats.database = getattr(db, 'name', db)
+    with stats.stage('open database'):
+        if isinstance(db, Database):
+            database = db
+        elif db in resident_databases:
+            database = resident_databases[db]
+        else:
+            database = Database(db)
 
-	# p for plus, m for minus primer # History reason
+        fcdict = database.fcdict
+        twobit_db = database.twobit
+        dg3_table = database.dg3_table(options)
 
-        p_qid = amp['pid']
-        f_3_pos = amp['f3_pos'] 
-        p_qseq = amp['p_qseq']
-        p_aseq = amp['p_aseq']
-        p_tail = amp['p_tail']
-        p_Tm = amp['p_Tm']
-        p_DeltaG = amp['p_DeltaG']
-        p_sb = f_3_pos - len(p_aseq) + 1
+    try:
+        if emit is None:
+            database_emit = None
+        else:
+            def database_emit(item, order=None):
+                item[3]['db'] = database.name
+                emit(item, order)
 
-        m_qid = amp['mid']
-        r_3_pos = amp['r3_pos']
-        m_qseq = amp['m_qseq']
-        m_aseq = amp['m_aseq']
-        m_tail = amp['m_tail']
-        m_Tm = amp['m_Tm']
-        m_DeltaG = amp['m_DeltaG']
-        m_se = r_3_pos + len(m_aseq)
+        oligo_pos = get_oligo_pos(options, database, oligos)
 
-        mid_seq = amp['mid_seq']
-        real_hid = amp['real_hid']
+        partitions = partition_hits(oligo_pos, threads * 4)
+        if threads > 1 and len(partitions) > 1:
+            with stats.stage('partitions') as counts:
+                amp_list = search_partitions(options, session_dir, oligos, oligo_pos, fcdict, twobit_db, dg3_table, partitions, threads, database_emit)
+                counts['partitions'] = len(partitions)
+        else:
+            (candidates, p_scores, m_scores) = primer_process(options, oligos, oligo_pos, twobit_db, dg3_table)
+            with stats.stage('analysis') as counts:
+                amp_list = primer_analysis(candidates, p_scores, m_scores, options, oligos, session_dir, fcdict, twobit_db, emit=database_emit)
+                counts['candidates'] = len(candidates)
+                if emit is None:
+                    counts['amplicons'] = len(amp_list)
+
+        for ave_Tm, ppc, size, amp in amp_list:
+            amp['db'] = database.name
+    finally:
+        if database is not db and db not in resident_databases:
+            database.close()
+        stats.database = None
 
-        amp_seq = p_tail + p_qseq + mid_seq + m_qseq + m_tail
-        amp_GC = chilli.cal_GC_content(amp_seq, + amp_len)
+    return amp_list
 
-        if p_qid == m_qid:
-            ppc = '-%.1f' % ppc
+def partition_hits(oligo_pos, count):
+    '''Split the hits with both plus and minus sites into at most count
+    sets of about the same number of sites'''
+    p_hids = set()
+    m_hids = set()
+    sizes = {}
+    for pos in oligo_pos:
+        for strand, hid_set in (('p_list', p_hids), ('m_list', m_hids)):
+            for hid, sites in pos[strand].iteritems():
+                hid_set.add(hid)
+                sizes[hid] = sizes.get(hid, 0) + len(sites)
+
+    hids = p_hids & m_hids
+    # The biggest hit first, each one to the smallest partition
+    partitions = [(0, n, set()) for n in xrange(min(count, len(hids)))]
+    for hid in sorted(hids, key=lambda hid: (-sizes[hid], hid)):
+        (size, n, members) = heapq.heappop(partitions)
+        members.add(hid)
+        heapq.heappush(partitions, (size + sizes[hid], n, members))
+
+    return [members for (size, n, members) in sorted(partitions, key=itemgetter(1))]
+
+class SerialOrder(object):
+    '''Order of the amplicons of the partitions in a serial search: the
+    forward primer, the rank of the reverse primer in its partners, the
+    rank of the hit in the forward sites of the primer and the rank of the
+    amplicon in the (forward primer, reverse primer, hit) group'''
+    def __init__(self, oligos, oligo_pos):
+        self.oligos = oligos
+        self.oligo_pos = oligo_pos
+        self.partner_ranks = {}
+        self.hit_ranks = {}
+        self.counts = {}
+
+    def order(self, key):
+        (i, k, j) = key
+        if i not in self.hit_ranks:
+            self.hit_ranks[i] = dict([(hid, n) for (n, hid) in enumerate(self.oligo_pos[i]['p_list'].iterkeys())])
+            if self.oligos[i]['partners'] is not None:
+                self.partner_ranks[i] = dict([(m, n) for (n, m) in enumerate(self.oligos[i]['partners'])])
+        if i in self.partner_ranks:
+            k_rank = self.partner_ranks[i][k]
         else:
-            ppc = '%.1f' % ppc
+            k_rank = k
+        n = self.counts.get(key, 0)
+        self.counts[key] = n + 1
+
+        return (i, k_rank, self.hit_ranks[i][j], n)
+
+# Arguments of search_partition_job, inherited by the workers
+partition_args = None
+
+def search_partition_job(hids):
+    '''Search the primers in the hits of one partition in a worker process,
+    return (amp_list, keys, stage records)'''
+    (options, session_dir, oligos, oligo_pos, fcdict, twobit_db, dg3_table) = partition_args
+    global stats
+    database = stats.database
+    stats = stage_stats.StageStats()
+    stats.database = database
+    (candidates, p_scores, m_scores) = primer_process(options, oligos, oligo_pos, twobit_db, dg3_table, hids)
+    keys = []
+    with stats.stage('analysis') as counts:
+        amp_list = primer_analysis(candidates, p_scores, m_scores, options, oligos, session_dir, fcdict, twobit_db, keys)
+        counts['candidates'] = len(candidates)
+        counts['amplicons'] = len(amp_list)
+
+    return amp_list, keys, stats.records
+
+def search_partitions(options, session_dir, oligos, oligo_pos, fcdict, twobit_db, dg3_table, partitions, threads, emit=None):
+    '''Search the partitions of the hits in a pool of processes, the
+    index and the .2bit mmaps are shared by fork. The results are merged in
+    the same order as a serial search, or passed to emit in order of the
+    partitions as they are finished, with their serial order.'''
+    global partition_args
+    partition_args = (options, session_dir, oligos, oligo_pos, fcdict, twobit_db, dg3_table)
+    pool = multiprocessing.Pool(threads)
+
+    # The amplicons of each (forward primer, reverse primer, hit) are from
+    # one partition and in order
+    groups = {}
+    serial = SerialOrder(oligos, oligo_pos)
+    try:
+        # A MFEprimerError of a worker is raised again by imap
+        for (amp_list, keys, records) in pool.imap(search_partition_job, partitions, chunksize=1):
+            stats.merge(records)
+            if emit is not None:
+                for key, amp in zip(keys, amp_list):
+                    emit(amp, serial.order(key))
+                continue
+            for key, amp in zip(keys, amp_list):
+                groups.setdefault(key, []).append(amp)
+    finally:
+        # Also for the errors of the workers
+        pool.terminate()
+        pool.join()
+        partition_args = None
+
+    amp_list = []
+    for i in xrange(len(oligos)):
+        p_list = oligo_pos[i]['p_list']
+        for k in partners(oligos, i):
+            for j in p_list.iterkeys():
+                amp_list.extend(groups.get((i, k, j), []))
 
-	options.outfile.write("%d\t%s\t%s\t%s\t%s\t%d\t%.2f\t%.2f\t%.2f\t%.2f\t%.2f\t%d\t%d\t%s\n" % (sn, p_qid, m_qid, real_hid, ppc, amp_len, amp_GC, p_Tm, m_Tm, p_DeltaG, m_DeltaG, p_sb, m_se, amp_seq))
+    return amp_list
 
+# Arguments of search_database_job, inherited by the workers
+job_args = None
+
+def search_database_job(n):
+    '''search_database of the n-th database in a worker process, return
+    (amp_list, stage records)'''
+    (options, session_dir, oligos) = job_args
+    global stats
+    stats = stage_stats.StageStats()
+    return search_database(options, session_dir, options.database[n], oligos), stats.records
+
+def search_databases_parallel(options, session_dir, oligos, emit=None):
+    '''Search the databases in a pool of options.jobs processes, the
+    results are merged in order of the databases, or passed to emit as
+    the databases are finished'''
+    global job_args
+    job_args = (options, session_dir, oligos)
+    pool = multiprocessing.Pool(min(options.jobs, len(options.database)))
 
-def process_primer(options, session_dir):
+    amp = []
+    try:
+        # A MFEprimerError of a worker is raised again by imap
+        for (amp_list, records) in pool.imap(search_database_job, range(len(options.database)), chunksize=1):
+            stats.merge(records)
+            if emit is None:
+                amp.extend(amp_list)
+            else:
+                for item in amp_list:
+                    emit(item)
+    finally:
+        # Also for the errors of the workers
+        pool.terminate()
+        pool.join()
+        job_args = None
+
+    return amp
+
+def process_primer(options, session_dir, emit=None):
     '''Primer task'''
+    with stats.stage('read primers') as counts:
+        oligos = check_infile(options)
+        counts['primers'] = len(oligos)
+    amp = search_primers(options, session_dir, oligos, emit)
+
+    return amp, oligos
+
+def read_pairs(pairs):
+    '''[(primer ID, primer ID), ...] of the pair file (a file object or a
+    name) or list, None for None'''
+    if pairs is None or isinstance(pairs, list):
+        return pairs
+
+    if isinstance(pairs, basestring):
+        try:
+            pairs = open(pairs)
+        except IOError, e:
+            raise MFEprimerError('Error: can not open the pair file: %s' % e)
+
+    pair_list = []
+    for line_no, line in enumerate(pairs):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        fields = line.split('\t')
+        if len(fields) != 2:
+            # Not the line itself, the file may be anything on a server
+            pairs.close()
+            raise MFEprimerError('Error: illegal line %s in %s, a pair is two primer IDs separated by a tab' % (line_no + 1, pairs.name))
+        pair_list.append((fields[0].strip(), fields[1].strip()))
+
+    pairs.close()
+    return pair_list
+
+def set_partners(options, oligos):
+    '''Set oligo['partners'], the indexes of the reverse primers checked with
+    the oligo as forward primer, None for all the oligos.
+
+    A pair of --pairs is checked in the four combinations of its primers,
+    a pair of --cross_pairs in the two combinations of the primers.'''
+    pairs = read_pairs(getattr(options, 'pairs', None))
+    cross_pairs = read_pairs(getattr(options, 'cross_pairs', None))
+    options.pairs = pairs
+    options.cross_pairs = cross_pairs
+    if pairs is None and cross_pairs is None:
+        for oligo in oligos:
+            oligo['partners'] = None
+        return
+
+    index = {}
+    for i in xrange(len(oligos)):
+        index[oligos[i]['id']] = i
+
+    combinations = set()
+    for pair_list, with_self in ((pairs, True), (cross_pairs, False)):
+        for (fp_id, rp_id) in pair_list or []:
+            for primer_id in (fp_id, rp_id):
+                if primer_id not in index:
+                    raise MFEprimerError('Error: primer %s of the pairs is not in the primer file' % primer_id)
+
+            (i, k) = (index[fp_id], index[rp_id])
+            combinations.update([(i, k), (k, i)])
+            if with_self:
+                combinations.update([(i, i), (k, k)])
+
+    for oligo in oligos:
+        oligo['partners'] = []
+    for (i, k) in sorted(combinations):
+        oligos[i]['partners'].append(k)
+
+def partners(oligos, i):
+    '''Indexes of the reverse primers checked with the i-th forward primer'''
+    if oligos[i]['partners'] is None:
+        return xrange(len(oligos))
+
+    return oligos[i]['partners']
+
+def search_primers(options, session_dir, oligos, emit=None):
+    '''Search the oligos in the databases, return the amp_list, or pass
+    each amplicon to emit if given'''
     if not isinstance(options.database, list):
         options.database = [options.database]
 
-    if not isinstance(options.infile, file):
-        options.infile = open(options.infile)
+    for oligo in oligos:
+        oligo['rc_seq'] = Seq.rev_com(oligo['seq'])
+    set_partners(options, oligos)
 
-    oligos = check_infile(options)
-    amp = []
-    for db in options.database:
-        fcdict_cache = db + '.uni'
-        fcdict = chilli.get_cache(fcdict_cache)
-        product, binding_range = primer_process(options, session_dir, fcdict, db, oligos)
-        seq_list = extract_by_twoBitToFa(binding_range, options, session_dir, db)
-        filter_product = get_align_seq(seq_list, options, product)
-        amp_list = primer_analysis(filter_product, options, oligos, session_dir, fcdict, db)
-        amp.extend(amp_list)
+    if getattr(options, 'jobs', 1) > 1 and len(options.database) > 1:
+        # The databases are in parallel, the hits of each one are not
+        amp = search_databases_parallel(options, session_dir, oligos, emit)
+    else:
+        amp = []
+        for db in options.database:
+            amp.extend(search_database(options, session_dir, db, oligos, getattr(options, 'threads', 1), emit))
+
+    return select_amp_list(options, amp)
+
+def get_options(databases, **params):
+    '''Options of the databases, the default values and the params, the
+    names of the params are the long option names, such as k_value, ppc or
+    size_stop'''
+    options = argparse.Namespace()
+    for action in get_parser()._actions:
+        if action.dest not in ('help', 'version', 'infile', 'outfile'):
+            setattr(options, action.dest, action.default)
+    options.database = list(databases)
+
+    for name, value in params.iteritems():
+        if not hasattr(options, name) or name == 'database':
+            raise MFEprimerError('Unknown option: %s' % name)
+        setattr(options, name, value)
+
+    error = check_options(options)
+    if error:
+        raise MFEprimerError(error)
 
-    return amp, oligos
+    return options
 
-def main():
-    '''Main control function'''
-    options = get_opt()
+def check_primers(primers, databases, **params):
+    '''Check the specificity of the primers, return the amplicons as a list
+    of Amplicon sorted as the output of MFEprimer.py.
+
+    primers is a string in FASTA format or a list of (id, seq), databases
+    is a list of database names or Database objects, which can be opened
+    once and used for many checks. The params are the options of
+    MFEprimer.py, such as ppc=50 or k_value=7.
+
+        db = Database('human.genomic')
+        for amp in check_primers([('fp', 'CCTACGGGAGGCAGCAG'), ('rp', 'ATTACCGCGGCTGCTGG')], [db], ppc=50):
+            print amp.fp_id, amp.rp_id, amp.hit_id, amp.size, amp.ppc
+        db.close()
+
+    Illegal options, primers or pairs, a wrong k-value and databases which
+    can not be opened raise MFEprimerError, a ValueError. The stage
+    statistics of the check are left in MFEprimer.stats.
+    '''
+    global stats
+    stats = stage_stats.StageStats()
+    if isinstance(databases, (basestring, Database)):
+        databases = [databases]
+    options = get_options(databases, **params)
+
+    if isinstance(primers, basestring):
+        lines = primers.splitlines()
+    else:
+        lines = []
+        for (primer_id, seq) in primers:
+            lines.extend(['>%s' % primer_id, seq])
+
+    err_or_degenerate = SeqCheck.fasta_format_check(lines, err_path=None)
+    if err_or_degenerate not in ['yes', 'no']:
+        raise MFEprimerError(err_or_degenerate.replace('<br />', ' '))
+
+    oligos = parse_oligos(lines, err_or_degenerate)
+    amp_list = search_primers(options, None, oligos)
+
+    return get_amplicons(amp_list)
 
+def run(options):
+    '''Check the primers and write the results to options.outfile'''
+    global stats
+    stats = stage_stats.StageStats()
     session_dir = chilli.session()
+    try:
+        output(options, session_dir)
+    finally:
+        # Clean session tmp directory
+        shutil.rmtree(session_dir, ignore_errors=True)
 
+def output(options, session_dir):
+    '''Search the primers and write the results'''
     start_time = time.time()
-    amp_list, oligos = process_primer(options, session_dir)
-    if options.tab:
-	tab_out(amp_list, oligos, options, start_time, session_dir)
+    if options.stream:
+        writer = StreamWriter(options, session_dir)
+        amp_list, oligos = process_primer(options, session_dir, writer.add)
+        with stats.stage('output') as counts:
+            writer.close()
+            counts['amplicons'] = writer.count
     else:
-	format_output_primer(amp_list, oligos, options, start_time, session_dir)
+        amp_list, oligos = process_primer(options, session_dir)
+        with stats.stage('output') as counts:
+            counts['amplicons'] = len(amp_list)
+            if options.tab:
+                tab_out(amp_list, oligos, options, start_time, session_dir)
+            else:
+                format_output_primer(amp_list, oligos, options, start_time, session_dir)
+
+    if options.stats and (options.tab or options.stream):
+        print >> sys.stderr, os.linesep.join(stats.format())
+    if options.stats_json:
+        report = stats.as_dict()
+        report['program'] = Program
+        report['version'] = Version
+        json.dump(report, options.stats_json, indent=1, sort_keys=True)
+        options.stats_json.write(os.linesep)
+        options.stats_json.close()
 
-    # Clean session tmp directory
+def main():
+    '''Main control function'''
+    options = get_opt()
     try:
-      shutil.rmtree(session_dir)
-    except:
-      pass
-
-
+        run(options)
+    except MFEprimerError, e:
+        print2stderr(e)
 
 if __name__ == '__main__':
     main()
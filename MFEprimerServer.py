@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- #
+'''MFEprimer server: keep the databases open and check the primers of the
+requests, without the start-up cost of MFEprimer.py for each check.
+
+Start the server with the databases to be loaded, on a HTTP port or a Unix
+socket:
+
+    MFEprimerServer.py -d human.genomic human.rna --port 8000
+    MFEprimerServer.py -d human.genomic --socket /tmp/mfeprimer.sock
+
+A request is a JSON object, "args" are the MFEprimer.py options except the
+ones reading or writing files on the server (-i/--infile, -o/--outfile,
+--amplicon, --stats_json, --pairs and --cross_pairs, also as
+abbreviations), "primers" are the
+primer sequences in FASTA format. The databases must be the ones loaded by
+the server, with the same names:
+
+    {"args": "-d human.genomic --tab --ppc 50", "primers": ">p1\\nCCTACGGGAGGCAGCAG\\n>p2\\nATTACCGCGGCTGCTGG"}
+
+HTTP: POST the request, the response is the output of MFEprimer (text or
+tabular format). A bad request gets the error message with status 400.
+
+    curl --data-binary @request.json http://localhost:8000/
+
+Unix socket: send the request and shut down the writing side, the response
+is a JSON object {"status": "ok" or "error", "output": ...}, see query().
+
+The requests are processed one by one, use the -j and -t options of
+MFEprimer in the requests for parallel searching.
+'''
+
+Program = 'MFEprimerServer'
+Date = '2026-10-18'
+Version = '1.0'
+
+import os
+import sys
+import json
+import shlex
+import shutil
+import socket
+import tempfile
+import argparse
+import StringIO
+import SocketServer
+import BaseHTTPServer
+
+import MFEprimer
+
+# Options of MFEprimer.py which read or write files on the server
+UNSUPPORTED_OPTIONS = ['-i', '--infile', '-o', '--outfile', '--amplicon', '--stats_json', '--pairs', '--cross_pairs']
+
+def get_opt():
+    '''Check and parsing the opts'''
+    parser = argparse.ArgumentParser(prog='MFEprimerServer', description='MFEprimer server: keep the databases open and check the primers of the requests.', usage='%(prog)s.py -d Human.genomic [Human.rna ...] (--port 8000 | --socket /tmp/mfeprimer.sock)')
+    parser.add_argument('-d', '--database', nargs='+', type=str,
+	    help='[Required] Databases to be loaded.', required=True)
+    parser.add_argument('--host', nargs='?', type=str,
+	    default='127.0.0.1', help='[Optional] Host name of the HTTP server, default = 127.0.0.1. [String]')
+
+    listen_group = parser.add_mutually_exclusive_group(required=True)
+    listen_group.add_argument('--port', nargs='?', type=int,
+	    help='Port of the HTTP server. [Integer]')
+    listen_group.add_argument('--socket', nargs='?', type=str,
+	    help='Path of the Unix socket. [File]')
+
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + Version)
+
+    return parser.parse_args()
+
+def blocked_option(arg, actions):
+    '''The unsupported option named by the argument, None for the others.
+    As argparse, a long option may be abbreviated or have "=value", and a
+    short option may have the value attached or follow other short flags.
+    actions is {option string : action} of the MFEprimer.py parser.'''
+    if not arg.startswith('-') or arg == '-':
+        return None
+
+    if arg.startswith('--'):
+        name = arg.split('=')[0]
+        if name in actions:
+            names = [name]
+        else:
+            names = [option for option in actions if option.startswith('--') and option.startswith(name)]
+        for option in names:
+            if option in UNSUPPORTED_OPTIONS:
+                return option
+        return None
+
+    # Only the flags without values can be followed by other short options
+    for char in arg[1:]:
+        option = '-' + char
+        if option in UNSUPPORTED_OPTIONS:
+            return option
+        if option not in actions or actions[option].nargs != 0:
+            break
+
+    return None
+
+def check_namespace(options):
+    '''Return the unsupported option set in the parsed options, None if
+    none is set. sys.stdout is the default output file when parsing.'''
+    if options.outfile is not sys.stdout:
+        return '--outfile'
+    if options.amplicon:
+        return '--amplicon'
+    if options.stats_json is not None:
+        return '--stats_json'
+    if options.pairs is not None:
+        return '--pairs'
+    if options.cross_pairs is not None:
+        return '--cross_pairs'
+
+    return None
+
+def check(request):
+    '''Check the primers of the request, return (ok, output or error message)'''
+    args = request.get('args', [])
+    primers = request.get('primers', '')
+    if isinstance(args, basestring):
+        args = shlex.split(args.encode('utf-8'))
+    else:
+        args = [str(arg) for arg in args]
+    if isinstance(primers, unicode):
+        primers = primers.encode('utf-8')
+
+    # The files of the options are opened by the parser, so the options
+    # are rejected before parsing
+    actions = MFEprimer.get_parser()._option_string_actions
+    for arg in args:
+        option = blocked_option(arg, actions)
+        if option is not None:
+            return False, 'Error: option %s is not supported by the server' % option
+
+    # The FASTA parsers read file objects, the primers go to a temporary file
+    tmp_dir = tempfile.mkdtemp(prefix='mfeprimer_')
+    primer_file = os.path.join(tmp_dir, 'primers.fa')
+    fo = open(primer_file, 'w')
+    fo.write(primers)
+    fo.close()
+
+    output = StringIO.StringIO()
+    output.name = '<stdout>'
+    messages = StringIO.StringIO()
+    (stdout, stderr) = (sys.stdout, sys.stderr)
+    (sys.stdout, sys.stderr) = (messages, messages)
+    try:
+        try:
+            options = MFEprimer.get_opt(args + ['-i', primer_file])
+
+            option = check_namespace(options)
+            if option is not None:
+                options.infile.close()
+                return False, 'Error: option %s is not supported by the server' % option
+
+            for db in options.database:
+                if db not in MFEprimer.resident_databases:
+                    options.infile.close()
+                    return False, 'Error: database %s is not loaded by the server' % db
+
+            options.outfile = output
+            MFEprimer.run(options)
+        except MFEprimer.MFEprimerError, e:
+            # Errors of the primers, the pairs and the databases
+            return False, str(e)
+        except SystemExit:
+            # Errors of the options
+            return False, messages.getvalue() or 'Error: bad request'
+    finally:
+        (sys.stdout, sys.stderr) = (stdout, stderr)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return True, output.getvalue()
+
+def parse_request(body):
+    '''Return the request object, None for a bad one'''
+    try:
+        request = json.loads(body)
+    except ValueError:
+        return None
+
+    if not isinstance(request, dict):
+        return None
+
+    return request
+
+class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''POST a request, get the output'''
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length', 0))
+        request = parse_request(self.rfile.read(length))
+        if request is None:
+            (ok, output) = (False, 'Error: the request must be a JSON object')
+        else:
+            (ok, output) = check(request)
+
+        if ok:
+            self.send_response(200)
+        else:
+            self.send_response(400)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(output)))
+        self.end_headers()
+        self.wfile.write(output)
+
+class UnixHandler(SocketServer.StreamRequestHandler):
+    '''Read a request until the end of the input, send the JSON response'''
+    def handle(self):
+        request = parse_request(self.rfile.read())
+        if request is None:
+            (ok, output) = (False, 'Error: the request must be a JSON object')
+        else:
+            (ok, output) = check(request)
+
+        if ok:
+            status = 'ok'
+        else:
+            status = 'error'
+        self.wfile.write(json.dumps({'status' : status, 'output' : output}))
+
+def query(socket_file, args, primers):
+    '''Send a request to the server on the Unix socket, return (ok, output)'''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_file)
+    sock.sendall(json.dumps({'args' : args, 'primers' : primers}))
+    sock.shutdown(socket.SHUT_WR)
+
+    data = []
+    while True:
+        block = sock.recv(65536)
+        if not block:
+            break
+        data.append(block)
+    sock.close()
+
+    response = json.loads(''.join(data))
+    return response['status'] == 'ok', response['output'].encode('utf-8')
+
+def main():
+    '''Main'''
+    options = get_opt()
+    MFEprimer.load_databases(options.database)
+    print 'Loaded: %s' % ', '.join(options.database)
+
+    if options.socket:
+        if os.path.exists(options.socket):
+            os.remove(options.socket)
+        server = SocketServer.UnixStreamServer(options.socket, UnixHandler)
+        print 'Listening on %s' % options.socket
+    else:
+        server = BaseHTTPServer.HTTPServer((options.host, options.port), HTTPHandler)
+        print 'Listening on http://%s:%s/' % (options.host, options.port)
+
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    server.server_close()
+    if options.socket:
+        os.remove(options.socket)
+
+if __name__ == '__main__':
+    main()
@@ -91,6 +91,30 @@ def iupac2normal(seq, prefixes=['']):
 
         return iupac2normal(last_seq, prefixes = new_prefixes)
 
+def is_degenerate(seq):
+    '''Whether the sequence has ambiguous bases'''
+    for base in seq:
+        if len(iupac_dict.get(base, '')) != 1:
+            return True
+
+    return False
+
+def best_variant(seq, template):
+    '''Return the normal sequence of the degenerate seq matching best to the
+    template (same length and strand as seq): each ambiguous base becomes
+    the template base if possible, else its first base'''
+    variant = []
+    for base, t_base in zip(seq, template):
+        bases = iupac_dict[base]
+        if len(bases) == 1:
+            variant.append(base)
+        elif t_base in bases:
+            variant.append(t_base)
+        else:
+            variant.append(bases[0])
+
+    return ''.join(variant)
+
 def convert(records):
     '''Convert'''
     result_fasta_array = []
@@ -10,6 +10,12 @@ References
 
 [2] von Ahsen, N., Wittwer, C.T. and Schutz, E. (2001) Oligonucleotide melting tempera-tures under PCR conditions: Nearest-neighbor corrections for Mg2+, deoxynu-cleotide triphosphate, and dimethyl sulfoxide concentrations with comparison to alternative empirical formulas, Clinical Chemistry, 47, 1956-1961.
 
+BatchCal calculates the Tm and DeltaG of many duplexes at once with the
+same conditions. The NN parameters are compiled to tables indexed by
+integer-coded bases, the salt and oligo terms are calculated once, and
+NumPy (optional) is used for the duplexes of the same length. The results
+are the same as Cal, calTm and calDeltaG.
+
 by Wubin Qu <quwubin@gmail.com>
 Copyright @ 2010, All Rights Reserved.
 '''
@@ -19,10 +25,18 @@ Date = '2010-3-2'
 License = 'GPL v3'
 Version = '1.0'
 
+import os
+import sys
 import math
+from array import array
 import Seq
 import ThermodynamicsParameters as TP
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 def calDeltaHS(qseq, sseq): 
     """ Calculate deltaH and deltaS """
 
@@ -115,6 +129,243 @@ class Cal():
 	self.Tm = calTm(qseq, sseq, mono_conc=mono_conc, diva_conc=diva_conc, oligo_conc=oligo_conc, dntp_conc=dntp_conc,deltaH=deltaH, deltaS=deltaS)
 	self.DeltaG = calDeltaG(qseq, sseq, mono_conc=mono_conc, diva_conc=diva_conc, dntp_conc=dntp_conc,deltaH=deltaH, deltaS=deltaS)
 
+NN_BASES = 'ACGT'
+# Base to code (A=0, C=1, G=2, T=3), other characters to 4
+CODE_TABLE = ''.join([chr(NN_BASES.find(chr(i)) if chr(i) in NN_BASES else 4) for i in xrange(256)])
+
+def compileTables(dH=TP.dH_full, dS=TP.dS_full):
+    '''Compile the NN parameters to tables indexed by the base codes.
+
+    init tables: q * 5 + s, for the first and the last base pair
+    nn tables: ((q1 * 5 + q2) * 5 + s1) * 5 + s2, for the dinucleotides
+    The ok tables tell whether the parameters are present.
+    '''
+    init_dH = [0.0] * 25
+    init_dS = [0.0] * 25
+    init_ok = [False] * 25
+    nn_dH = [0.0] * 625
+    nn_dS = [0.0] * 625
+    nn_ok = [False] * 625
+    for q1 in xrange(4):
+        for s1 in xrange(4):
+            key = 'init%s%s' % (NN_BASES[q1], NN_BASES[s1])
+            if key in dH and key in dS:
+                code = q1 * 5 + s1
+                (init_dH[code], init_dS[code], init_ok[code]) = (dH[key], dS[key], True)
+
+            for q2 in xrange(4):
+                for s2 in xrange(4):
+                    key = NN_BASES[q1] + NN_BASES[q2] + NN_BASES[s1] + NN_BASES[s2]
+                    if key in dH and key in dS:
+                        code = ((q1 * 5 + q2) * 5 + s1) * 5 + s2
+                        (nn_dH[code], nn_dS[code], nn_ok[code]) = (dH[key], dS[key], True)
+
+    return init_dH, init_dS, init_ok, nn_dH, nn_dS, nn_ok
+
+NN_TABLES = compileTables()
+
+def calDeltaHSCoded(q, s, tables=NN_TABLES):
+    '''Same as calDeltaHS, q and s are translated with CODE_TABLE'''
+    (init_dH, init_dS, init_ok, nn_dH, nn_dS, nn_ok) = tables
+    init_begin = ord(q[0]) * 5 + ord(s[0])
+    init_end = ord(q[-1]) * 5 + ord(s[-1])
+    if init_ok[init_begin] and init_ok[init_end]:
+        deltaH = init_dH[init_begin] + init_dH[init_end]
+        deltaS = init_dS[init_begin] + init_dS[init_end]
+    else:
+        deltaH = 0
+        deltaS = 0
+
+    for i in xrange(len(q) - 1):
+        code = ((ord(q[i]) * 5 + ord(q[i+1])) * 5 + ord(s[i])) * 5 + ord(s[i+1])
+        if nn_ok[code]:
+            deltaH += nn_dH[code]
+            deltaS += nn_dS[code]
+
+    return deltaH, deltaS
+
+class BatchCal():
+    '''Tm and DeltaG of many duplexes with the same conditions'''
+    def __init__(self, mono_conc=50, diva_conc=1.5, oligo_conc=50, dntp_conc=0.25, tables=NN_TABLES):
+        # The same arithmetic as calTm and calDeltaG
+        mono_conc = float(mono_conc) + divalent2monovalent(float(diva_conc), float(dntp_conc))
+        mono_conc = mono_conc / 1000
+        self.salt = math.log(mono_conc, math.e)
+
+        oligo_conc = float(oligo_conc) / 1000000000
+        self.oligo = 1.987 * math.log(oligo_conc / 4, math.e)
+        self.tao = 273.15 + 37
+        self.tables = tables
+        if numpy is not None:
+            self.np_tables = [numpy.array(table) for table in tables]
+
+    def calDeltaHS(self, qseqs, sseqs):
+        '''Return the deltaH, deltaS and length of each duplex'''
+        if numpy is None:
+            dH = []
+            dS = []
+            for qseq, sseq in zip(qseqs, sseqs):
+                (deltaH, deltaS) = calDeltaHSCoded(qseq.translate(CODE_TABLE), sseq.translate(CODE_TABLE), self.tables)
+                dH.append(deltaH)
+                dS.append(deltaS)
+            return dH, dS, [len(qseq) for qseq in qseqs]
+
+        count = len(qseqs)
+        dH = numpy.zeros(count)
+        dS = numpy.zeros(count)
+        lengths = numpy.array([len(qseq) for qseq in qseqs], dtype=numpy.int64)
+
+        groups = {}
+        for i in xrange(count):
+            groups.setdefault(len(qseqs[i]), []).append(i)
+
+        for length, members in groups.iteritems():
+            members = numpy.array(members)
+            q = numpy.frombuffer(''.join([qseqs[i] for i in members]).translate(CODE_TABLE), dtype=numpy.uint8).reshape(len(members), length)
+            s = numpy.frombuffer(''.join([sseqs[i] for i in members]).translate(CODE_TABLE), dtype=numpy.uint8).reshape(len(members), length)
+            (dH[members], dS[members]) = self.calDeltaHSCoded(q, s)
+
+        return dH, dS, lengths
+
+    def calDeltaHSCoded(self, q, s):
+        '''deltaH and deltaS of the duplexes of the same length, q and s are
+        NumPy matrices of the base codes, one row for each duplex'''
+        (init_dH, init_dS, init_ok, nn_dH, nn_dS, nn_ok) = self.np_tables
+        q = q.astype(numpy.intp)
+        s = s.astype(numpy.intp)
+        init_begin = q[:, 0] * 5 + s[:, 0]
+        init_end = q[:, -1] * 5 + s[:, -1]
+        ok = init_ok[init_begin] & init_ok[init_end]
+        deltaH = numpy.where(ok, init_dH[init_begin] + init_dH[init_end], 0.0)
+        deltaS = numpy.where(ok, init_dS[init_begin] + init_dS[init_end], 0.0)
+
+        # Add the dinucleotides in order, so the sums are the same as calDeltaHS
+        for i in xrange(q.shape[1] - 1):
+            code = ((q[:, i] * 5 + q[:, i+1]) * 5 + s[:, i]) * 5 + s[:, i+1]
+            deltaH += nn_dH[code]
+            deltaS += nn_dS[code]
+
+        return deltaH, deltaS
+
+    def calTmDeltaG(self, qseqs, sseqs):
+        '''Return the lists of Tm and DeltaG of the duplexes'''
+        (dH, dS, lengths) = self.calDeltaHS(qseqs, sseqs)
+        if numpy is None:
+            Tm = []
+            DeltaG = []
+            for deltaH, deltaS, length in zip(dH, dS, lengths):
+                deltaS = deltaS + 0.368 * (length - 1) * self.salt
+                Tm.append(deltaH * 1000 / (deltaS + self.oligo) - 273.15)
+                DeltaG.append((deltaH * 1000 - self.tao * deltaS) / 1000)
+            return Tm, DeltaG
+
+        dS = dS + 0.368 * (lengths - 1) * self.salt
+        Tm = dH * 1000 / (dS + self.oligo) - 273.15
+        DeltaG = (dH * 1000 - self.tao * dS) / 1000
+        return Tm.tolist(), DeltaG.tolist()
+
+    def calDeltaG(self, qseqs, sseqs):
+        '''Return the list of DeltaG of the duplexes'''
+        return self.calTmDeltaG(qseqs, sseqs)[1]
+
+class DeltaG3Table():
+    '''DeltaG of the 3' end, the last 5 base pairs of the alignment, looked
+    up from a table of all the ACGT 5-mer pairs.
+
+    get(qseq, sseq) is the same as calDeltaG(qseq, Seq.complement(sseq)),
+    sseq is the target sequence as in the alignment. The table is indexed
+    by code(qseq) * 1024 + code(sseq), 8 MB of float64. It is built with
+    NumPy at once and saved to cache_file, without NumPy the entries are
+    calculated when first used.
+    '''
+    size = 5
+    count = 4**10
+
+    def __init__(self, mono_conc=50, diva_conc=1.5, dntp_conc=0.25, cache_file=None):
+        self.thermo = BatchCal(mono_conc=mono_conc, diva_conc=diva_conc, dntp_conc=dntp_conc)
+        self.table = None
+        if cache_file:
+            self.table = self.load(cache_file)
+
+        if self.table is None:
+            if numpy is None:
+                self.table = array('d', [float('nan')]) * self.count
+            else:
+                self.table = self.build()
+                if cache_file:
+                    self.save(cache_file)
+
+    def load(self, cache_file):
+        '''Load the table, None if the cache file is absent or broken'''
+        try:
+            if os.path.getsize(cache_file) != self.count * 8:
+                return None
+            table = array('d')
+            fh = open(cache_file, 'rb')
+            table.fromfile(fh, self.count)
+            fh.close()
+        except (IOError, OSError, EOFError):
+            return None
+
+        if sys.byteorder == 'big':
+            table.byteswap()
+        return table
+
+    def save(self, cache_file):
+        '''Save the table (little-endian), skipped if the directory is not
+        writable'''
+        tmp_name = '%s.%s.tmp' % (cache_file, os.getpid())
+        table = array('d', self.table)
+        if sys.byteorder == 'big':
+            table.byteswap()
+        try:
+            fh = open(tmp_name, 'wb')
+            table.tofile(fh)
+            fh.close()
+            os.rename(tmp_name, cache_file)
+        except (IOError, OSError):
+            try:
+                os.remove(tmp_name)
+            except OSError:
+                pass
+
+    def build(self):
+        '''Calculate all the entries with NumPy'''
+        # Base codes of the 1024 5-mers, the first base in the high bits
+        codes = numpy.arange(1024)
+        mers = numpy.empty((1024, self.size), dtype=numpy.intp)
+        for i in xrange(self.size):
+            mers[:, i] = (codes >> (2 * (self.size - 1 - i))) & 3
+
+        q = numpy.repeat(mers, 1024, axis=0)
+        # Complement of the target: A-T (0-3), C-G (1-2)
+        s = numpy.tile(3 - mers, (1024, 1))
+        (deltaH, deltaS) = self.thermo.calDeltaHSCoded(q, s)
+        deltaS = deltaS + 0.368 * (self.size - 1) * self.thermo.salt
+        deltaG = (deltaH * 1000 - self.thermo.tao * deltaS) / 1000
+        return array('d', deltaG.tostring())
+
+    def get(self, qseq, sseq):
+        '''3' DeltaG of the 5 base pairs'''
+        q = qseq.translate(CODE_TABLE)
+        s = sseq.translate(CODE_TABLE)
+        if len(q) != self.size or len(s) != self.size or '\x04' in q or '\x04' in s:
+            # Short alignment or other bases, not in the table
+            return self.thermo.calDeltaG([qseq], [Seq.complement(sseq)])[0]
+
+        code = 0
+        for c in q:
+            code = code * 4 + ord(c)
+        for c in s:
+            code = code * 4 + ord(c)
+
+        deltaG = self.table[code]
+        if deltaG != deltaG:
+            # NaN, not calculated yet
+            deltaG = self.thermo.calDeltaG([qseq], [Seq.complement(sseq)])[0]
+            self.table[code] = deltaG
+        return deltaG
+
 def main():
     qseq = 'TATACTTT'
     sseq = Seq.complement(qseq)
@@ -16,8 +16,8 @@ Version = '1.0'
 import sys
 import os
 from optparse import OptionParser
-import chilli
-import FastaSimpleFormatParser
+import itertools
+import contig_table
 
 
 def get_opt():
@@ -27,6 +27,8 @@ def get_opt():
     version = '%prog Version: ' + '%s [%s]' % (Version, Date)
     parser = OptionParser(usage=usage, version=version)
     parser.add_option('-i', '--infile', dest='infile', help='Input file anme. [String]')
+    parser.add_option('-a', '--append', dest='append', help='Append the sequences to this indexed database, the new sequences are numbered after the sequences of the database. [String]')
+    parser.add_option('-u', '--uni_file', dest='uni_file', help='Write the contig table of the appended database to this file, default is the .uni file of the database. [String]')
     [options, args] = parser.parse_args()
 
     if len(args) > 1:
@@ -40,54 +42,69 @@ def get_opt():
 def print2stderr(msg):
     '''Print msg to sys.stderr and exit the program'''
     print >> sys.stderr, msg
-    exit()
+    sys.exit(1)
 
-def convert(infile, outfile, cache_name):
-    '''Convert'''
+def next_id(fcdict):
+    '''The first unused numeric id of the cache'''
+    if not fcdict:
+        return 0
+
+    return max([int(id) for id in fcdict]) + 1
+
+def convert(infile, outfile, cache_name, fcdict=None):
+    '''Convert, the new records are added after the records of fcdict (a
+    contig table or an old cache) if given'''
     fh = open(infile)
     fo = open(outfile, 'w')
 
-    pre_fcdict = {}
-    sn = 0
+    if fcdict is None:
+        old_records = []
+        sn = 0
+    elif isinstance(fcdict, contig_table.ContigTable):
+        old_records = fcdict.records()
+        sn = len(fcdict)
+    else:
+        old_records = contig_table.cache_records(fcdict)
+        sn = next_id(fcdict)
+
+    # [id, desc, size] of the new sequences
+    new_records = []
     for line in fh:
         line = line.strip()
         if line.startswith('>'):
             fasta_id, sep, desc = line.partition(' ')
-            pre_fcdict[str(sn)] = {
-                'id' : fasta_id[1:80],
-                'desc' : desc[:240],
-            }
+            new_records.append([fasta_id[1:80], desc[:240], 0])
             line = '>%s %s' % (sn, line[1:])
             sn += 1
+        elif new_records:
+            new_records[-1][2] += len(line)
 
 	fo.write(line + os.linesep)
 
     fh.close()
     fo.close()
 
-    if len(pre_fcdict) < 1:
+    if len(new_records) < 1:
         print2stderr('No Fasta format sequences in the database')
 
-    records = FastaSimpleFormatParser.parse(open(outfile))
-    fcdict = {}
-    for record in records:
-        id = record['id']
-        desc = pre_fcdict[id]['desc']
-        size = record['size']
-        fcdict[id] = {
-            'id' : pre_fcdict[id]['id'],
-            'desc' : desc,
-            'size' : size,
-        }
-
-    chilli.set_cache(fcdict, cache_name)
+    contig_table.write(cache_name, itertools.chain(old_records, new_records))
 
 def main ():
     '''Main'''
     options = get_opt()
     convert_db = options.infile + '.unifasta'
-    cache_name = options.infile + '.uni'
-    convert(options.infile, convert_db, cache_name)
+    if options.append:
+        cache_name = options.append + '.uni'
+        try:
+            fcdict = contig_table.load(cache_name)
+        except:
+            print2stderr('Error: can not read %s' % cache_name)
+        convert(options.infile, convert_db, options.uni_file or cache_name, fcdict)
+        if isinstance(fcdict, contig_table.ContigTable):
+            fcdict.close()
+    else:
+        cache_name = options.infile + '.uni'
+        convert(options.infile, convert_db, cache_name)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- #
+'''Binary contig table of the database (the ".uni" file) for MFEprimer-2.0
+
+The table replaces the JSON cache {"seq_id" : {"id", "desc", "size"}},
+which had to be loaded as a whole for each run, with a table read in
+place, so only the sequences with amplicons are decoded.
+
+File layout (all values are little-endian):
+
+    Header      magic (8s), version (uint32), sequence count (uint64)
+    Records     sequence count + 1 pairs of uint64 (size, heap offset),
+                the strings of the n-th sequence are heap[offset[n] :
+                offset[n+1]], the last record only has the heap end
+    Heap        "id\0desc" of each sequence in UTF-8
+
+The seq_id is the serial number of the sequence in the .unifasta, .2bit
+and .idx files, starting from 0. Old JSON or shelve caches are still
+read by load().
+'''
+
+Date = '2026-10-18'
+Version = '1.0'
+
+import os
+import sys
+import mmap
+import struct
+import shutil
+from array import array
+from optparse import OptionParser
+
+import chilli
+
+MAGIC = 'MFEUNITB'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIQ')
+RECORD = struct.Struct('<QQ')
+
+def get_opt():
+    '''Handle options'''
+    usage = 'Usage: %prog database.uni\n\nConvert the JSON .uni cache of an indexed database to the binary contig table.'
+    version = '%prog Version: ' + '%s [%s]' % (Version, Date)
+    parser = OptionParser(usage=usage, version=version)
+    [options, args] = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error('Incorrect argument, add" "-h" for help.')
+
+    return options, args
+
+def print2stderr(msg):
+    '''Print msg to sys.stderr and exit the program'''
+    print >> sys.stderr, msg
+    sys.exit(1)
+
+def is_table(filename):
+    '''Whether the file is a binary contig table'''
+    fh = open(filename, 'rb')
+    magic = fh.read(len(MAGIC))
+    fh.close()
+    return magic == MAGIC
+
+def write(filename, records):
+    '''Write the table of the records, (id, desc, size) of the sequences in
+    order of seq_id. The file is replaced at the end, so the records can be
+    read from the old table of the same file.'''
+    tmp_name = filename + '.tmp'
+    heap_name = filename + '.heap'
+    heap = open(heap_name, 'wb')
+    # Interleaved (size, heap offset) of the records
+    table = array('L')
+    offset = 0
+    for (seq_id, desc, size) in records:
+        data = _encode(seq_id) + '\0' + _encode(desc)
+        table.append(size)
+        table.append(offset)
+        heap.write(data)
+        offset += len(data)
+    table.append(0)
+    table.append(offset)
+    heap.close()
+
+    fo = open(tmp_name, 'wb')
+    fo.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(table) // 2 - 1))
+    for i in xrange(0, len(table), 65536):
+        part = table[i : (i+65536)]
+        fo.write(struct.pack('<%sQ' % len(part), *part))
+    heap = open(heap_name, 'rb')
+    shutil.copyfileobj(heap, fo)
+    heap.close()
+    fo.close()
+
+    os.remove(heap_name)
+    os.rename(tmp_name, filename)
+
+def _encode(text):
+    '''UTF-8 string'''
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+
+    return text
+
+class ContigTable(object):
+    '''Read-only mmapped contig table, table[seq_id] is {'id', 'desc',
+    'size'} of the sequence as in the JSON cache. The seq_id is an integer
+    or a string, the records are decoded when first used.'''
+    def __init__(self, filename):
+        self.filename = filename
+        self.fh = open(filename, 'rb')
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.mm) < HEADER.size:
+            raise ValueError('%s is not a MFEprimer contig table' % filename)
+
+        (magic, version, count) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('%s is not a MFEprimer contig table' % filename)
+
+        self.count = count
+        self.heap = HEADER.size + (count + 1) * RECORD.size
+        self.cache = {}
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, seq_id):
+        try:
+            n = int(seq_id)
+        except ValueError:
+            return False
+
+        return 0 <= n < self.count
+
+    def __iter__(self):
+        '''seq_ids as strings, same as the keys of the JSON cache'''
+        for n in xrange(self.count):
+            yield str(n)
+
+    def keys(self):
+        return list(self)
+
+    def __getitem__(self, seq_id):
+        if seq_id in self.cache:
+            return self.cache[seq_id]
+
+        if seq_id not in self:
+            raise KeyError(seq_id)
+
+        (seq_name, desc, size) = self.record(int(seq_id))
+        contig = {
+            'id' : seq_name,
+            'desc' : desc,
+            'size' : size,
+        }
+        self.cache[seq_id] = contig
+        return contig
+
+    def get(self, seq_id, default=None):
+        if seq_id in self:
+            return self[seq_id]
+
+        return default
+
+    def record(self, n):
+        '''(id, desc, size) of the n-th sequence'''
+        (size, start) = RECORD.unpack_from(self.mm, HEADER.size + n * RECORD.size)
+        (next_size, stop) = RECORD.unpack_from(self.mm, HEADER.size + (n + 1) * RECORD.size)
+        (seq_name, sep, desc) = self.mm[(self.heap + start) : (self.heap + stop)].partition('\0')
+        return seq_name.decode('utf-8'), desc.decode('utf-8'), size
+
+    def records(self):
+        '''Yield (id, desc, size) of all the sequences in order'''
+        for n in xrange(self.count):
+            yield self.record(n)
+
+    def close(self):
+        self.mm.close()
+        self.fh.close()
+
+def load(filename):
+    '''Open the contig table, or load the old JSON or shelve cache'''
+    if is_table(filename):
+        return ContigTable(filename)
+
+    return chilli.get_cache(filename)
+
+def cache_records(fcdict):
+    '''Yield (id, desc, size) of the old cache in order of seq_id, missing
+    seq_ids become empty records'''
+    if not fcdict:
+        return
+
+    count = max([int(seq_id) for seq_id in fcdict]) + 1
+    for n in xrange(count):
+        contig = fcdict.get(str(n))
+        if contig is None:
+            yield ('', '', 0)
+        else:
+            yield (contig['id'], contig['desc'], contig['size'])
+
+def convert(filename):
+    '''Convert the old cache to the contig table in place'''
+    fcdict = chilli.get_cache(filename)
+    write(filename, cache_records(fcdict))
+
+def main():
+    '''Main'''
+    options, args = get_opt()
+    filename = args[0]
+    try:
+        if is_table(filename):
+            print '%s is already a contig table of %s sequences' % (filename, len(ContigTable(filename)))
+        else:
+            convert(filename)
+            print '%s converted to a contig table of %s sequences' % (filename, len(ContigTable(filename)))
+    except (IOError, ValueError), e:
+        print2stderr('Error: %s' % e)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- #
+'''Sort items with a bounded number of them in memory.
+
+    sorter = ExternalSort(max_items=100000)
+    for item in items:
+        sorter.add(item)
+    for item in sorter:
+        ...
+    sorter.close()
+
+When max_items items are added, they are sorted and written to a temporary
+run file, the runs and the remaining items are merged when iterating. The
+items are compared as they are, such as tuples with the sort key first,
+and must be picklable.
+'''
+
+Date = '2026-10-18'
+Version = '1.0'
+
+import heapq
+import tempfile
+import cPickle
+
+class ExternalSort(object):
+    '''Sorted items, at most max_items of them are kept in memory'''
+    def __init__(self, max_items=100000, tmp_dir=None):
+        if max_items < 1:
+            raise ValueError('max_items must be at least 1')
+
+        self.max_items = max_items
+        self.tmp_dir = tmp_dir
+        self.items = []
+        self.runs = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, item):
+        self.items.append(item)
+        self.count += 1
+        if len(self.items) >= self.max_items:
+            self.spill()
+
+    def spill(self):
+        '''Write the items in memory to a sorted run'''
+        self.items.sort()
+        fh = tempfile.TemporaryFile(prefix='mfeprimer_sort_', dir=self.tmp_dir)
+        pickler = cPickle.Pickler(fh, cPickle.HIGHEST_PROTOCOL)
+        for item in self.items:
+            pickler.dump(item)
+            # The pickler would keep all the items for the references
+            pickler.clear_memo()
+        self.runs.append(fh)
+        self.items = []
+
+    def read_run(self, fh):
+        '''Yield the items of a run'''
+        fh.seek(0)
+        unpickler = cPickle.Unpickler(fh)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                break
+
+    def __iter__(self):
+        '''Yield all the items in order'''
+        self.items.sort()
+        if not self.runs:
+            return iter(self.items)
+
+        return heapq.merge(*([self.read_run(fh) for fh in self.runs] + [iter(self.items)]))
+
+    def close(self):
+        '''Delete the runs'''
+        for fh in self.runs:
+            fh.close()
+        self.runs = []
+        self.items = []
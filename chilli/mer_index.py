@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- #
+'''Binary k-mer position index for MFEprimer-2.0
+
+The index replaces the SQLite "pos" table, which stored the positions as
+"seq_id:pos,pos;seq_id:pos" text and had to be re-parsed for every primer.
+
+File layout (all values are little-endian):
+
+    Header          magic (8s), version (uint32), k (uint32),
+                    plus hit count (uint64), minus hit count (uint64)
+    Plus offsets    4**k + 1 uint64, offsets[mer_id] .. offsets[mer_id+1]
+                    is the slice of the plus hits for the mer
+    Minus offsets   4**k + 1 uint64, same for the minus strand
+    Plus hits       packed uint32 pairs (seq_id, pos), sorted by seq_id, pos
+    Minus hits      packed uint32 pairs (seq_id, pos), sorted by seq_id, pos
+
+The position values are the same as the SQLite index: the 3' end of the
+mer on the plus strand, the 5' start of the mer on the minus strand.
+
+The file is opened with mmap, so looking up a mer costs two array slices.
+'''
+
+Date = '2026-10-18'
+Version = '1.0'
+
+import os
+import sys
+import mmap
+import struct
+from array import array
+
+MAGIC = 'MFEMERIX'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIIQQ')
+OFFSET = struct.Struct('<Q')
+HIT_SIZE = 8 # Two uint32: seq_id and pos
+
+def index_name(db):
+    '''Index file name of the database'''
+    return db + '.idx'
+
+def _hit_array(data=''):
+    '''Return an uint32 array (little-endian) from the raw string'''
+    hits = array('I')
+    hits.fromstring(data)
+    if sys.byteorder == 'big':
+        hits.byteswap()
+
+    return hits
+
+def _write_array(fh, values):
+    '''Write the array in little-endian'''
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+
+    values.tofile(fh)
+
+def _write_offsets(fh, offsets, chunk=65536):
+    '''Write the offset table as uint64'''
+    for i in xrange(0, len(offsets), chunk):
+        part = offsets[i : (i+chunk)]
+        fh.write(struct.pack('<%sQ' % len(part), *part))
+
+def write(filename, k, plus, minus):
+    '''Write the index file.
+
+    plus and minus are sequences with 4**k items, each item is an uint32
+    array of interleaved (seq_id, pos) values or None for absent mers.
+    '''
+    write_groups(filename, k, table_groups(plus), table_groups(minus))
+
+def table_groups(table):
+    '''Yield (mer_id, hits) for the mers present in the table'''
+    for mer_id, hits in enumerate(table):
+        if hits:
+            yield mer_id, hits
+
+def write_groups(filename, k, plus_groups, minus_groups):
+    '''Write the index file from two streams of (mer_id, hits), one for
+    each strand, both in increasing order of mer_id'''
+    mer_count = 4**k
+    tmp_name = filename + '.tmp'
+    fh = open(tmp_name, 'wb')
+
+    # Reserve the header and the offset tables, fill them after the hits
+    table_size = (mer_count + 1) * OFFSET.size
+    fh.seek(HEADER.size + 2 * table_size)
+
+    tables = []
+    for groups in (plus_groups, minus_groups):
+        offsets = array('L', [0]) * (mer_count + 1)
+        for mer_id, hits in groups:
+            _write_array(fh, hits)
+            offsets[mer_id + 1] = len(hits) // 2
+
+        total = 0
+        for i in xrange(1, mer_count + 1):
+            total += offsets[i]
+            offsets[i] = total
+        tables.append(offsets)
+
+    fh.seek(0)
+    fh.write(HEADER.pack(MAGIC, FORMAT_VERSION, k, tables[0][-1], tables[1][-1]))
+    for offsets in tables:
+        _write_offsets(fh, offsets)
+
+    fh.close()
+    os.rename(tmp_name, filename)
+
+class MerIndex(object):
+    '''Read-only mmapped k-mer position index'''
+    def __init__(self, filename):
+        self.filename = filename
+        self.fh = open(filename, 'rb')
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.mm) < HEADER.size:
+            raise ValueError('%s is not a MFEprimer index file' % filename)
+
+        (magic, version, k, n_plus, n_minus) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('%s is not a MFEprimer index file' % filename)
+
+        self.k = k
+        self.mer_count = 4**k
+        table_size = (self.mer_count + 1) * OFFSET.size
+        self.plus_table = HEADER.size
+        self.minus_table = self.plus_table + table_size
+        self.plus_data = self.minus_table + table_size
+        self.minus_data = self.plus_data + n_plus * HIT_SIZE
+        self.n_plus = n_plus
+        self.n_minus = n_minus
+
+    def _slice(self, table, data, mer_id):
+        '''Raw string of the hits for the mer'''
+        (start,) = OFFSET.unpack_from(self.mm, table + mer_id * OFFSET.size)
+        (stop,) = OFFSET.unpack_from(self.mm, table + (mer_id + 1) * OFFSET.size)
+        return self.mm[(data + start * HIT_SIZE) : (data + stop * HIT_SIZE)]
+
+    def lookup(self, mer_id):
+        '''Return the plus and minus hits of the mer as uint32 arrays of
+        interleaved (seq_id, pos) values'''
+        if mer_id < 0 or mer_id >= self.mer_count:
+            raise IndexError('mer_id %s out of range for k=%s' % (mer_id, self.k))
+
+        plus = _hit_array(self._slice(self.plus_table, self.plus_data, mer_id))
+        minus = _hit_array(self._slice(self.minus_table, self.minus_data, mer_id))
+        return plus, minus
+
+    def groups(self, strand, chunk=65536):
+        '''Yield (mer_id, hits) of the strand (0 for plus, 1 for minus) in
+        order of mer_id, the absent mers are skipped'''
+        if strand == 0:
+            table, data = self.plus_table, self.plus_data
+        else:
+            table, data = self.minus_table, self.minus_data
+
+        for first in xrange(0, self.mer_count, chunk):
+            count = min(chunk, self.mer_count - first)
+            offsets = struct.unpack_from('<%sQ' % (count + 1), self.mm, table + first * OFFSET.size)
+            for i in xrange(count):
+                if offsets[i] != offsets[i+1]:
+                    yield first + i, _hit_array(self.mm[(data + offsets[i] * HIT_SIZE) : (data + offsets[i+1] * HIT_SIZE)])
+
+    def close(self):
+        self.mm.close()
+        self.fh.close()
+
+def decode(hits):
+    '''Convert the interleaved hits to {seq_id : [pos, ...]}'''
+    pos_dict = {}
+    for i in xrange(0, len(hits), 2):
+        seq_id = hits[i]
+        if seq_id in pos_dict:
+            pos_dict[seq_id].append(hits[i+1])
+        else:
+            pos_dict[seq_id] = [hits[i+1]]
+
+    return pos_dict
+
+def main():
+    '''Print the positions of the mer'''
+    if len(sys.argv) != 3:
+        print 'Usage: %s db.idx mer_id' % os.path.basename(sys.argv[0])
+        sys.exit(1)
+
+    index = MerIndex(sys.argv[1])
+    plus, minus = index.lookup(int(sys.argv[2]))
+    print 'k =', index.k
+    print 'plus:', decode(plus)
+    print 'minus:', decode(minus)
+    index.close()
+
+if __name__ == '__main__':
+    main()
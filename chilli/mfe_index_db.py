@@ -6,23 +6,60 @@ import sys
 import datetime
 from time import time
 from optparse import OptionParser
-import sqlite3
+from array import array
+import itertools
+import multiprocessing
+import heapq
+import struct
+import tempfile
+import shutil
+from operator import itemgetter
 import FastaIterator
+import mer_index
 
 D2n_dic = dict(A=0, T=3, C=2, G=1, a=0, t=3, c=2, g=1)
 n2D_dic = {0:'A', 3:'T', 2:'C', 1:'G', 0:'a', 3:'t', 2:'c', 1:'g'}
 
+# str.translate table: base -> 2-bit code in D2n_dic, others -> 4
+base_code_table = ''.join([chr(D2n_dic.get(chr(i), 4)) for i in xrange(256)])
+
+# Long sequences are indexed in chunks of this many windows
+CHUNK_SIZE = 1000000
+
+# Estimated memory for each hit and each per-mer array in the tables
+HIT_BYTES = 9
+ARRAY_BYTES = 80
+
+# (mer_id, count) before the hits of a mer in the run files
+RUN_HEADER = struct.Struct('II')
+
 def optget():
     '''parse options'''
     parser = OptionParser()
     parser.add_option("-f", "--file", dest = "filename", help = "DNA file in fasta to be indexed")
-    parser.add_option("-k", "--k", dest = "k", type='int', help = "K mer , default is 9", default = 9)
+    parser.add_option("-k", "--k", dest = "k", type='int', help = "K mer , default is 9, or the k of the index with -a")
+    parser.add_option("-t", "--threads", dest = "threads", type='int', help = "Number of processes for indexing, default is 1", default = 1)
+    parser.add_option("-m", "--max_memory", dest = "max_memory", type='int', help = "Memory limit for the positions in MB, default is half of the physical memory")
+    parser.add_option("--tmp_dir", dest = "tmp_dir", help = "Directory for the temporary sorted runs, default is the directory of the index")
+    parser.add_option("-a", "--append", dest = "append", help = "Merge the positions into the index of this database instead of creating a new index")
+    parser.add_option("-o", "--outfile", dest = "outfile", help = "Write the index to this file, default is the index of the database")
 
     (options, args) = parser.parse_args()
 
     if not options.filename:
         print_usage()
-        exit()	
+        sys.exit(1)
+
+    if options.threads < 1:
+        print 'Error: the number of threads should be at least 1'
+        sys.exit(1)
+
+    if options.max_memory is not None and options.max_memory < 1:
+        print 'Error: illegal value for max_memory'
+        sys.exit(1)
+
+    if options.k is None and not options.append:
+        options.k = 9
 
     return options
 
@@ -32,57 +69,70 @@ def print_usage():
 
 Usage:
 
-    %s -f human.genomic -k 9
+    %s -f human.genomic -k 9 [-t 8] [-m 4096]
+    %s -f new_strains.unifasta -a human.genomic [-o human.genomic.idx.new]
 
 Author: Wubin Qu <quwubin@gmail.com>
-Last updated: 2012-4-24
-    ''' % (os.path.basename(sys.argv[0]), os.path.basename(sys.argv[0]))
+Last updated: 2026-10-18
+    ''' % ((os.path.basename(sys.argv[0]),) * 3)
 
-def get_memory_percent():
-    '''Print Memory information'''
-    import os
+def default_max_memory():
+    '''Half of the physical memory in MB'''
     try:
-	import psutil
-    except:
-	print '''psutil module needed.
-
-	You can download and install it from here: http://code.google.com/p/psutil/
-	'''
-	exit()
-
-    p = psutil.Process(os.getpid())
-    return p.memory_percent()
-
-def insert_db(conn, mer_count, plus, minus):
-    for mer_id in xrange(mer_count):
-        conn.execute("insert into pos (mer_id, plus, minus) values (?, ?, ?)", \
-                [mer_id, plus[mer_id], minus[mer_id]])
-
-    conn.commit()
-
-def update_db(conn, mer_count, plus, minus):
-    for mer_id in xrange(mer_count):
-        (plus_data, minus_data) = conn.execute("select plus, minus from pos where mer_id=?", [mer_id]).fetchone()
-        if plus_data:
-            if plus[mer_id]:
-                plus_data += ';%s' % plus[mer_id]
-            else:
-                pass
-        else:
-            plus_data = plus[mer_id]
-
-        if minus_data:
-            if minus[mer_id]:
-                minus_data += ';%s' % minus[mer_id]
-            else:
-                pass
-        else:
-            minus_data = minus[mer_id]
-
-        conn.execute("update pos set plus=?, minus=? where mer_id=?", \
-                [plus_data, minus_data, mer_id])
-
-    conn.commit()
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 2 // 1024**2
+    except (ValueError, OSError, AttributeError):
+        return 2048
+
+def spill_run(run_dir, run_no, plus, minus):
+    '''Write the position tables in memory to sorted run files, one for
+    each strand. A run is a list of (mer_id, count) headers, each one
+    followed by the interleaved (seq_id, pos) hits, in order of mer_id.
+    '''
+    run_names = []
+    for strand, table in (('plus', plus), ('minus', minus)):
+        run_name = os.path.join(run_dir, '%s.run%s' % (strand, run_no))
+        fh = open(run_name, 'wb')
+        for mer_id, hits in mer_index.table_groups(table):
+            fh.write(RUN_HEADER.pack(mer_id, len(hits) // 2))
+            hits.tofile(fh)
+        fh.close()
+        run_names.append(run_name)
+
+    return run_names
+
+def read_run(run_name):
+    '''Yield (mer_id, hits) from a run file'''
+    fh = open(run_name, 'rb')
+    while True:
+        header = fh.read(RUN_HEADER.size)
+        if not header:
+            break
+
+        mer_id, count = RUN_HEADER.unpack(header)
+        hits = array('I')
+        hits.fromfile(fh, count * 2)
+        yield mer_id, hits
+
+    fh.close()
+
+def tag_stream(stream_no, stream):
+    '''Yield (mer_id, stream_no, hits)'''
+    for mer_id, hits in stream:
+        yield mer_id, stream_no, hits
+
+def merge_groups(streams):
+    '''K-way merge of the (mer_id, hits) streams of one strand, yield
+    (mer_id, hits).
+
+    The streams are given in order of (seq_id, pos), so the hits of one
+    mer are still sorted after joining them in order of the stream.
+    '''
+    tagged = [tag_stream(stream_no, stream) for stream_no, stream in enumerate(streams)]
+    for mer_id, group in itertools.groupby(heapq.merge(*tagged), key=itemgetter(0)):
+        hits = array('I')
+        for mer_id, stream_no, stream_hits in group:
+            hits.extend(stream_hits)
+        yield mer_id, hits
 
 def baseN(num, b):
     '''convert non-negative decimal integer n to
@@ -113,107 +163,251 @@ def DNA2int(seq):
 
     return plus_mer
 
-def index(filename, k):
-    ''''''
+def iter_mers(seq, k):
+    '''Yield (i, plus_mer_id, minus_mer_id) for each k-mer starting at i.
+
+    The 2-bit codes of both strands are rolled with shift-and-mask, so
+    each base costs O(1). Windows with unrecognized bases, such as 'N',
+    are skipped and the codes restart after them.
+    '''
+    mask = 4**k - 1
+    shift = 2 * (k - 1)
+    plus_mer = 0
+    minus_mer = 0
+    valid = 0 # Number of recognized bases at the end of the current window
+    i = -k + 1
+    for code in bytearray(seq.translate(base_code_table)):
+        if code > 3:
+            valid = 0
+        else:
+            plus_mer = ((plus_mer << 2) | code) & mask
+            minus_mer = (minus_mer >> 2) | ((3 - code) << shift)
+            valid += 1
+            if valid >= k:
+                yield i, plus_mer, minus_mer
+        i += 1
+
+def split_chunks(records, k, chunk_size=CHUNK_SIZE):
+    '''Split the sequences into tasks of (seq_id, offset, seq, k).
+
+    Each chunk holds the windows starting in [offset, offset + chunk_size),
+    so neighbouring chunks overlap by k - 1 bases.
+    '''
+    for record in records:
+        print record.id
+        seq_id = int(record.id)
+        fasta_seq = record.seq
+        offset = 0
+        while True:
+            yield seq_id, offset, fasta_seq[offset : (offset + chunk_size + k - 1)], k
+            offset += chunk_size
+            if offset > len(fasta_seq) - k:
+                break
+
+def group_hits(seq_id, keys):
+    '''Sort the (mer_id << 32 | pos) keys and group the hits by mer.
+
+    Return (mers, counts, hits), hits are interleaved (seq_id, pos).
+    '''
+    keys.sort()
+    mers = array('I')
+    counts = array('I')
+    hits = array('I')
+    last_mer_id = -1
+    for key in keys:
+        mer_id = key >> 32
+        if mer_id != last_mer_id:
+            mers.append(mer_id)
+            counts.append(0)
+            last_mer_id = mer_id
+        counts[-1] += 1
+        hits.append(seq_id)
+        hits.append(key & 0xffffffff)
+
+    return mers, counts, hits
+
+def index_chunk(task):
+    '''Index one chunk, return the partial position table of both strands'''
+    seq_id, offset, seq, k = task
+    plus_keys = []
+    minus_keys = []
+    for i, plus_mer_id, minus_mer_id in iter_mers(seq, k):
+        pos = offset + i
+        plus_keys.append((plus_mer_id << 32) | (pos + k - 1))
+        minus_keys.append((minus_mer_id << 32) | pos)
+
+    return group_hits(seq_id, plus_keys), group_hits(seq_id, minus_keys)
+
+def index_chunk_into(plus, minus, task):
+    '''Index one chunk straight into the position tables (single process),
+    return the estimated memory used by the new hits'''
+    seq_id, offset, seq, k = task
+    hit_count = 0
+    array_count = 0
+    for i, plus_mer_id, minus_mer_id in iter_mers(seq, k):
+        pos = offset + i
+        hit_count += 1
+        if plus[plus_mer_id] is None:
+            plus[plus_mer_id] = array('I')
+            array_count += 1
+        plus[plus_mer_id].extend((seq_id, pos+k-1))
+
+        if minus[minus_mer_id] is None:
+            minus[minus_mer_id] = array('I')
+            array_count += 1
+        minus[minus_mer_id].extend((seq_id, pos))
+
+    return 2 * hit_count * HIT_BYTES + array_count * ARRAY_BYTES
+
+def merge_chunk(table, grouped):
+    '''Append the grouped hits of a chunk to the position table, return
+    the estimated memory used by the new hits'''
+    mers, counts, hits = grouped
+    array_count = 0
+    start = 0
+    for n in xrange(len(mers)):
+        mer_id = mers[n]
+        stop = start + counts[n] * 2
+        if table[mer_id] is None:
+            table[mer_id] = hits[start:stop]
+            array_count += 1
+        else:
+            table[mer_id].extend(hits[start:stop])
+        start = stop
+
+    return len(hits) // 2 * HIT_BYTES + array_count * ARRAY_BYTES
+
+def open_base_index(db, k=None):
+    '''Open the index of the database to be appended, k must be the one of
+    the index if given'''
+    index_file = mer_index.index_name(db)
+    try:
+        base_index = mer_index.MerIndex(index_file)
+    except (IOError, ValueError), e:
+        print 'Error: can not open the index %s for appending: %s' % (index_file, e)
+        sys.exit(1)
+
+    if k is not None and base_index.k != k:
+        print 'Error: %s was indexed with k = %s, not %s' % (db, base_index.k, k)
+        sys.exit(1)
+
+    return base_index
+
+def index(filename, k, threads=1, max_memory=None, tmp_dir=None, append=None, outfile=None):
+    '''Index the k-mer positions of the unifasta file.
+
+    The positions are collected in memory until max_memory (MB) is used,
+    then spilled to sorted runs in tmp_dir, which are merged into the
+    index at the end.
+
+    If append is the name of an indexed database, the records (numbered
+    after the sequences of the database) are merged into its index, k is
+    the one of the index if None. The index is written to outfile if
+    given, so the index of the database is kept until the append is
+    finished.
+    '''
     start = time()
 
+    if append:
+        dbname = mer_index.index_name(append)
+        base_index = open_base_index(append, k)
+        k = base_index.k
+    else:
+        dbname = mer_index.index_name('.'.join(filename.split('.')[:-1]))
+        base_index = None
+
+    if outfile:
+        dbname = outfile
+
     mer_count = 4**k
 
-    dbname = '.'.join(filename.split('.')[:-1]) + '.sqlite3.db'
+    if max_memory is None:
+        max_memory = default_max_memory()
+
+    # The two tables and the offset tables of the index writer
+    budget = max_memory * 1024**2 - 4 * mer_count * 8
+    if budget <= 0:
+        print 'Error: %s MB memory is not enough for k = %s' % (max_memory, k)
+        sys.exit(1)
+
+    if tmp_dir is None:
+        tmp_dir = os.path.dirname(os.path.abspath(dbname))
+    run_dir = tempfile.mkdtemp(prefix='mfe_index_', dir=tmp_dir)
+
+    # Interleaved (seq_id, pos) hits for each mer
+    plus = [None]*mer_count
+    minus = [None]*mer_count
+    used = 0
+    runs = []
+
+    if threads > 1:
+        pool = multiprocessing.Pool(threads)
+    else:
+        pool = None
+
+    # Send a bounded batch of chunks to the workers each time, the results
+    # come back in order so the hits stay sorted by seq_id and pos.
+    tasks = split_chunks(FastaIterator.parse(open(filename)), k)
+    batch_size = threads * 2
+    while True:
+        batch = list(itertools.islice(tasks, batch_size))
+        if not batch:
+            break
+
+        if pool is None:
+            results = batch
+        else:
+            results = pool.imap(index_chunk, batch)
+
+        for result in results:
+            if pool is None:
+                used += index_chunk_into(plus, minus, result)
+            else:
+                plus_grouped, minus_grouped = result
+                used += merge_chunk(plus, plus_grouped)
+                used += merge_chunk(minus, minus_grouped)
 
-    conn = sqlite3.connect(dbname)
-    cur = conn.cursor()
-    cur.executescript('''
-    drop table if exists pos;
-    create table pos(
-    mer_id integer primary key, 
-    plus text,
-    minus text
-    );''')
+            if used > budget:
+                runs.append(spill_run(run_dir, len(runs), plus, minus))
 
-    plus = ['']*mer_count
-    minus = ['']*mer_count
+                # Empty the container
+                plus = [None]*mer_count
+                minus = [None]*mer_count
+                used = 0
 
-    is_empty = False
-    is_db_new = True
+                print 'Spill run %s due to the memory limit: %s MB.' % (len(runs), max_memory)
 
-    for record in FastaIterator.parse(open(filename)):
-        is_empty = False
-        print record.id
+        seq_id, offset, seq, k = batch[-1]
+        print "%s: %s bp, %s" % (seq_id, offset + len(seq), str(datetime.timedelta(seconds=(time() - start))))
 
-        fasta_seq = record.seq
-	#print 'Time used: ', time() - start
-
-        plus_mer_list = [''] * mer_count
-        minus_mer_list = [''] * mer_count
-
-        i_max = len(fasta_seq) - k
-        i = 0
-        kmer = fasta_seq[:k]
-        while i < i_max:
-            #print i, len(fasta_seq), i_max
-            #print kmer
-            try:
-                plus_mer_id, minus_mer_id = DNA2int_2(kmer)
-            except:
-                #print 'Unrecognized base: %s' % fasta_seq[i+k]
-                # Skip the unrecognized base, such as 'N'
-                i += 1
-                kmer = kmer[1:] + fasta_seq[i+k-1]
-                continue
-
-            if plus_mer_list[plus_mer_id]:
-                plus_mer_list[plus_mer_id] += ',%i' % (i+k-1)
-            else:
-                plus_mer_list[plus_mer_id] = str(i+k-1)
+    if pool is not None:
+        pool.close()
+        pool.join()
 
-            if minus_mer_list[minus_mer_id]:
-                minus_mer_list[minus_mer_id] += ',%i' % (i)
-            else:
-                minus_mer_list[minus_mer_id] = str(i)
+    if not runs and base_index is None:
+        mer_index.write(dbname, k, plus, minus)
+    else:
+        # The index to be appended, the sorted runs and the rest in memory
+        streams = ([], [])
+        if base_index is not None:
+            streams[0].append(base_index.groups(0))
+            streams[1].append(base_index.groups(1))
 
-            i += 1
-            kmer = kmer[1:] + fasta_seq[i+k-1]
-            if not i % 100000:
-                print "%s: %.2f%%, %s" % (record.id, i/i_max*100, str(datetime.timedelta(seconds=(time() - start))))
-        else:
-            pass
-
-	#print 'Time used: ', time() - start
-        for mer_id in xrange(mer_count):
-            if plus_mer_list[mer_id]:
-                if plus[mer_id]:
-                    plus[mer_id] += ';%s:%s' % (record.id, plus_mer_list[mer_id])
-                else:
-                    plus[mer_id] = '%s:%s' % (record.id, plus_mer_list[mer_id])
-
-            if minus_mer_list[mer_id]:
-                if minus[mer_id]:
-                    minus[mer_id] += ';%s:%s' % (record.id, minus_mer_list[mer_id])
-                else:
-                    minus[mer_id] = '%s:%s' % (record.id, minus_mer_list[mer_id])
-
-        memory_percent = get_memory_percent()
-        if memory_percent > 50:
-            if is_db_new:
-                insert_db(conn, mer_count, plus, minus)
-                is_db_new = False
-            else:
-                update_db(conn, mer_count, plus, minus)
+        for run_names in runs:
+            streams[0].append(read_run(run_names[0]))
+            streams[1].append(read_run(run_names[1]))
 
-            # Empty the container
-            plus = ['']*mer_count
-            minus = ['']*mer_count
-            is_empty = True
+        if used:
+            streams[0].append(mer_index.table_groups(plus))
+            streams[1].append(mer_index.table_groups(minus))
 
-            print 'Empty plus and minus due to the memory: %s.' % memory_percent
+        print 'Merge %s runs ...' % (len(streams[0]))
+        mer_index.write_groups(dbname, k, merge_groups(streams[0]), merge_groups(streams[1]))
 
+        if base_index is not None:
+            base_index.close()
 
-    if not is_empty:
-        if is_db_new:
-            insert_db(conn, mer_count, plus, minus)
-        else:
-            update_db(conn, mer_count, plus, minus)
+    shutil.rmtree(run_dir)
 
     print "Time used: %s" % str(datetime.timedelta(seconds=(time() - start)))
     print 'Done.'
@@ -221,7 +415,7 @@ def index(filename, k):
 def main():
     '''main'''
     options = optget()
-    index(options.filename, options.k)
+    index(options.filename, options.k, options.threads, options.max_memory, options.tmp_dir, options.append, options.outfile)
 
 if __name__ == "__main__":
     main()
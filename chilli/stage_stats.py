@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- #
+'''Wall time, CPU time, process peak RSS and item counts of the stages of
+a MFEprimer run, for each database.
+
+    stats = StageStats()
+    stats.database = 'human.genomic'
+    with stats.stage('lookup') as counts:
+        ...
+        counts['sites'] = len(sites)
+
+The records of the same stage and database are summed, so a stage may run
+many times. The CPU time includes the finished child processes. The
+process peak RSS is the largest resident set size of the process and its
+children until the end of the stage, a high-water mark of the whole run,
+not the memory used by the stage itself.
+'''
+
+Date = '2026-10-18'
+Version = '1.0'
+
+import os
+import sys
+import time
+import resource
+from contextlib import contextmanager
+
+def cpu_time():
+    '''User and system time of the process and its finished children'''
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+def peak_memory():
+    '''Peak resident set size in MB of the process and its children'''
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform == 'darwin':
+        # Bytes on Mac, KB on Linux
+        return peak / 1024.0 / 1024.0
+
+    return peak / 1024.0
+
+class StageStats(object):
+    '''Records of the stages, in order of their first run'''
+    def __init__(self):
+        self.database = None # Database of the following stages
+        self.records = []
+        self.index = {}
+        self.start_wall = time.time()
+        self.start_cpu = cpu_time()
+
+    @contextmanager
+    def stage(self, name):
+        '''Time the stage, the yielded dict takes the item counts'''
+        counts = {}
+        wall = time.time()
+        cpu = cpu_time()
+        yield counts
+        self.add(name, self.database, time.time() - wall, cpu_time() - cpu, peak_memory(), counts)
+
+    def add(self, name, database, wall, cpu, peak_rss, counts, calls=1):
+        '''Add a run of the stage'''
+        key = (name, database)
+        if key not in self.index:
+            self.index[key] = {
+                'stage' : name,
+                'database' : database,
+                'calls' : 0,
+                'wall' : 0.0,
+                'cpu' : 0.0,
+                'process_peak_rss' : 0.0,
+                'counts' : {},
+            }
+            self.records.append(self.index[key])
+
+        record = self.index[key]
+        record['calls'] += calls
+        record['wall'] += wall
+        record['cpu'] += cpu
+        record['process_peak_rss'] = max(record['process_peak_rss'], peak_rss)
+        for item, count in counts.iteritems():
+            record['counts'][item] = record['counts'].get(item, 0) + count
+
+    def merge(self, records):
+        '''Add the records of a worker process'''
+        for record in records:
+            self.add(record['stage'], record['database'], record['wall'], record['cpu'], record['process_peak_rss'], record['counts'], record['calls'])
+
+    def total(self):
+        '''Record of the whole run until now'''
+        return {
+            'wall' : time.time() - self.start_wall,
+            'cpu' : cpu_time() - self.start_cpu,
+            'process_peak_rss' : peak_memory(),
+        }
+
+    def as_dict(self):
+        '''The records for JSON'''
+        return {
+            'total' : self.total(),
+            'stages' : self.records,
+        }
+
+    def format(self):
+        '''Lines of a table of the records'''
+        lines = ['Stage'.ljust(18) + 'Database'.ljust(20) + 'Wall [s]'.rjust(10) + 'CPU [s]'.rjust(10) + 'Peak RSS [MB]'.rjust(15) + '  Counts']
+        for record in self.records:
+            database = os.path.basename(record['database'] or '-')
+            if len(database) > 18:
+                database = database[:15] + '...'
+            counts = ', '.join(['%s=%s' % (item, record['counts'][item]) for item in sorted(record['counts'])])
+            lines.append(record['stage'].ljust(18) + database.ljust(20) + ('%.3f' % record['wall']).rjust(10) + ('%.3f' % record['cpu']).rjust(10) + ('%.1f' % record['process_peak_rss']).rjust(15) + '  ' + counts)
+
+        total = self.total()
+        lines.append('total'.ljust(38) + ('%.3f' % total['wall']).rjust(10) + ('%.3f' % total['cpu']).rjust(10) + ('%.1f' % total['process_peak_rss']).rjust(15))
+        return lines
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- #
+'''Read and append UCSC .2bit files
+
+File format: http://genome.ucsc.edu/FAQ/FAQformat.html#format7
+
+    Header      signature (0x1A412743), version, sequence count, reserved
+    Index       name size (byte), name, offset of the record, for each sequence
+    Records     dna size, N block count, N block starts, N block sizes,
+                mask block count, mask block starts, mask block sizes,
+                reserved, packed DNA (4 bases per byte, T=0 C=1 A=2 G=3)
+
+Version 0 files use 32-bit record offsets, version 1 files use 64-bit
+record offsets for files larger than 4 GB.
+
+TwoBit reads the sequences in process with mmap, which replaces the
+twoBitToFa program of the Blat suite when MFEprimer fetches the binding
+sites and the amplicons.
+'''
+
+Date = '2026-10-18'
+Version = '1.0'
+
+import os
+import sys
+import mmap
+import struct
+import shutil
+from bisect import bisect_right
+from optparse import OptionParser
+
+SIGNATURE = 0x1A412743
+
+# Packed DNA: 2 bits per base, the first base in the high bits
+BASES = 'TCAG'
+BYTE_TABLE = [BASES[i >> 6] + BASES[(i >> 4) & 3] + BASES[(i >> 2) & 3] + BASES[i & 3] for i in xrange(256)]
+
+def get_opt():
+    '''Handle options'''
+    usage = 'Usage: %prog -a database.2bit [-o out.2bit] new.2bit'
+    version = '%prog Version: ' + '%s [%s]' % (Version, Date)
+    parser = OptionParser(usage=usage, version=version)
+    parser.add_option('-a', '--append', dest='append', help='Append the sequences of new.2bit to this .2bit file. [String]')
+    parser.add_option('-o', '--outfile', dest='outfile', help='Write the appended file to this file, default is the .2bit file of -a. [String]')
+    [options, args] = parser.parse_args()
+
+    if len(args) != 1 or not options.append:
+        parser.error('Incorrect argument, add" "-h" for help.')
+
+    return options, args
+
+def print2stderr(msg):
+    '''Print msg to sys.stderr and exit the program'''
+    print >> sys.stderr, msg
+    sys.exit(1)
+
+def read_header(fh):
+    '''Return (byte order, version, [(name, offset), ...]) of the .2bit file'''
+    fh.seek(0)
+    data = fh.read(16)
+    if len(data) < 16:
+        raise ValueError('Not a .2bit file: %s' % fh.name)
+
+    for byte_order in ('<', '>'):
+        (signature, version, seq_count, reserved) = struct.unpack(byte_order + 'IIII', data)
+        if signature == SIGNATURE:
+            break
+    else:
+        raise ValueError('Not a .2bit file: %s' % fh.name)
+
+    if version not in (0, 1):
+        raise ValueError('Unsupported .2bit version %s: %s' % (version, fh.name))
+
+    offset_format = byte_order + ('Q' if version == 1 else 'I')
+    offset_size = struct.calcsize(offset_format)
+    index = []
+    for i in xrange(seq_count):
+        name_size = ord(fh.read(1))
+        name = fh.read(name_size)
+        (offset,) = struct.unpack(offset_format, fh.read(offset_size))
+        index.append((name, offset))
+
+    return byte_order, version, index
+
+def index_size(names, version):
+    '''Size of the header and the index'''
+    offset_size = 8 if version == 1 else 4
+    return 16 + sum([1 + len(name) + offset_size for name in names])
+
+def data_start(index, version):
+    '''Offset of the first record'''
+    if index:
+        return min([offset for name, offset in index])
+    else:
+        return index_size([], version)
+
+def append(twobit_file, new_file, outfile=None):
+    '''Append the sequences of new_file to twobit_file, or write them to
+    outfile if given and leave twobit_file as it is.
+
+    The records are copied as they are, only the index is rewritten.
+    '''
+    old_fh = open(twobit_file, 'rb')
+    new_fh = open(new_file, 'rb')
+    (old_order, old_version, old_index) = read_header(old_fh)
+    (new_order, new_version, new_index) = read_header(new_fh)
+    if old_order != new_order:
+        raise ValueError('%s and %s have different byte orders' % (twobit_file, new_file))
+
+    old_names = set([name for name, offset in old_index])
+    for name, offset in new_index:
+        if name in old_names:
+            raise ValueError('Sequence %s is already in %s' % (name, twobit_file))
+
+    # Records run from the first record to the end of the file
+    old_start = data_start(old_index, old_version)
+    new_start = data_start(new_index, new_version)
+    old_data_size = os.path.getsize(twobit_file) - old_start
+    new_data_size = os.path.getsize(new_file) - new_start
+
+    names = [name for name, offset in old_index + new_index]
+    version = 0
+    if index_size(names, 0) + old_data_size + new_data_size > 0xffffffff:
+        version = 1
+    start = index_size(names, version)
+
+    index = []
+    for name, offset in old_index:
+        index.append((name, offset - old_start + start))
+    for name, offset in new_index:
+        index.append((name, offset - new_start + start + old_data_size))
+
+    byte_order = old_order
+    offset_format = byte_order + ('Q' if version == 1 else 'I')
+    if outfile is None:
+        outfile = twobit_file
+    tmp_name = outfile + '.tmp'
+    fo = open(tmp_name, 'wb')
+    fo.write(struct.pack(byte_order + 'IIII', SIGNATURE, version, len(index), 0))
+    for name, offset in index:
+        fo.write(chr(len(name)) + name + struct.pack(offset_format, offset))
+
+    for fh, record_start in ((old_fh, old_start), (new_fh, new_start)):
+        fh.seek(record_start)
+        shutil.copyfileobj(fh, fo)
+        fh.close()
+
+    fo.close()
+    os.rename(tmp_name, outfile)
+
+class TwoBit(object):
+    '''Read-only mmapped .2bit file.
+
+    The sequence records (size, N blocks and mask blocks) are read on the
+    first access and kept in memory, the packed DNA is decoded from the
+    mmap for each range.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.fh = open(filename, 'rb')
+        (self.byte_order, self.version, index) = read_header(self.fh)
+        self.offsets = dict(index)
+        self.records = {}
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _read_blocks(self, pos):
+        '''Return (starts, sizes, next position) of the block list at pos'''
+        (count,) = struct.unpack_from(self.byte_order + 'I', self.mm, pos)
+        pos += 4
+        starts = list(struct.unpack_from('%s%sI' % (self.byte_order, count), self.mm, pos))
+        pos += 4 * count
+        sizes = list(struct.unpack_from('%s%sI' % (self.byte_order, count), self.mm, pos))
+        pos += 4 * count
+        return starts, sizes, pos
+
+    def record(self, name):
+        '''Return (dna size, N blocks, mask blocks, offset of the packed DNA)
+        of the sequence'''
+        if name in self.records:
+            return self.records[name]
+
+        try:
+            pos = self.offsets[name]
+        except KeyError:
+            raise KeyError('Sequence %s is not in %s' % (name, self.filename))
+
+        (dna_size,) = struct.unpack_from(self.byte_order + 'I', self.mm, pos)
+        (n_starts, n_sizes, pos) = self._read_blocks(pos + 4)
+        (mask_starts, mask_sizes, pos) = self._read_blocks(pos)
+        # Skip the reserved word
+        record = (dna_size, (n_starts, n_sizes), (mask_starts, mask_sizes), pos + 4)
+        self.records[name] = record
+        return record
+
+    def size(self, name):
+        '''Length of the sequence'''
+        return self.record(name)[0]
+
+    def fetch(self, name, start=0, end=None):
+        '''Return the bases [start, end) of the sequence, N blocks as "N"
+        and masked blocks in lower case, same as twoBitToFa'''
+        (dna_size, n_blocks, mask_blocks, dna_offset) = self.record(name)
+        if end is None:
+            end = dna_size
+        if start < 0 or end > dna_size or start > end:
+            raise ValueError('Range %s:%s-%s is out of the sequence of size %s' % (name, start, end, dna_size))
+
+        if start == end:
+            return ''
+
+        data = self.mm[(dna_offset + start // 4) : (dna_offset + (end + 3) // 4)]
+        first = start % 4
+        seq = ''.join([BYTE_TABLE[ord(c)] for c in data])[first : (first + end - start)]
+
+        if n_blocks[0]:
+            seq = _apply_blocks(seq, start, end, n_blocks, lambda s: 'N' * len(s))
+        if mask_blocks[0]:
+            seq = _apply_blocks(seq, start, end, mask_blocks, lambda s: s.lower())
+
+        return seq
+
+    def fetch_ranges(self, ranges):
+        '''Return the sequences of the ranges, each one is a (name, start,
+        end) tuple or a "name:start-end" string as in twoBitToFa -seqList'''
+        seq_list = []
+        for seq_range in ranges:
+            if isinstance(seq_range, basestring):
+                seq_range = parse_range(seq_range)
+            seq_list.append(self.fetch(*seq_range))
+
+        return seq_list
+
+    def fetch_spans(self, spans, lower=False):
+        '''Fetch the (name, start, end) spans with one read for each group
+        of overlapping or adjacent spans of a sequence.
+
+        Return a (seq, seq_start) buffer for each span, the bases of the
+        span are seq[(start - seq_start) : (end - seq_start)]. The spans in
+        one group share the same buffer, in lower case if lower is True.
+        '''
+        order = sorted(xrange(len(spans)), key=lambda i: spans[i])
+        buffers = [None] * len(spans)
+        group = []
+        group_name = None
+        group_end = None
+        for i in order:
+            (name, start, end) = spans[i]
+            if group and (name != group_name or start > group_end):
+                self._fill_group(group, spans, buffers, group_name, group_end, lower)
+                group = []
+
+            if not group:
+                group_name = name
+                group_end = end
+            group.append(i)
+            group_end = max(group_end, end)
+
+        if group:
+            self._fill_group(group, spans, buffers, group_name, group_end, lower)
+
+        return buffers
+
+    def _fill_group(self, group, spans, buffers, name, end, lower):
+        '''Fetch the bases of the group once and share them'''
+        start = spans[group[0]][1]
+        seq = self.fetch(name, start, end)
+        if lower:
+            seq = seq.lower()
+        seq_buffer = (seq, start)
+        for i in group:
+            buffers[i] = seq_buffer
+
+    def close(self):
+        self.mm.close()
+        self.fh.close()
+
+def _apply_blocks(seq, start, end, blocks, convert):
+    '''Convert the parts of seq ([start, end) of the sequence) covered by
+    the sorted blocks'''
+    (starts, sizes) = blocks
+    i = bisect_right(starts, start) - 1
+    if i < 0:
+        i = 0
+
+    parts = []
+    last = start
+    while i < len(starts) and starts[i] < end:
+        block_start = max(starts[i], last)
+        block_end = min(starts[i] + sizes[i], end)
+        if block_start < block_end:
+            parts.append(seq[(last - start) : (block_start - start)])
+            parts.append(convert(seq[(block_start - start) : (block_end - start)]))
+            last = block_end
+        i += 1
+
+    if not parts:
+        return seq
+
+    parts.append(seq[(last - start):])
+    return ''.join(parts)
+
+def parse_range(seq_range):
+    '''Split "name:start-end" into (name, start, end), a bare name is the
+    whole sequence'''
+    if ':' not in seq_range:
+        return (seq_range, 0, None)
+
+    (name, pos) = seq_range.rsplit(':', 1)
+    (start, end) = pos.split('-')
+    return (name, int(start), int(end))
+
+def main():
+    '''Main'''
+    options, args = get_opt()
+    try:
+        append(options.append, args[0], options.outfile)
+    except (IOError, ValueError), e:
+        print2stderr('Error: %s' % e)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- #
+'''Benchmark of MFEprimer-2.0 on seeded synthetic genomes.
+
+The genome and the primer panels only depend on the options, so the
+results of two commits with the same options can be compared:
+
+    test/benchmark.py -w /tmp/bench -o before.json
+    (check out the new commit)
+    test/benchmark.py -w /tmp/bench -o after.json -c before.json
+
+The genome has unique sequence and copies of a few repeat families with 2%
+substitutions. It is indexed --build_runs times at each k value, with the
+median wall time and the peak RSS of each indexing step. The primers of a
+panel are pairs drawn from the genome. Each panel is checked once to
+create the 3'-end DeltaG file of the database, then --runs times for the
+query latency percentiles, the throughput (primers per second at the
+median latency) and the stages reported by --stats_json of MFEprimer.py.
+MFEprimer.py of older commits without --stats_json is only timed by the
+wall clock, the stages are left out.
+
+The tree to benchmark is the one of this script, or another checkout given
+with -m, such as an old commit:
+
+    git worktree add /tmp/old <commit>
+    test/benchmark.py -m /tmp/old -w /tmp/bench -o before.json
+
+With -c, the build times and median latencies are compared with the old
+results, and the exit status is 1 if any of them is slower by more than
+the tolerance.
+'''
+
+Date = '2026-10-18'
+Version = '1.0'
+
+import os
+import sys
+import json
+import time
+import random
+import shlex
+import shutil
+import platform
+import subprocess
+from optparse import OptionParser
+
+# MFEprimer tree to benchmark, changed by -m
+MFEHOME = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BASES = 'ACGT'
+COMPLEMENT = {'A' : 'T', 'C' : 'G', 'G' : 'C', 'T' : 'A'}
+
+# Parameters of the genome, the results are comparable only if they agree
+GENOME_OPTIONS = ['genome_size', 'contigs', 'repeat', 'families', 'seed']
+
+# Differences below this many seconds are noise, not regressions
+MIN_DIFF = 0.05
+
+def get_opt():
+    '''Handle options'''
+    usage = 'Usage: %prog [options]'
+    version = '%prog Version: ' + '%s [%s]' % (Version, Date)
+    parser = OptionParser(usage=usage, version=version)
+    parser.add_option('-m', '--mfe_home', dest='mfe_home', help='Directory of the MFEprimer tree to benchmark, default = the tree of this script. [String]')
+    parser.add_option('-w', '--work_dir', dest='work_dir', default='benchmark', help='Directory for the genomes, indexes and outputs, default = benchmark. [String]')
+    parser.add_option('-o', '--outfile', dest='outfile', help='Write the results to this file in JSON format. [String]')
+    parser.add_option('-c', '--compare', dest='compare', help='Compare with the results of an earlier run in this file. [String]')
+    parser.add_option('--tolerance', dest='tolerance', type='float', default=0.2, help='Allowed slow down in the comparison, default = 0.2 (20%). [Float]')
+    parser.add_option('-s', '--seed', dest='seed', type='int', default=1, help='Seed of the genome and the primers, default = 1. [Integer]')
+    parser.add_option('-g', '--genome_size', dest='genome_size', type='int', default=2000000, help='Genome size in bases, default = 2000000. [Integer]')
+    parser.add_option('--contigs', dest='contigs', type='int', default=4, help='Number of sequences of the genome, default = 4. [Integer]')
+    parser.add_option('-r', '--repeat', dest='repeat', type='float', default=0.1, help='Fraction of the genome in repeat copies, default = 0.1. [Float]')
+    parser.add_option('--families', dest='families', type='int', default=5, help='Number of repeat families, default = 5. [Integer]')
+    parser.add_option('-k', '--k_values', dest='k_values', default='7,9', help='K values of the indexes, default = 7,9. [String]')
+    parser.add_option('-p', '--panels', dest='panels', default='10,100,1000', help='Number of primers in each panel, 10 to 10000, default = 10,100,1000. [String]')
+    parser.add_option('-n', '--runs', dest='runs', type='int', default=5, help='Runs of each panel, default = 5. [Integer]')
+    parser.add_option('-b', '--build_runs', dest='build_runs', type='int', default=3, help='Runs of the indexing at each k value, default = 3. [Integer]')
+    parser.add_option('--pairs', dest='pairs', action='store_true', default=False, help='Only check the pairs of each panel (--pairs of MFEprimer.py) instead of all primer combinations.')
+    parser.add_option('-a', '--args', dest='args', default='', help='More options of MFEprimer.py, such as "--ppc 50 -t 4". [String]')
+    [options, args] = parser.parse_args()
+
+    if args:
+        parser.error('Incorrect argument, add" "-h" for help.')
+
+    try:
+        options.k_values = [int(k) for k in options.k_values.split(',')]
+        options.panels = [int(n) for n in options.panels.split(',')]
+    except ValueError:
+        parser.error('K values and panels must be integers separated by ",".')
+
+    for n in options.panels:
+        if n < 10 or n > 10000:
+            parser.error('The panels must have 10 to 10000 primers.')
+    if options.genome_size < 10000 or options.contigs < 1 or options.runs < 1 or options.build_runs < 1:
+        parser.error('Illegal genome size, contigs or runs.')
+    if options.repeat < 0 or options.repeat >= 1:
+        parser.error('The repeat fraction must be in [0, 1).')
+
+    return options
+
+def random_seq(rng, size):
+    '''Random sequence of the size'''
+    return ''.join([rng.choice(BASES) for i in xrange(size)])
+
+def mutate(rng, seq, rate):
+    '''Copy of the sequence with substitutions at the rate'''
+    seq = list(seq)
+    for i in xrange(len(seq)):
+        if rng.random() < rate:
+            seq[i] = rng.choice(BASES.replace(seq[i], ''))
+
+    return ''.join(seq)
+
+def reverse_complement(seq):
+    return ''.join([COMPLEMENT[base] for base in reversed(seq)])
+
+def make_genome(options):
+    '''Return the sequences of the synthetic genome'''
+    rng = random.Random(options.seed)
+    families = [random_seq(rng, rng.randint(300, 3000)) for i in xrange(options.families)]
+
+    contig_size = options.genome_size // options.contigs
+    contigs = []
+    for n in xrange(options.contigs):
+        copies = []
+        repeat_size = 0
+        while families and repeat_size < options.repeat * contig_size:
+            copy = mutate(rng, rng.choice(families), 0.02)
+            if rng.random() < 0.5:
+                copy = reverse_complement(copy)
+            copies.append(copy)
+            repeat_size += len(copy)
+
+        unique = random_seq(rng, max(contig_size - repeat_size, 0))
+        offsets = sorted([rng.randint(0, len(unique)) for copy in copies])
+        pieces = []
+        last = 0
+        for offset, copy in zip(offsets, copies):
+            pieces.append(unique[last:offset])
+            pieces.append(copy)
+            last = offset
+        pieces.append(unique[last:])
+        contigs.append(''.join(pieces))
+
+    return contigs
+
+def write_fasta(filename, records):
+    '''Write (id, seq) records'''
+    fo = open(filename, 'w')
+    for (seq_id, seq) in records:
+        fo.write('>%s%s' % (seq_id, os.linesep))
+        for i in xrange(0, len(seq), 60):
+            fo.write(seq[i:(i+60)] + os.linesep)
+    fo.close()
+
+def make_panel(options, contigs, count):
+    '''Return the primers (id, seq) and the pairs of a panel, drawn from the
+    genome with its own seed, so a panel does not depend on the others'''
+    rng = random.Random(options.seed * 100003 + count)
+    primers = []
+    pairs = []
+    while len(primers) < count:
+        seq = rng.choice(contigs)
+        size = rng.randint(100, 1000)
+        start = rng.randint(0, len(seq) - size)
+        fp = seq[start:(start+20)]
+        rp = reverse_complement(seq[(start+size-20):(start+size)])
+        n = len(pairs) + 1
+        primers.append(('P%s_F' % n, fp))
+        if len(primers) < count:
+            primers.append(('P%s_R' % n, rp))
+            pairs.append(('P%s_F' % n, 'P%s_R' % n))
+
+    return primers, pairs
+
+def run_command(args, log):
+    '''Run the command, return (wall time, peak RSS in MB) of the process'''
+    fo = open(log, 'a')
+    start = time.time()
+    process = subprocess.Popen(args, stdout=fo, stderr=subprocess.STDOUT)
+    (pid, status, rusage) = os.wait4(process.pid, 0)
+    wall = time.time() - start
+    fo.close()
+
+    if not os.WIFEXITED(status) or os.WEXITSTATUS(status) != 0:
+        print >> sys.stderr, 'Error: %s failed, see %s' % (' '.join(args), log)
+        exit(1)
+
+    if sys.platform == 'darwin':
+        # Bytes on Mac, KB on Linux
+        return wall, rusage.ru_maxrss / 1024.0 / 1024.0
+    return wall, rusage.ru_maxrss / 1024.0
+
+def fatotwobit():
+    '''faToTwoBit of the platform, as in IndexDb.sh'''
+    if sys.platform == 'darwin':
+        system = 'mac'
+    else:
+        system = 'linux'
+    if sys.maxsize > 2**32:
+        bits = '64'
+    else:
+        bits = '32'
+
+    return os.path.join(MFEHOME, 'bin', system, bits, 'faToTwoBit')
+
+def build_index(options, genome_file, k):
+    '''Index the genome for the k value in a new directory --build_runs
+    times, return the database and the steps [{'step', 'wall',
+    'peak_memory'}, ...] with the median wall time'''
+    db_dir = os.path.join(options.work_dir, 'k%s' % k)
+    db = os.path.join(db_dir, 'genome.fa')
+    python = sys.executable
+    commands = [
+        ('unifasta', [python, os.path.join(MFEHOME, 'chilli', 'UniFastaFormat.py'), '-i', db]),
+        ('faToTwoBit', [fatotwobit(), db + '.unifasta', db + '.2bit']),
+        ('mfe_index_db', [python, os.path.join(MFEHOME, 'chilli', 'mfe_index_db.py'), '-f', db + '.unifasta', '-k', str(k)]),
+    ]
+
+    walls = [[] for command in commands]
+    memories = [0.0 for command in commands]
+    for n in xrange(options.build_runs):
+        # No files of earlier runs, such as the 3'-end DeltaG file
+        if os.path.isdir(db_dir):
+            shutil.rmtree(db_dir)
+        os.makedirs(db_dir)
+        shutil.copy(genome_file, db)
+
+        for i in xrange(len(commands)):
+            (wall, memory) = run_command(commands[i][1], os.path.join(db_dir, 'index.log'))
+            walls[i].append(wall)
+            memories[i] = max(memories[i], memory)
+        os.remove(db + '.unifasta')
+
+    steps = []
+    for i in xrange(len(commands)):
+        steps.append({'step' : commands[i][0], 'wall' : percentile(walls[i], 50), 'peak_memory' : memories[i]})
+
+    return db, steps
+
+def percentile(values, p):
+    '''Nearest-rank percentile'''
+    values = sorted(values)
+    rank = int(round(p / 100.0 * len(values) + 0.5))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+def mfeprimer_options():
+    '''Long options in the help of MFEprimer.py of the tree'''
+    process = subprocess.Popen([sys.executable, os.path.join(MFEHOME, 'MFEprimer.py'), '-h'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    words = [word.strip('[],') for word in process.communicate()[0].split()]
+    return set([word for word in words if word.startswith('--')])
+
+def run_panel(options, db, k, count, primer_file, pair_file):
+    '''Check the panel --runs times, return the query results'''
+    out_dir = os.path.dirname(db)
+    out_file = os.path.join(out_dir, 'p%s.tab' % count)
+    stats_file = os.path.join(out_dir, 'p%s.stats.json' % count)
+    args = [sys.executable, os.path.join(MFEHOME, 'MFEprimer.py'), '-i', primer_file, '-d', db, '-k', str(k), '--tab', '-o', out_file]
+    if options.stats_json:
+        args.extend(['--stats_json', stats_file])
+    if options.pairs:
+        args.extend(['--pairs', pair_file])
+    args.extend(shlex.split(options.args))
+
+    # The first run creates the 3'-end DeltaG file
+    run_command(args, os.path.join(out_dir, 'query.log'))
+
+    latencies = []
+    memories = []
+    stages = {}
+    for n in xrange(options.runs):
+        (wall, memory) = run_command(args, os.path.join(out_dir, 'query.log'))
+        latencies.append(wall)
+        memories.append(memory)
+        if not options.stats_json:
+            continue
+        for record in json.load(open(stats_file))['stages']:
+            stage = stages.setdefault(record['stage'], {'wall' : [], 'cpu' : [], 'process_peak_rss' : 0.0, 'counts' : record['counts']})
+            stage['wall'].append(record['wall'])
+            stage['cpu'].append(record['cpu'])
+            # Named peak_memory before it was labelled as process peak RSS
+            peak_rss = record.get('process_peak_rss', record.get('peak_memory', 0.0))
+            stage['process_peak_rss'] = max(stage['process_peak_rss'], peak_rss)
+
+    for stage in stages.itervalues():
+        stage['wall'] = percentile(stage['wall'], 50)
+        stage['cpu'] = percentile(stage['cpu'], 50)
+
+    amplicons = len(open(out_file).readlines()) - 1
+    p50 = percentile(latencies, 50)
+    return {
+        'k' : k,
+        'primers' : count,
+        'amplicons' : amplicons,
+        'p50' : p50,
+        'p90' : percentile(latencies, 90),
+        'p99' : percentile(latencies, 99),
+        'throughput' : count / p50,
+        'peak_memory' : max(memories),
+        'stages' : stages,
+    }
+
+def git_commit():
+    '''Commit of the MFEprimer tree, None if unknown'''
+    try:
+        process = subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'], cwd=MFEHOME, stdout=subprocess.PIPE, stderr=open(os.devnull, 'w'))
+        commit = process.communicate()[0].strip()
+    except OSError:
+        return None
+
+    return commit or None
+
+def print_results(results):
+    '''Print the tables of the build and query results'''
+    print 'Commit: %s' % results['commit']
+    print 'Genome: %(genome_size)s bases, %(contigs)s contigs, repeat %(repeat)s, %(families)s families, seed %(seed)s' % results['options']
+    print
+    print 'Build'.ljust(8) + 'Step'.ljust(16) + 'Wall [s]'.rjust(10) + 'Mem [MB]'.rjust(10)
+    for build in results['builds']:
+        for step in build['steps']:
+            print ('k=%s' % build['k']).ljust(8) + step['step'].ljust(16) + ('%.3f' % step['wall']).rjust(10) + ('%.1f' % step['peak_memory']).rjust(10)
+        print ('k=%s' % build['k']).ljust(8) + 'total'.ljust(16) + ('%.3f' % build['wall']).rjust(10)
+
+    print
+    print 'Query'.ljust(8) + 'Primers'.rjust(8) + 'Amplicons'.rjust(10) + 'p50 [s]'.rjust(10) + 'p90 [s]'.rjust(10) + 'p99 [s]'.rjust(10) + 'Primers/s'.rjust(11) + 'Mem [MB]'.rjust(10)
+    for query in results['queries']:
+        print ('k=%s' % query['k']).ljust(8) + str(query['primers']).rjust(8) + str(query['amplicons']).rjust(10) + ('%.3f' % query['p50']).rjust(10) + ('%.3f' % query['p90']).rjust(10) + ('%.3f' % query['p99']).rjust(10) + ('%.1f' % query['throughput']).rjust(11) + ('%.1f' % query['peak_memory']).rjust(10)
+
+    print
+    if not any([query['stages'] for query in results['queries']]):
+        print 'Stages: not available, MFEprimer.py has no --stats_json'
+        return
+
+    print 'Stage'.ljust(18) + 'Query'.ljust(16) + 'Wall [s]'.rjust(10) + 'CPU [s]'.rjust(10) + 'Peak RSS [MB]'.rjust(15)
+    for query in results['queries']:
+        name = 'k=%s, %s' % (query['k'], query['primers'])
+        for stage in sorted(query['stages'], key=lambda stage: -query['stages'][stage]['wall']):
+            record = query['stages'][stage]
+            print stage.ljust(18) + name.ljust(16) + ('%.3f' % record['wall']).rjust(10) + ('%.3f' % record['cpu']).rjust(10) + ('%.1f' % record['process_peak_rss']).rjust(15)
+
+def compare(results, old, tolerance):
+    '''Print the changes from the old results, return the number of
+    regressions'''
+    for name in GENOME_OPTIONS:
+        if results['options'][name] != old['options'][name]:
+            print >> sys.stderr, 'Error: the results have different %s, they are not comparable' % name
+            exit(1)
+
+    rows = []
+    old_builds = dict([(build['k'], build) for build in old['builds']])
+    for build in results['builds']:
+        if build['k'] in old_builds:
+            rows.append(('build k=%s' % build['k'], old_builds[build['k']]['wall'], build['wall'], None))
+
+    old_queries = dict([((query['k'], query['primers']), query) for query in old['queries']])
+    for query in results['queries']:
+        key = (query['k'], query['primers'])
+        if key in old_queries:
+            old_query = old_queries[key]
+            if old_query['amplicons'] != query['amplicons']:
+                note = 'amplicons %s -> %s' % (old_query['amplicons'], query['amplicons'])
+            else:
+                note = None
+            rows.append(('query k=%s, %s' % key, old_query['p50'], query['p50'], note))
+
+    print
+    print 'Compared with %s' % old['commit']
+    print 'Item'.ljust(22) + 'Old [s]'.rjust(10) + 'New [s]'.rjust(10) + 'Change'.rjust(10)
+    regressions = 0
+    for (name, old_time, new_time, note) in rows:
+        change = (new_time - old_time) / max(old_time, 1e-6)
+        line = name.ljust(22) + ('%.3f' % old_time).rjust(10) + ('%.3f' % new_time).rjust(10) + ('%+.1f%%' % (change * 100)).rjust(10)
+        if change > tolerance and new_time - old_time > MIN_DIFF:
+            regressions += 1
+            line += '  SLOWER'
+        if note:
+            line += '  ' + note
+        print line
+
+    return regressions
+
+def main():
+    '''Main'''
+    options = get_opt()
+    if options.mfe_home:
+        global MFEHOME
+        MFEHOME = os.path.abspath(options.mfe_home)
+        if not os.path.isfile(os.path.join(MFEHOME, 'MFEprimer.py')):
+            print >> sys.stderr, 'Error: no MFEprimer.py in %s' % MFEHOME
+            exit(1)
+
+    mfe_options = mfeprimer_options()
+    options.stats_json = '--stats_json' in mfe_options
+    if not options.stats_json:
+        print >> sys.stderr, 'Warning: MFEprimer.py has no --stats_json, only the wall time of the runs is measured'
+    if options.pairs and '--pairs' not in mfe_options:
+        print >> sys.stderr, 'Error: MFEprimer.py has no --pairs'
+        exit(1)
+
+    if not os.path.isdir(options.work_dir):
+        os.makedirs(options.work_dir)
+
+    genome_file = os.path.join(options.work_dir, 'genome.fa')
+    contigs = make_genome(options)
+    write_fasta(genome_file, [('chr%s' % (n + 1), seq) for n, seq in enumerate(contigs)])
+
+    panels = {}
+    for count in options.panels:
+        (primers, pairs) = make_panel(options, contigs, count)
+        primer_file = os.path.join(options.work_dir, 'panel%s.fa' % count)
+        pair_file = os.path.join(options.work_dir, 'panel%s.pairs' % count)
+        write_fasta(primer_file, primers)
+        fo = open(pair_file, 'w')
+        for pair in pairs:
+            fo.write('%s\t%s%s' % (pair[0], pair[1], os.linesep))
+        fo.close()
+        panels[count] = (primer_file, pair_file)
+
+    results = {
+        'commit' : git_commit(),
+        'date' : time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python' : platform.python_version(),
+        'platform' : platform.platform(),
+        'options' : {
+            'genome_size' : options.genome_size,
+            'contigs' : options.contigs,
+            'repeat' : options.repeat,
+            'families' : options.families,
+            'seed' : options.seed,
+            'runs' : options.runs,
+            'build_runs' : options.build_runs,
+            'pairs' : options.pairs,
+            'args' : options.args,
+        },
+        'builds' : [],
+        'queries' : [],
+    }
+    for k in options.k_values:
+        (db, steps) = build_index(options, genome_file, k)
+        results['builds'].append({
+            'k' : k,
+            'wall' : sum([step['wall'] for step in steps]),
+            'steps' : steps,
+        })
+        for count in options.panels:
+            (primer_file, pair_file) = panels[count]
+            results['queries'].append(run_panel(options, db, k, count, primer_file, pair_file))
+
+    print_results(results)
+    if options.outfile:
+        fo = open(options.outfile, 'w')
+        json.dump(results, fo, indent=1, sort_keys=True)
+        fo.write(os.linesep)
+        fo.close()
+
+    if options.compare:
+        regressions = compare(results, json.load(open(options.compare)), options.tolerance)
+        if regressions:
+            print >> sys.stderr, '%s regressions above %.0f%%' % (regressions, options.tolerance * 100)
+            exit(1)
+
+if __name__ == '__main__':
+    main()
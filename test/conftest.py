@@ -0,0 +1,122 @@
+'''Fixtures of the tests: run "python -m pytest test" in the MFEprimer
+directory. The databases are indexed from the files of this directory in
+a temporary directory.'''
+
+import os
+import sys
+import random
+import shutil
+import subprocess
+
+import pytest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+MFEHOME = os.path.dirname(TEST_DIR)
+sys.path.insert(0, MFEHOME)
+
+from chilli import Seq
+
+def fatotwobit():
+    '''faToTwoBit of the platform, as in IndexDb.sh'''
+    if sys.platform == 'darwin':
+        system = 'mac'
+    else:
+        system = 'linux'
+    if sys.maxsize > 2**32:
+        bits = '64'
+    else:
+        bits = '32'
+
+    return os.path.join(MFEHOME, 'bin', system, bits, 'faToTwoBit')
+
+def index_db(db, k=9):
+    '''Index the FASTA file db as IndexDb.sh'''
+    python = sys.executable
+    for args in ([python, os.path.join(MFEHOME, 'chilli', 'UniFastaFormat.py'), '-i', db],
+            [fatotwobit(), db + '.unifasta', db + '.2bit'],
+            [python, os.path.join(MFEHOME, 'chilli', 'mfe_index_db.py'), '-f', db + '.unifasta', '-k', str(k)]):
+        subprocess.check_call(args, stdout=open(os.devnull, 'w'))
+    os.remove(db + '.unifasta')
+
+    return db
+
+def append_db(db, fasta_file, k=None):
+    '''Append the FASTA file to the indexed database db with IndexDb.sh -a,
+    return the exit status'''
+    args = ['bash', os.path.join(MFEHOME, 'IndexDb.sh'), '-a', db, fasta_file]
+    if k is not None:
+        args.append(str(k))
+    # The scripts of IndexDb.sh run with the Python of the tests
+    env = dict(os.environ)
+    env['PATH'] = os.path.dirname(sys.executable) + os.pathsep + env.get('PATH', '')
+    return subprocess.call(args, stdout=open(os.devnull, 'w'), stderr=open(os.devnull, 'w'), env=env)
+
+@pytest.fixture(scope='session')
+def rna_db(tmpdir_factory):
+    '''test.rna indexed with k = 9'''
+    db = str(tmpdir_factory.mktemp('rna').join('test.rna'))
+    shutil.copy(os.path.join(TEST_DIR, 'test.rna'), db)
+
+    return index_db(db)
+
+def random_records(seed=1):
+    '''(id, seq) of a few random sequences with N runs and lower case
+    (masked) runs'''
+    rand = random.Random(seed)
+    records = []
+    for (n, size) in enumerate((3, 250, 1000, 2333)):
+        seq = [rand.choice('ACGT') for i in xrange(size)]
+        for (run, count) in (('N', 3), ('lower', 4)):
+            for i in xrange(count * size // 500):
+                start = rand.randrange(size)
+                stop = min(size, start + rand.randrange(1, 40))
+                for j in xrange(start, stop):
+                    if run == 'N':
+                        seq[j] = 'N'
+                    elif seq[j] != 'N':
+                        seq[j] = seq[j].lower()
+        records.append(('seq%s' % n, ''.join(seq)))
+
+    return records
+
+def write_fasta(filename, records, width=60):
+    '''Write the (id, seq) records'''
+    fo = open(filename, 'w')
+    for (seq_name, seq) in records:
+        fo.write('>%s test sequence\n' % seq_name)
+        for i in xrange(0, len(seq), width):
+            fo.write(seq[i : (i+width)] + '\n')
+    fo.close()
+
+    return filename
+
+@pytest.fixture(scope='session')
+def masked_records():
+    return random_records()
+
+@pytest.fixture(scope='session')
+def masked_db(tmpdir_factory, masked_records):
+    '''The masked records indexed with k = 5'''
+    db = str(tmpdir_factory.mktemp('masked').join('masked.fa'))
+    write_fasta(db, masked_records)
+
+    return index_db(db, k=5)
+
+@pytest.fixture(scope='session')
+def masked_primers(masked_records):
+    '''(id, seq) of 4 pairs of 12 bp primers of the longest masked record,
+    which give many amplicons with ppc = 10 on the masked_db'''
+    rand = random.Random(2)
+    seq = masked_records[-1][1].upper()
+    primers = []
+    for n in xrange(4):
+        start = rand.randrange(len(seq) - 300)
+        primers.append(('p%sf' % n, seq[start : (start+12)]))
+        primers.append(('p%sr' % n, Seq.rev_com(seq[(start+200) : (start+212)])))
+
+    return primers
+
+@pytest.fixture
+def primers():
+    '''The primers of p.fa in FASTA format'''
+    return open(os.path.join(TEST_DIR, 'p.fa')).read()
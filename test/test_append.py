@@ -0,0 +1,88 @@
+'''Appending to an indexed database gives the same files as indexing all
+the sequences at once'''
+
+import os
+
+import pytest
+
+from conftest import index_db, append_db, random_records, write_fasta
+from chilli import mer_index
+from chilli import twobit
+from chilli import contig_table
+
+K = 5
+
+@pytest.fixture(scope='module')
+def databases(tmpdir_factory):
+    '''(full, appended) databases of the same records'''
+    tmpdir = tmpdir_factory.mktemp('append')
+    records = random_records(seed=3)
+    full = index_db(write_fasta(str(tmpdir.join('full.fa')), records), k=K)
+    appended = index_db(write_fasta(str(tmpdir.join('appended.fa')), records[:2]), k=K)
+    assert append_db(appended, write_fasta(str(tmpdir.join('new1.fa')), records[2:3]), k=K) == 0
+    # The k of the index without a k-value
+    assert append_db(appended, write_fasta(str(tmpdir.join('new2.fa')), records[3:])) == 0
+    assert not tmpdir.join('new2.fa.unifasta').check()
+    assert not tmpdir.join('new2.fa.2bit').check()
+
+    return records, full, appended
+
+def test_index(databases):
+    (records, full, appended) = databases
+    full_index = mer_index.MerIndex(mer_index.index_name(full))
+    appended_index = mer_index.MerIndex(mer_index.index_name(appended))
+    assert appended_index.k == full_index.k
+    for mer_id in xrange(full_index.mer_count):
+        assert appended_index.lookup(mer_id) == full_index.lookup(mer_id)
+    full_index.close()
+    appended_index.close()
+
+def test_twobit(databases):
+    (records, full, appended) = databases
+    full_twobit = twobit.TwoBit(full + '.2bit')
+    appended_twobit = twobit.TwoBit(appended + '.2bit')
+    for (seq_id, (seq_name, seq)) in enumerate(records):
+        name = str(seq_id)
+        assert appended_twobit.fetch(name) == seq
+        # Same size, N blocks and mask blocks
+        assert appended_twobit.record(name)[:3] == full_twobit.record(name)[:3]
+    full_twobit.close()
+    appended_twobit.close()
+
+def test_contig_table(databases):
+    (records, full, appended) = databases
+    full_table = contig_table.load(full + '.uni')
+    appended_table = contig_table.load(appended + '.uni')
+    assert list(appended_table.records()) == list(full_table.records())
+    assert [seq_name for (seq_name, desc, size) in appended_table.records()] == [seq_name for (seq_name, seq) in records]
+    full_table.close()
+    appended_table.close()
+
+def test_append_twice(databases):
+    # The sequences of the database can not be appended again
+    (records, full, appended) = databases
+    with pytest.raises(ValueError):
+        twobit.append(appended + '.2bit', full + '.2bit')
+
+def database_files(db):
+    return dict([(ext, open(db + ext, 'rb').read()) for ext in ('.uni', '.2bit', '.idx')])
+
+@pytest.fixture
+def small_db(tmpdir):
+    return index_db(write_fasta(str(tmpdir.join('small.fa')), random_records(seed=4)[:2]), k=K)
+
+def test_wrong_k_value(small_db, tmpdir):
+    # The index step fails after the contig table and the .2bit file of
+    # the new sequences are written, the database is not changed
+    files = database_files(small_db)
+    new_file = write_fasta(str(tmpdir.join('new.fa')), random_records(seed=5)[1:3])
+    assert append_db(small_db, new_file, k=K + 2) != 0
+    assert database_files(small_db) == files
+    assert sorted(os.listdir(str(tmpdir))) == ['new.fa', 'small.fa', 'small.fa.2bit', 'small.fa.idx', 'small.fa.uni']
+
+def test_not_indexed(small_db, tmpdir):
+    new_file = write_fasta(str(tmpdir.join('new.fa')), random_records(seed=5)[1:3])
+    os.remove(small_db + '.idx')
+    files = dict([(ext, open(small_db + ext, 'rb').read()) for ext in ('.uni', '.2bit')])
+    assert append_db(small_db, new_file, k=K) != 0
+    assert dict([(ext, open(small_db + ext, 'rb').read()) for ext in ('.uni', '.2bit')]) == files
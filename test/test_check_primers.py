@@ -0,0 +1,70 @@
+'''Tests of the errors of MFEprimer.check_primers()'''
+
+import pytest
+
+import MFEprimer
+
+def test_check_primers(rna_db, primers):
+    amplicons = MFEprimer.check_primers(primers, [rna_db])
+    assert amplicons
+    assert amplicons[0].id == 1
+
+def test_wrong_k_value(rna_db, primers):
+    with pytest.raises(ValueError) as e:
+        MFEprimer.check_primers(primers, [rna_db], k_value=7)
+    assert 'k = 9' in str(e.value)
+
+def test_unknown_primer_of_pairs(rna_db, primers):
+    with pytest.raises(ValueError):
+        MFEprimer.check_primers(primers, [rna_db], pairs=[('no_such_primer', 'PSC1_T1_Mus_AQP11_0_rp')])
+
+def test_illegal_pair_file(rna_db, primers, tmpdir):
+    pair_file = tmpdir.join('pairs.txt')
+    pair_file.write('one field\n')
+    with pytest.raises(ValueError) as e:
+        MFEprimer.check_primers(primers, [rna_db], pairs=str(pair_file))
+    assert 'line 1' in str(e.value)
+
+def test_missing_pair_file(rna_db, primers, tmpdir):
+    with pytest.raises(ValueError):
+        MFEprimer.check_primers(primers, [rna_db], pairs=str(tmpdir.join('missing.txt')))
+
+def test_missing_database(primers, tmpdir):
+    with pytest.raises(ValueError):
+        MFEprimer.check_primers(primers, [str(tmpdir.join('missing'))])
+
+def test_missing_database_object(tmpdir):
+    with pytest.raises(ValueError):
+        MFEprimer.Database(str(tmpdir.join('missing')))
+
+def test_illegal_option(rna_db, primers):
+    with pytest.raises(ValueError):
+        MFEprimer.check_primers(primers, [rna_db], ppc=200)
+
+def test_unknown_option(rna_db, primers):
+    with pytest.raises(ValueError):
+        MFEprimer.check_primers(primers, [rna_db], no_such_option=1)
+
+def test_illegal_primers(rna_db):
+    with pytest.raises(ValueError):
+        MFEprimer.check_primers('not a FASTA file', [rna_db])
+
+def test_jobs_and_threads(rna_db, primers):
+    with pytest.raises(ValueError) as e:
+        MFEprimer.check_primers(primers, [rna_db, rna_db], jobs=2, threads=2)
+    assert '-j' in str(e.value)
+
+    # With one database -j has no effect
+    assert MFEprimer.check_primers(primers, [rna_db], jobs=2, threads=2)
+
+def test_seed_protect(rna_db, primers):
+    # seed_protect is only checked for seed_mismatches = 1
+    assert MFEprimer.check_primers(primers, [rna_db], seed_protect=9)
+    with pytest.raises(ValueError):
+        MFEprimer.check_primers(primers, [rna_db], seed_mismatches=1, seed_protect=9)
+
+def test_error_in_worker(rna_db, primers, tmpdir):
+    # The databases are opened in the worker processes of -j
+    with pytest.raises(MFEprimer.MFEprimerError) as e:
+        MFEprimer.check_primers(primers, [rna_db, str(tmpdir.join('missing'))], jobs=2)
+    assert 'missing' in str(e.value)
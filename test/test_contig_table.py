@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*- #
+'''Tests of chilli/contig_table.py'''
+
+import json
+
+import pytest
+
+from chilli import contig_table
+
+RECORDS = [
+    (u'chr1', u'first sequence', 248956422),
+    (u'empty', u'', 0),
+    (u'NM_000546.6', u'Homo sapiens tumor protein p53 (TP53), transcript variant 1, mRNA', 2512),
+    (u'sp\xe9cial', u'α-globin', 7),
+]
+
+def test_write_read(tmpdir):
+    filename = str(tmpdir.join('db.uni'))
+    contig_table.write(filename, iter(RECORDS))
+    assert contig_table.is_table(filename)
+    assert not tmpdir.join('db.uni.tmp').check()
+    assert not tmpdir.join('db.uni.heap').check()
+
+    table = contig_table.ContigTable(filename)
+    assert len(table) == len(RECORDS)
+    assert list(table.records()) == RECORDS
+    assert table.record(2) == RECORDS[2]
+    assert table.keys() == ['0', '1', '2', '3']
+    assert table['3'] == {'id' : RECORDS[3][0], 'desc' : RECORDS[3][1], 'size' : RECORDS[3][2]}
+    assert table[0]['id'] == u'chr1'
+    assert '4' not in table and 'x' not in table
+    assert table.get('4') is None
+    with pytest.raises(KeyError):
+        table['-1']
+    table.close()
+
+def test_empty_table(tmpdir):
+    filename = str(tmpdir.join('db.uni'))
+    contig_table.write(filename, [])
+    table = contig_table.ContigTable(filename)
+    assert len(table) == 0
+    assert list(table.records()) == []
+    table.close()
+
+def test_not_a_table(tmpdir):
+    filename = tmpdir.join('db.uni')
+    filename.write('{}')
+    assert not contig_table.is_table(str(filename))
+    with pytest.raises(ValueError):
+        contig_table.ContigTable(str(filename))
+
+def test_json_cache(tmpdir):
+    # The old JSON cache is read by load() and converted in place
+    filename = str(tmpdir.join('db.uni'))
+    cache = dict([(str(n), {'id' : seq_name, 'desc' : desc, 'size' : size}) for (n, (seq_name, desc, size)) in enumerate(RECORDS)])
+    del cache['1']
+    json.dump(cache, open(filename, 'w'))
+    assert contig_table.load(filename) == cache
+    assert list(contig_table.cache_records(cache)) == [RECORDS[0], ('', '', 0)] + RECORDS[2:]
+
+    contig_table.convert(filename)
+    table = contig_table.load(filename)
+    assert isinstance(table, contig_table.ContigTable)
+    assert list(table.records()) == [RECORDS[0], ('', '', 0)] + RECORDS[2:]
+    table.close()
+
+def test_database_table(masked_db, masked_records):
+    # The table written by UniFastaFormat.py
+    table = contig_table.load(masked_db + '.uni')
+    assert list(table.records()) == [(seq_name, u'test sequence', len(seq)) for (seq_name, seq) in masked_records]
+    table.close()
@@ -0,0 +1,52 @@
+'''Tests of the degenerate primers, which must give the amplicons of their
+best matching variants'''
+
+import pytest
+
+import MFEprimer
+from chilli import FastaFormatParser
+from chilli import DegenerateSeqConvetor
+
+# The degenerate bases of a primer, one of them matches the original base
+DEGENERATE = {'A' : 'R', 'G' : 'R', 'C' : 'Y', 'T' : 'Y'}
+
+def degenerate(seq):
+    '''The seq with N as the second base and R or Y as the third base from
+    the 3' end'''
+    seq = seq.upper()
+    return seq[0] + 'N' + seq[2:-3] + DEGENERATE[seq[-3]] + seq[-2:]
+
+def row(amp, names):
+    '''Fields of the amplicon with the primer ids mapped by names'''
+    return (names.get(amp.fp_id, amp.fp_id), names.get(amp.rp_id, amp.rp_id), amp.hit_id, amp.ppc, amp.size, amp.gc,
+        amp.fp_tm, amp.rp_tm, amp.fp_dg, amp.rp_dg, amp.fp_3_dg, amp.rp_3_dg, amp.start, amp.stop, amp.seq)
+
+@pytest.fixture(params=['rna', 'masked'])
+def search(request, rna_db, primers, masked_db, masked_primers):
+    '''(primers, check_primers() on one of the databases with the params)'''
+    if request.param == 'rna':
+        primers = [(oligo['id'], oligo['seq']) for oligo in FastaFormatParser.parse(primers.splitlines())]
+        return primers, lambda primers, **params: MFEprimer.check_primers(primers, [rna_db], **params)
+
+    return masked_primers, lambda primers, **params: MFEprimer.check_primers(primers, [masked_db], k_value=5, ppc=10, **params)
+
+@pytest.mark.parametrize('n', [0, 3])
+def test_variants(search, n):
+    (primers, check) = search
+    (primer_id, seq) = primers[n]
+    primers = list(primers)
+    primers[n] = (primer_id, degenerate(seq))
+    amplicons = check(primers)
+    assert [amp for amp in amplicons if primer_id in (amp.fp_id, amp.rp_id)]
+
+    # The degenerate primer as its variants
+    variants = list(primers)
+    names = {}
+    for (m, variant) in enumerate(DegenerateSeqConvetor.iupac2normal(degenerate(seq))):
+        names['%s_%s' % (primer_id, m)] = primer_id
+        variants.append(('%s_%s' % (primer_id, m), variant))
+    del variants[n]
+    expanded = set([row(amp, names) for amp in check(variants)])
+
+    for amp in amplicons:
+        assert row(amp, {}) in expanded
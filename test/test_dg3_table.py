@@ -0,0 +1,86 @@
+'''Tests of the 3' DeltaG tables of a database and of the batch
+thermodynamics, which must give the same values as TmDeltaG.Cal'''
+
+import os
+import random
+import shutil
+
+import pytest
+
+import MFEprimer
+from chilli import Seq
+from chilli import TmDeltaG
+from conftest import TEST_DIR, index_db
+
+@pytest.fixture
+def database(tmpdir):
+    db = str(tmpdir.join('test.rna'))
+    shutil.copy(os.path.join(TEST_DIR, 'test.rna'), db)
+    database = MFEprimer.Database(index_db(db))
+    yield database
+    database.close()
+
+def dg3_files(database):
+    directory = os.path.dirname(database.name)
+    return sorted([name for name in os.listdir(directory) if '.dg3_' in name])
+
+def test_default_cache_file(database, primers):
+    pytest.importorskip('numpy')
+    MFEprimer.check_primers(primers, [database])
+    MFEprimer.check_primers(primers, [database], mono_conc=50.0)
+    assert dg3_files(database) == ['test.rna.dg3_50.0_1.5_0.25']
+
+def test_no_cache_file_for_other_concentrations(database, primers):
+    for mono_conc in (10, 20, 30, 40, 60, 70):
+        MFEprimer.check_primers(primers, [database], mono_conc=mono_conc)
+    assert dg3_files(database) == []
+    assert len(database.dg3_tables) == MFEprimer.MAX_DG3_TABLES
+    assert database.dg3_tables.keys()[-1] == (70.0, 1.5, 0.25)
+
+def random_duplexes(seed=3, count=500):
+    '''(qseq, sseq) of random primers and their targets with mismatches
+    and N bases, sseq is the target as in the alignment'''
+    rand = random.Random(seed)
+    duplexes = []
+    for n in xrange(count):
+        qseq = ''.join([rand.choice('ACGT') for i in xrange(rand.randint(5, 30))])
+        sseq = []
+        for base in qseq:
+            if rand.random() < 0.15:
+                sseq.append(rand.choice('ACGTN'))
+            else:
+                sseq.append(base)
+        duplexes.append((qseq, ''.join(sseq)))
+
+    return duplexes
+
+@pytest.fixture(params=['numpy', 'no numpy'])
+def thermo_module(request, monkeypatch):
+    '''TmDeltaG with or without NumPy'''
+    if request.param == 'numpy':
+        if TmDeltaG.numpy is None:
+            pytest.skip('NumPy is not installed')
+    else:
+        monkeypatch.setattr(TmDeltaG, 'numpy', None)
+
+    return TmDeltaG
+
+@pytest.mark.parametrize('conc', [
+    {},
+    {'mono_conc' : 20, 'diva_conc' : 3, 'oligo_conc' : 200, 'dntp_conc' : 0.8},
+])
+def test_batch_same_as_cal(thermo_module, conc):
+    # BatchCal gives the same bits as TmDeltaG.Cal
+    duplexes = random_duplexes()
+    thermo = thermo_module.BatchCal(**conc)
+    (Tm_list, DeltaG_list) = thermo.calTmDeltaG([qseq for (qseq, sseq) in duplexes], [Seq.complement(sseq) for (qseq, sseq) in duplexes])
+    for (n, (qseq, sseq)) in enumerate(duplexes):
+        cal = thermo_module.Cal(qseq, Seq.complement(sseq), **conc)
+        assert (Tm_list[n], DeltaG_list[n]) == (cal.Tm, cal.DeltaG)
+
+def test_dg3_same_as_calDeltaG(thermo_module):
+    conc = {'mono_conc' : 50, 'diva_conc' : 1.5, 'dntp_conc' : 0.25}
+    table = thermo_module.DeltaG3Table(**conc)
+    for (qseq, sseq) in random_duplexes(seed=4, count=2000):
+        (q, s) = (qseq[-5:], sseq[-5:])
+        assert table.get(q, s) == thermo_module.calDeltaG(q, Seq.complement(s), **conc)
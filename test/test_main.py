@@ -0,0 +1,44 @@
+'''Exit status of MFEprimer.py'''
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+from conftest import MFEHOME, TEST_DIR
+
+def mfeprimer(*args):
+    '''(exit status, STDOUT, STDERR) of MFEprimer.py'''
+    process = subprocess.Popen([sys.executable, os.path.join(MFEHOME, 'MFEprimer.py')] + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    (out, err) = process.communicate()
+    return process.returncode, out, err
+
+def test_success(rna_db, tmpdir):
+    (status, out, err) = mfeprimer('-i', os.path.join(TEST_DIR, 'p.fa'), '-d', rna_db, '--tab')
+    assert status == 0
+    assert out.startswith('AmpID\t')
+
+@pytest.mark.parametrize('args', [
+    # MFEprimerError
+    ['-d', '%(missing)s'],
+    ['-d', '%(db)s', '-k', '7'],
+    ['-d', '%(db)s', '--pairs', '%(pairs)s'],
+    # Illegal options
+    ['-d', '%(db)s', '%(db)s', '-j', '2', '-t', '2'],
+    ['-d', '%(db)s', '--ppc', '200'],
+])
+def test_errors(rna_db, tmpdir, args):
+    pair_file = tmpdir.join('pairs.txt')
+    pair_file.write('one field\n')
+    names = {'db' : rna_db, 'missing' : str(tmpdir.join('missing')), 'pairs' : str(pair_file)}
+    (status, out, err) = mfeprimer('-i', os.path.join(TEST_DIR, 'p.fa'), *[arg % names for arg in args])
+    assert status == 1
+    assert 'Error' in out + err
+
+def test_illegal_primers(rna_db, tmpdir):
+    primer_file = tmpdir.join('primers.fa')
+    primer_file.write('not a FASTA file\n')
+    (status, out, err) = mfeprimer('-i', str(primer_file), '-d', rna_db)
+    assert status == 1
+    assert 'Illegal line' in err
@@ -0,0 +1,49 @@
+'''Tests of the --max_hits and --max_hits_per_pair selections, which must
+be the same as truncating the full results'''
+
+import pytest
+
+import MFEprimer
+
+def rows(amplicons):
+    '''Lines of the tabular output without the AmpID'''
+    return [MFEprimer.tab_line(amp).split('\t', 1)[1] for amp in amplicons]
+
+def per_pair(amplicons, limit):
+    '''The first limit amplicons of each pair'''
+    counts = {}
+    selected = []
+    for amp in amplicons:
+        pair = MFEprimer.pair_key(amp.fp_id, amp.rp_id)
+        counts[pair] = counts.get(pair, 0) + 1
+        if counts[pair] <= limit:
+            selected.append(amp)
+
+    return selected
+
+@pytest.fixture(params=['rna', 'masked'])
+def search(request, rna_db, primers, masked_db, masked_primers):
+    '''check_primers() on one of the databases with the other params'''
+    if request.param == 'rna':
+        return lambda **params: MFEprimer.check_primers(primers, [rna_db], **params)
+
+    return lambda **params: MFEprimer.check_primers(masked_primers, [masked_db], k_value=5, ppc=10, **params)
+
+def test_max_hits(search):
+    amplicons = search()
+    for max_hits in (1, 3, 7, len(amplicons) + 1):
+        selected = search(max_hits=max_hits)
+        assert rows(selected) == rows(amplicons[:max_hits])
+        assert [amp.id for amp in selected] == range(1, len(selected) + 1)
+
+def test_max_hits_per_pair(search):
+    amplicons = search()
+    for limit in (1, 2):
+        assert rows(search(max_hits_per_pair=limit)) == rows(per_pair(amplicons, limit))
+        assert rows(search(max_hits=3, max_hits_per_pair=limit)) == rows(per_pair(amplicons, limit)[:3])
+
+def test_selection_not_trivial(masked_db, masked_primers):
+    # The masked primers have pairs of many amplicons and ties of PPC
+    amplicons = MFEprimer.check_primers(masked_primers, [masked_db], k_value=5, ppc=10)
+    assert len(per_pair(amplicons, 1)) < len(amplicons)
+    assert len(set([amp.ppc for amp in amplicons])) < len(amplicons)
@@ -0,0 +1,72 @@
+'''Tests of chilli/mer_index.py against a brute-force k-mer scan'''
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+from conftest import MFEHOME, write_fasta
+from chilli import chilli
+from chilli import mer_index
+
+COMPLEMENT = dict(zip('ACGTacgt', 'TGCAtgca'))
+
+def reverse_complement(seq):
+    return ''.join([COMPLEMENT[base] for base in reversed(seq)])
+
+def scan(records, k):
+    '''{mer_id : [(seq_id, pos), ...]} of both strands by brute force.
+
+    The plus positions are the 3' ends of the mers, the minus positions
+    are the starts of the mers on the plus strand.
+    '''
+    plus = {}
+    minus = {}
+    for (seq_id, (seq_name, seq)) in enumerate(records):
+        for i in xrange(len(seq) - k + 1):
+            mer = seq[i : (i+k)]
+            if 'N' in mer:
+                continue
+            plus.setdefault(chilli.DNA2int(mer), []).append((seq_id, i + k - 1))
+            minus.setdefault(chilli.DNA2int(reverse_complement(mer)), []).append((seq_id, i))
+
+    return plus, minus
+
+def pairs(hits):
+    return sorted(zip(hits[::2], hits[1::2]))
+
+def test_lookup(masked_db, masked_records):
+    index = mer_index.MerIndex(mer_index.index_name(masked_db))
+    assert index.k == 5
+    assert index.mer_count == 4**5
+
+    (plus, minus) = scan(masked_records, index.k)
+    for mer_id in xrange(index.mer_count):
+        (plus_hits, minus_hits) = index.lookup(mer_id)
+        assert pairs(plus_hits) == sorted(plus.get(mer_id, []))
+        assert pairs(minus_hits) == sorted(minus.get(mer_id, []))
+    index.close()
+
+def test_groups(masked_db, masked_records):
+    index = mer_index.MerIndex(mer_index.index_name(masked_db))
+    for (strand, expected) in enumerate(scan(masked_records, index.k)):
+        groups = list(index.groups(strand, chunk=100))
+        assert [mer_id for (mer_id, hits) in groups] == sorted(expected)
+        for (mer_id, hits) in groups:
+            pos_dict = mer_index.decode(hits)
+            assert sorted([(seq_id, pos) for seq_id in pos_dict for pos in pos_dict[seq_id]]) == sorted(expected[mer_id])
+    index.close()
+
+def test_threads(masked_db, masked_records, tmpdir):
+    # The workers return the hits in order, the index is the same
+    db = write_fasta(str(tmpdir.join('masked.fa')), masked_records)
+    subprocess.check_call([sys.executable, os.path.join(MFEHOME, 'chilli', 'UniFastaFormat.py'), '-i', db], stdout=open(os.devnull, 'w'))
+    subprocess.check_call([sys.executable, os.path.join(MFEHOME, 'chilli', 'mfe_index_db.py'), '-f', db + '.unifasta', '-k', '5', '-t', '2'], stdout=open(os.devnull, 'w'))
+    assert open(mer_index.index_name(db), 'rb').read() == open(mer_index.index_name(masked_db), 'rb').read()
+
+def test_not_an_index(tmpdir):
+    filename = tmpdir.join('db.idx')
+    filename.write('MFE')
+    with pytest.raises(ValueError):
+        mer_index.MerIndex(str(filename))
@@ -0,0 +1,48 @@
+'''Tests of --pairs and --cross_pairs, which must give the amplicons of
+the full check with the listed combinations of the primers'''
+
+import pytest
+
+import MFEprimer
+
+def rows(amplicons):
+    '''Lines of the tabular output without the AmpID'''
+    return [MFEprimer.tab_line(amp).split('\t', 1)[1] for amp in amplicons]
+
+def combined(amplicons, combinations):
+    '''The amplicons of the (forward primer, reverse primer) combinations'''
+    return [amp for amp in amplicons if (amp.fp_id, amp.rp_id) in combinations]
+
+@pytest.fixture
+def check(masked_db, masked_primers):
+    return lambda **params: MFEprimer.check_primers(masked_primers, [masked_db], k_value=5, ppc=10, **params)
+
+def test_pairs(check):
+    amplicons = check()
+    pairs = [('p0f', 'p0r'), ('p2f', 'p3r')]
+    combinations = set()
+    for (fp_id, rp_id) in pairs:
+        combinations.update([(fp_id, rp_id), (rp_id, fp_id), (fp_id, fp_id), (rp_id, rp_id)])
+    selected = check(pairs=pairs)
+    assert selected
+    assert len(selected) < len(amplicons)
+    assert rows(selected) == rows(combined(amplicons, combinations))
+
+def test_cross_pairs(check):
+    amplicons = check()
+    selected = check(cross_pairs=[('p2f', 'p3r'), ('p2r', 'p3r')])
+    assert rows(selected) == rows(combined(amplicons, set([('p2f', 'p3r'), ('p3r', 'p2f'), ('p2r', 'p3r'), ('p3r', 'p2r')])))
+    # Not the primers with themselves
+    assert selected
+    assert not [amp for amp in selected if amp.fp_id == amp.rp_id]
+
+def test_pairs_and_cross_pairs(check, tmpdir):
+    amplicons = check()
+    pair_file = tmpdir.join('pairs.txt')
+    pair_file.write('# fp\trp\np3f\tp0r\n')
+    cross_file = tmpdir.join('cross.txt')
+    cross_file.write('p3f\tp1r\n')
+    selected = check(pairs=str(pair_file), cross_pairs=str(cross_file))
+    combinations = set([('p3f', 'p0r'), ('p0r', 'p3f'), ('p3f', 'p3f'), ('p0r', 'p0r'), ('p3f', 'p1r'), ('p1r', 'p3f')])
+    assert selected
+    assert rows(selected) == rows(combined(amplicons, combinations))
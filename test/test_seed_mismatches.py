@@ -0,0 +1,37 @@
+'''Tests of --seed_mismatches, which must find the amplicons of the exact
+3' mers and more'''
+
+import pytest
+
+import MFEprimer
+from chilli import FastaFormatParser
+
+def rows(amplicons):
+    '''Lines of the tabular output without the AmpID'''
+    return set([MFEprimer.tab_line(amp).split('\t', 1)[1] for amp in amplicons])
+
+@pytest.mark.parametrize('protect', [1, 2, 4])
+def test_superset(masked_db, masked_primers, protect):
+    exact = rows(MFEprimer.check_primers(masked_primers, [masked_db], k_value=5, ppc=10))
+    seed = rows(MFEprimer.check_primers(masked_primers, [masked_db], k_value=5, ppc=10, seed_mismatches=1, seed_protect=protect))
+    assert exact <= seed
+
+def test_superset_rna(rna_db, primers):
+    exact = rows(MFEprimer.check_primers(primers, [rna_db]))
+    seed = rows(MFEprimer.check_primers(primers, [rna_db], seed_mismatches=1))
+    assert exact <= seed
+
+def test_mismatched_seed(rna_db, primers):
+    # A G-T mismatch at the 7th base from the 3' end of the forward primer
+    [(fp_id, fp_seq), (rp_id, rp_seq)] = [(oligo['id'], oligo['seq'].upper()) for oligo in FastaFormatParser.parse(primers.splitlines())[:2]]
+    assert fp_seq[-7] == 'T'
+    pair = [(fp_id, fp_seq[:-7] + 'G' + fp_seq[-6:]), (rp_id, rp_seq)]
+
+    exact = rows(MFEprimer.check_primers(pair, [rna_db]))
+    seed = rows(MFEprimer.check_primers(pair, [rna_db], seed_mismatches=1))
+    assert not exact
+    assert len(seed) == 1
+
+    # The mismatch is in the protected bases
+    assert not MFEprimer.check_primers(pair, [rna_db], seed_mismatches=1, seed_protect=7)
+    assert MFEprimer.check_primers(pair, [rna_db], seed_mismatches=1, seed_protect=6)
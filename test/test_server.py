@@ -0,0 +1,73 @@
+'''Tests of MFEprimerServer.check()'''
+
+import os
+
+import pytest
+
+import MFEprimer
+import MFEprimerServer
+
+@pytest.fixture
+def server_db(rna_db):
+    MFEprimer.load_databases([rna_db])
+    return rna_db
+
+def test_check(server_db, primers):
+    (ok, output) = MFEprimerServer.check({'args' : ['-d', server_db, '--tab'], 'primers' : primers})
+    assert ok
+    assert output.startswith('AmpID\t')
+
+@pytest.mark.parametrize('args', [
+    ['-o', '%(target)s'],
+    ['--outfile', '%(target)s'],
+    ['--outfile=%(target)s'],
+    ['--outf', '%(target)s'],
+    ['--o', '%(target)s'],
+    ['-o%(target)s'],
+    ['-o=%(target)s'],
+    ['--stats_json', '%(target)s'],
+    ['--stats_j', '%(target)s'],
+    ['--stats_j=%(target)s'],
+    ['--amplicon'],
+    ['--amp'],
+    ['-i', '%(target)s'],
+    ['-i%(target)s'],
+    ['--inf', '%(target)s'],
+    ['--pairs', '%(target)s'],
+    ['--pai', '%(target)s'],
+    ['--cross_pairs', '%(target)s'],
+    ['--cross=%(target)s'],
+])
+def test_unsupported_options(server_db, primers, tmpdir, args):
+    target = tmpdir.join('victim.txt')
+    target.write('keep')
+    args = [arg % {'target' : str(target)} for arg in args]
+
+    (ok, output) = MFEprimerServer.check({'args' : ['-d', server_db] + args, 'primers' : primers})
+    assert not ok
+    assert 'not supported' in output
+    assert target.read() == 'keep'
+    assert not os.path.exists(str(target) + '.fa')
+
+def test_unsupported_options_string(server_db, primers, tmpdir):
+    target = tmpdir.join('stats.json')
+    (ok, output) = MFEprimerServer.check({'args' : '-d %s --stats_j %s' % (server_db, target), 'primers' : primers})
+    assert not ok
+    assert not target.check()
+
+def test_abbreviations_of_other_options(server_db, primers):
+    # --stats is also a prefix of --stats_json
+    (ok, output) = MFEprimerServer.check({'args' : ['-d', server_db, '--tab', '--stats', '--pp', '50'], 'primers' : primers})
+    assert ok
+
+def test_database_not_loaded(server_db, primers, tmpdir):
+    (ok, output) = MFEprimerServer.check({'args' : ['-d', str(tmpdir.join('other'))], 'primers' : primers})
+    assert not ok
+    assert 'not loaded' in output
+
+def test_pairs_file_not_read(server_db, primers, tmpdir):
+    secret = tmpdir.join('secret.txt')
+    secret.write('root:SECRET\n')
+    (ok, output) = MFEprimerServer.check({'args' : ['-d', server_db, '--pa', str(secret)], 'primers' : primers})
+    assert not ok
+    assert 'SECRET' not in output
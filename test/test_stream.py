@@ -0,0 +1,60 @@
+'''The streamed and the parallel outputs are the same as the serial one'''
+
+import os
+import sys
+import random
+import subprocess
+
+import pytest
+
+from conftest import MFEHOME, index_db, write_fasta
+
+COMPLEMENT = dict(zip('ACGT', 'TGCA'))
+
+@pytest.fixture(scope='module')
+def repeat_db(tmpdir_factory):
+    '''Copies of the same region in several sequences, so many amplicons
+    have the same PPC and size, and the primers of the region'''
+    tmpdir = tmpdir_factory.mktemp('repeat')
+    rand = random.Random(7)
+    region = ''.join([rand.choice('ACGT') for i in xrange(400)])
+    records = []
+    for n in xrange(8):
+        flank = ''.join([rand.choice('ACGT') for i in xrange(200 + 50 * n)])
+        records.append(('copy%s' % n, flank + region + flank[::-1]))
+    db = index_db(write_fasta(str(tmpdir.join('repeat.fa')), records))
+
+    primers = []
+    for (n, (start, stop)) in enumerate(((0, 300), (50, 390), (20, 250))):
+        primers.append(('p%s_f' % n, region[start : (start + 20)]))
+        primers.append(('p%s_r' % n, ''.join([COMPLEMENT[base] for base in reversed(region[(stop - 20) : stop])])))
+    primer_file = write_fasta(str(tmpdir.join('primers.fa')), primers)
+
+    return db, primer_file
+
+def run(repeat_db, tmpdir, *args):
+    (db, primer_file) = repeat_db
+    out_file = str(tmpdir.join('out.tab'))
+    subprocess.check_call([sys.executable, os.path.join(MFEHOME, 'MFEprimer.py'), '-i', primer_file, '-d', db, '-o', out_file] + list(args))
+    return open(out_file).read()
+
+@pytest.mark.parametrize('args', [
+    ['--tab', '-t', '3'],
+    ['--stream', 'tab'],
+    ['--stream', 'tab', '-t', '3'],
+    ['--stream', 'tab', '-t', '3', '--sort_buffer', '5'],
+])
+def test_same_output(repeat_db, tmpdir, args):
+    serial = run(repeat_db, tmpdir, '--tab')
+    # Many ties of PPC and size
+    assert len(serial.splitlines()) > 40
+    assert run(repeat_db, tmpdir, *args) == serial
+
+@pytest.mark.parametrize('limit', [
+    ['--max_hits', '10'],
+    ['--max_hits_per_pair', '3'],
+])
+def test_same_selection(repeat_db, tmpdir, limit):
+    serial = run(repeat_db, tmpdir, '--tab', *limit)
+    for args in (['--tab', '-t', '3'], ['--stream', 'tab', '-t', '3']):
+        assert run(repeat_db, tmpdir, *(args + limit)) == serial
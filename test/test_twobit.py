@@ -0,0 +1,56 @@
+'''Tests of chilli/twobit.py against the FASTA records'''
+
+import random
+
+import pytest
+
+from chilli import twobit
+
+@pytest.fixture
+def twobit_db(masked_db):
+    db = twobit.TwoBit(masked_db + '.2bit')
+    yield db
+    db.close()
+
+def test_fetch(twobit_db, masked_records):
+    # The records have N blocks and mask blocks
+    assert any(['N' in seq for (seq_name, seq) in masked_records])
+    assert any([seq.upper() != seq for (seq_name, seq) in masked_records])
+
+    for (seq_id, (seq_name, seq)) in enumerate(masked_records):
+        name = str(seq_id)
+        assert twobit_db.size(name) == len(seq)
+        assert twobit_db.fetch(name) == seq
+        for start in xrange(min(len(seq), 9)):
+            for end in xrange(start, len(seq) + 1, 7):
+                assert twobit_db.fetch(name, start, end) == seq[start:end]
+
+def test_fetch_out_of_range(twobit_db, masked_records):
+    size = len(masked_records[1][1])
+    for (start, end) in ((-1, 5), (0, size + 1), (5, 4)):
+        with pytest.raises(ValueError):
+            twobit_db.fetch('1', start, end)
+    with pytest.raises(KeyError):
+        twobit_db.fetch('missing')
+
+def test_fetch_ranges(twobit_db, masked_records):
+    seq = masked_records[2][1]
+    assert twobit_db.fetch_ranges(['2:10-70', ('2', 0, 3), '0']) == [seq[10:70], seq[0:3], masked_records[0][1]]
+
+@pytest.mark.parametrize('lower', [False, True])
+def test_fetch_spans(twobit_db, masked_records, lower):
+    rand = random.Random(2)
+    spans = []
+    for i in xrange(300):
+        seq_id = rand.randrange(1, len(masked_records))
+        size = len(masked_records[seq_id][1])
+        start = rand.randrange(size)
+        spans.append((str(seq_id), start, min(size, start + rand.randrange(1, 80))))
+
+    buffers = twobit_db.fetch_spans(spans, lower)
+    assert len(buffers) == len(spans)
+    for ((name, start, end), (seq, seq_start)) in zip(spans, buffers):
+        expected = masked_records[int(name)][1][start:end]
+        if lower:
+            expected = expected.lower()
+        assert seq[(start - seq_start) : (end - seq_start)] == expected